@@ -0,0 +1,236 @@
+"""
+User affinity across ML API instances.
+
+Forecasts, LSTM weights and compiled networks are cached per process, so
+every request of a user should reach the same instance. All instances share
+the peer list PEER_URLS and place it on a consistent-hash ring
+(HASH_RING_VNODES virtual nodes per peer); the owner of a user is the first
+peer clockwise from the hash of its user_id, so adding or removing a peer
+only moves the users of the arcs it takes or gives back.
+
+AffinityMiddleware finds the user_id of /api/predictions requests (path
+parameter or JSON body). A request for a user owned by another peer is
+either proxied there (AFFINITY_MODE=proxy) or answered with a 307 redirect
+to the owner (AFFINITY_MODE=redirect); 307 keeps the method and body.
+Forwarded requests carry X-ML-Forwarded and are always served where they
+land, so peers with different lists cannot loop. If the owner cannot be
+reached the request is served locally. Every response names the instance
+that served it in X-ML-Instance.
+"""
+import bisect
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.config import settings
+
+PREFIX = "/api/predictions/"
+FORWARDED_HEADER = "x-ml-forwarded"
+INSTANCE_HEADER = "x-ml-instance"
+OWNER_HEADER = "x-ml-owner"
+
+# Routes with the user in the path: /insights/{user_id}, /category/{user_id}/{category}, ...
+PATH_USER = re.compile(r"^/api/predictions/(?:insights|category|compare|backtest)/([^/]+)")
+
+# Headers not copied between the client and the owner (httpx also decodes
+# the owner's response, so its content-encoding no longer applies)
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+    "trailer", "transfer-encoding", "upgrade", "host", "content-length"
+}
+DECODED = {"content-encoding"}
+
+RING_SIZE = 2 ** 64
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def _normalize(url: str) -> str:
+    return url.strip().rstrip("/")
+
+
+class HashRing:
+    """Consistent-hash ring of peer URLs with virtual nodes"""
+
+    def __init__(self, nodes: List[str], vnodes: int):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._positions = [position for position, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        """Peer that owns key (None on an empty ring)"""
+        if not self._positions:
+            return None
+        index = bisect.bisect(self._positions, _hash(key)) % len(self._positions)
+        return self._owners[index]
+
+    def ownership(self) -> Dict[str, float]:
+        """Fraction of the hash space owned by each peer"""
+        shares = {node: 0 for node in self.nodes}
+        for index, position in enumerate(self._positions):
+            # Each point owns the arc that ends at it
+            previous = self._positions[index - 1] if index else self._positions[-1] - RING_SIZE
+            shares[self._owners[index]] += position - previous
+        return {node: round(share / RING_SIZE, 4) for node, share in shares.items()}
+
+
+class Affinity:
+    """This instance's view of the ring, plus forwarding counters"""
+
+    def __init__(self, instance_url: str, peer_urls: str, mode: str, vnodes: int):
+        self.instance = _normalize(instance_url)
+        peers = [_normalize(url) for url in peer_urls.split(",") if url.strip()]
+        self.ring = HashRing(peers, vnodes)
+        self.mode = mode
+        self.counters = {"local": 0, "forwarded_in": 0, "proxied": 0, "redirected": 0, "owner_unreachable": 0}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("proxy", "redirect") and self.instance in self.ring.nodes and len(self.ring.nodes) > 1
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=settings.PROXY_TIMEOUT)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def status(self, user_id: Optional[str] = None) -> Dict:
+        status = {
+            "instance": self.instance or None,
+            "mode": self.mode,
+            "enabled": self.enabled,
+            "peers": self.ring.nodes,
+            "ownership": self.ring.ownership(),
+            "requests": dict(self.counters)
+        }
+        if user_id is not None:
+            status["owner"] = self.ring.owner(user_id)
+        return status
+
+
+affinity = Affinity(settings.INSTANCE_URL, settings.PEER_URLS, settings.AFFINITY_MODE, settings.HASH_RING_VNODES)
+
+
+def user_of(path: str, body: bytes) -> Optional[str]:
+    """user_id of a predictions request, from the path or the JSON body"""
+    match = PATH_USER.match(path)
+    if match:
+        return match.group(1)
+    if not body:
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    user_id = payload.get("user_id") if isinstance(payload, dict) else None
+    return str(user_id) if user_id is not None else None
+
+
+class AffinityMiddleware:
+    """ASGI middleware that sends each user's requests to the owning instance"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not affinity.enabled or not scope["path"].startswith(PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        if FORWARDED_HEADER in headers:
+            affinity.counters["forwarded_in"] += 1
+            await self._serve(scope, receive, send)
+            return
+
+        # Buffer the body to read the user_id, then replay it to the route
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        user_id = user_of(scope["path"], body)
+        owner = affinity.ring.owner(user_id) if user_id else None
+        if owner is None or owner == affinity.instance:
+            await self._serve(scope, replay, send)
+            return
+
+        query = scope.get("query_string", b"").decode("latin-1")
+        url = owner + scope["path"] + (f"?{query}" if query else "")
+
+        if affinity.mode == "redirect":
+            affinity.counters["redirected"] += 1
+            await self._respond(send, 307, [
+                (b"location", url.encode("latin-1")),
+                (OWNER_HEADER.encode(), owner.encode("latin-1")),
+                (b"content-length", b"0")
+            ], b"")
+            return
+
+        try:
+            response = await affinity.client().request(
+                scope["method"],
+                url,
+                content=body,
+                headers={
+                    **{name: value for name, value in headers.items() if name not in HOP_BY_HOP},
+                    FORWARDED_HEADER: affinity.instance
+                }
+            )
+        except httpx.HTTPError as e:
+            # Availability over affinity: serve here if the owner is down
+            print(f"[AFFINITY] Owner {owner} unreachable ({type(e).__name__}), serving locally")
+            affinity.counters["owner_unreachable"] += 1
+            await self._serve(scope, replay, send)
+            return
+
+        affinity.counters["proxied"] += 1
+        response_headers = [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in response.headers.multi_items()
+            if name.lower() not in HOP_BY_HOP | DECODED
+        ]
+        response_headers.append((b"content-length", str(len(response.content)).encode()))
+        await self._respond(send, response.status_code, response_headers, response.content)
+
+    async def _serve(self, scope, receive, send):
+        """Run the request here, naming this instance in the response"""
+        affinity.counters["local"] += 1
+
+        async def send_with_instance(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (INSTANCE_HEADER.encode(), affinity.instance.encode("latin-1"))
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_instance)
+
+    @staticmethod
+    async def _respond(send, status: int, headers: List, body: bytes):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
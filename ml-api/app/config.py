@@ -7,6 +7,61 @@ class Settings(BaseSettings):
     NODE_API_URL: str = "http://localhost:5000"
     SECRET_KEY: str = "your-secret-key-change-this"
 
+    # Backtesting (rolling-origin model evaluation)
+    BACKTEST_MAX_WORKERS: int = 2
+    BACKTEST_HORIZON: int = 30
+    BACKTEST_FOLDS: int = 3
+
+    # CPU budget: TensorFlow threads per process (0 = TensorFlow default),
+    # concurrent LSTM trainings (slow lane) and cheap model work (fast lane)
+    TF_INTRA_OP_THREADS: int = 2
+    TF_INTER_OP_THREADS: int = 1
+    MAX_CONCURRENT_TRAININGS: int = 1
+    TRAINING_QUEUE_SIZE: int = 4
+    TRAINING_RETRY_AFTER: int = 30  # seconds, until the lane has timing data
+    FAST_LANE_WORKERS: int = 4
+    FAST_LANE_QUEUE: int = 64
+
+    # Startup warmup: run every predictor once on a synthetic series before /ready
+    WARMUP_ENABLED: bool = True
+    WARMUP_LSTM: bool = True  # also train a one-epoch LSTM (builds the TensorFlow graphs)
+
+    # LSTM memory: idle compiled networks kept for reuse, cap on the
+    # registered warm-start weights, tracemalloc frames for /debug/memory
+    # (0 = off, tracing slows allocations) and whether /debug/* is exposed
+    LSTM_MODEL_POOL_SIZE: int = 4
+    LSTM_REGISTRY_MAX_MB: int = 256
+    TRACEMALLOC_FRAMES: int = 0
+    DEBUG_ENDPOINTS: bool = False
+
+    # Batch retraining of every registered LSTM in grouped Keras models
+    LSTM_RETRAIN_INTERVAL_HOURS: int = 0  # 0 disables the background retrainer
+
+    # Streaming anomaly scoring: fold inserted expenses into the running
+    # stats from a change stream (needs a replica set; enable in one instance)
+    ANOMALY_STREAM_ENABLED: bool = False
+
+    # Forecast cache (forecasts computed once at the maximum horizon)
+    FORECAST_CACHE_SIZE: int = 1024  # entries (user/category/model)
+    FORECAST_CACHE_TTL: int = 3600  # seconds
+
+    # User affinity across instances: this instance's URL, every instance's
+    # URL (comma-separated, including this one) and what to do with requests
+    # for users owned by another instance ("off", "proxy" or "redirect")
+    INSTANCE_URL: str = ""
+    PEER_URLS: str = ""
+    AFFINITY_MODE: str = "off"
+    HASH_RING_VNODES: int = 512
+    PROXY_TIMEOUT: float = 300.0  # seconds (covers LSTM training on the owner)
+
+    # Materialized daily totals ("transactions" or "daily_totals")
+    TRANSACTIONS_SOURCE: str = "transactions"
+    # Read queries straight into Arrow columns when pymongoarrow is installed
+    ARROW_INGESTION: bool = True
+    # Background updater interval (0 disables it); only the instance holding
+    # the lease in daily_totals_state updates
+    DAILY_TOTALS_REFRESH_SECONDS: int = 0
+
     # Pydantic v2 settings config
     model_config = SettingsConfigDict(
         env_file=".env",
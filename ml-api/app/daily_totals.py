@@ -0,0 +1,315 @@
+"""
+Materialized daily totals of transactions.
+
+The `daily_totals` collection holds one document per (user, day, type,
+category, subcategory, paymentMethod) bucket with the summed amount and the
+number of transactions. Documents keep the field names of transactions
+(`user`, `date`, `type`, `category`, ..., `amount`), so code that reads
+transactions can read buckets with the same queries.
+
+Buckets are recomputed in MongoDB with an aggregation that ends in $merge
+(MongoDB 4.2+). The incremental updater only recomputes the (user, day)
+pairs touched by transactions inserted or updated since the last run, using
+an _id/updatedAt watermark kept in `daily_totals_state`. Edits are seen
+through updatedAt, which the Transaction model sets on save and on
+findOneAndUpdate/updateOne/updateMany. Deletes and the old day of a
+transaction moved to another date are not visible through the watermark:
+the model's delete and update hooks record those (user, day) pairs in
+`daily_totals_dirty`, and each update drains them. Writes that bypass the
+model (raw driver updates and deletes) are only picked up by a backfill:
+
+    python -m app.daily_totals --backfill [--user USER_ID]
+
+The background updater (DAILY_TOTALS_REFRESH_SECONDS > 0) may be enabled in
+every worker: each cycle it takes or renews a lease in `daily_totals_state`,
+and only the lease holder updates, so one instance runs the first backfill
+and the incremental updates at a time.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+COLLECTION = "daily_totals"
+STATE_COLLECTION = "daily_totals_state"
+# (user, day) pairs marked by the Transaction model on deletes and updates
+DIRTY_COLLECTION = "daily_totals_dirty"
+STATE_ID = "transactions"
+LEASE_ID = "updater_lease"
+
+# Update intervals a lease lasts without renewal (then another instance takes over)
+LEASE_INTERVALS = 3
+
+# Identifies this process as lease holder
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Days per recompute query (keeps the $or of day ranges small)
+DAYS_PER_BATCH = 200
+
+BUCKET_FIELDS = ["type", "category", "subcategory", "paymentMethod"]
+
+
+def _now() -> datetime:
+    """UTC now truncated to milliseconds (the precision BSON stores)"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def user_match(user_id) -> Dict:
+    """Transactions of one user (newer records use userId, older ones user)"""
+    return {"$or": [{"userId": user_id}, {"user": user_id}]}
+
+
+def bucket_pipeline(match: Dict, refreshed_at: datetime) -> List[Dict]:
+    """Aggregate the matched transactions into daily buckets and merge them"""
+    key_parts = [{"$ifNull": [{"$toString": "$_id.user"}, ""]}, "|", {
+        "$dateToString": {"format": "%Y-%m-%d", "date": "$_id.date"}
+    }]
+    for field in BUCKET_FIELDS:
+        key_parts += ["|", {"$ifNull": [f"$_id.{field}", ""]}]
+
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "user": {"$ifNull": ["$userId", "$user"]},
+                "date": {"$dateFromParts": {
+                    "year": {"$year": "$date"},
+                    "month": {"$month": "$date"},
+                    "day": {"$dayOfMonth": "$date"}
+                }},
+                **{field: f"${field}" for field in BUCKET_FIELDS}
+            },
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": {"$concat": key_parts},
+            "user": "$_id.user",
+            "date": "$_id.date",
+            **{field: f"$_id.{field}" for field in BUCKET_FIELDS},
+            "amount": 1,
+            "count": 1,
+            "updatedAt": {"$literal": refreshed_at}
+        }},
+        {"$merge": {
+            "into": COLLECTION,
+            "on": "_id",
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+
+async def ensure_indexes(db):
+    """Indexes used by readers of daily_totals"""
+    await db[COLLECTION].create_index([("user", 1), ("date", 1)])
+    await db[COLLECTION].create_index([("updatedAt", 1)])
+
+
+async def _current_watermark(db) -> Dict:
+    """Highest transaction _id and updatedAt currently stored"""
+    last = await db.transactions.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    updated = await db.transactions.find_one(
+        {"updatedAt": {"$ne": None}}, {"updatedAt": 1}, sort=[("updatedAt", -1)]
+    )
+    return {
+        "last_id": last["_id"] if last else None,
+        "updated_at": updated["updatedAt"] if updated else None
+    }
+
+
+async def _save_watermark(db, watermark: Dict):
+    await db[STATE_COLLECTION].update_one(
+        {"_id": STATE_ID},
+        {"$set": {**watermark, "refreshedAt": _now()}},
+        upsert=True
+    )
+
+
+async def backfill(db, user_id: Optional[str] = None) -> int:
+    """
+    Rebuild daily_totals from scratch, for every user or for one user.
+    Returns the number of buckets written.
+    """
+    await ensure_indexes(db)
+    refreshed_at = _now()
+
+    # Read the watermark first: anything written during the rebuild is
+    # picked up again by the next incremental update
+    watermark = await _current_watermark(db)
+
+    match = user_match(ObjectId(user_id)) if user_id else {}
+    await db.transactions.aggregate(bucket_pipeline(match, refreshed_at)).to_list(length=None)
+
+    # Buckets not rewritten by this run no longer have transactions
+    stale = {"updatedAt": {"$lt": refreshed_at}}
+    if user_id:
+        stale["user"] = ObjectId(user_id)
+    await db[COLLECTION].delete_many(stale)
+
+    # Days marked before the rebuild started are already up to date
+    dirty = {"markedAt": {"$lt": refreshed_at}}
+    if user_id:
+        dirty["user"] = ObjectId(user_id)
+    await db[DIRTY_COLLECTION].delete_many(dirty)
+
+    if user_id is None:
+        await _save_watermark(db, watermark)
+
+    written = await db[COLLECTION].count_documents(
+        {"updatedAt": refreshed_at, **({"user": ObjectId(user_id)} if user_id else {})}
+    )
+    print(f"[DAILY_TOTALS] Backfill wrote {written} buckets")
+    return written
+
+
+async def update(db) -> int:
+    """
+    Recompute the (user, day) buckets touched by transactions inserted or
+    updated since the last run, plus the days marked dirty by deletes and
+    date changes. Returns the number of days recomputed.
+    """
+    state = await db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+    if state is None:
+        print("[DAILY_TOTALS] No watermark yet, running a full backfill")
+        await backfill(db)
+        return -1
+
+    newer = []
+    if state.get("last_id") is not None:
+        newer.append({"_id": {"$gt": state["last_id"]}})
+    if state.get("updated_at") is not None:
+        newer.append({"updatedAt": {"$gt": state["updated_at"]}})
+    query = {"$or": newer} if newer else {}
+
+    watermark = {"last_id": state.get("last_id"), "updated_at": state.get("updated_at")}
+    touched: Dict[object, set] = {}
+
+    cursor = db.transactions.find(query, {"_id": 1, "user": 1, "userId": 1, "date": 1, "updatedAt": 1})
+    async for doc in cursor:
+        user = doc.get("userId") or doc.get("user")
+        if user is not None and doc.get("date") is not None:
+            day = doc["date"].replace(hour=0, minute=0, second=0, microsecond=0)
+            touched.setdefault(user, set()).add(day)
+
+        if watermark["last_id"] is None or doc["_id"] > watermark["last_id"]:
+            watermark["last_id"] = doc["_id"]
+        updated_at = doc.get("updatedAt")
+        if updated_at is not None and (watermark["updated_at"] is None or updated_at > watermark["updated_at"]):
+            watermark["updated_at"] = updated_at
+
+    dirty = await db[DIRTY_COLLECTION].find({}).to_list(length=None)
+    for doc in dirty:
+        if doc.get("user") is not None and doc.get("date") is not None:
+            touched.setdefault(doc["user"], set()).add(doc["date"])
+
+    days_recomputed = 0
+    for user, days in touched.items():
+        days = sorted(days)
+        for start in range(0, len(days), DAYS_PER_BATCH):
+            batch = days[start:start + DAYS_PER_BATCH]
+            await _recompute_days(db, user, batch)
+            days_recomputed += len(batch)
+
+    await _save_watermark(db, watermark)
+    if dirty:
+        # Keep the days marked again while they were being recomputed
+        await db[DIRTY_COLLECTION].delete_many({"$or": [
+            {"_id": doc["_id"], "markedAt": doc.get("markedAt")} for doc in dirty
+        ]})
+    if days_recomputed:
+        print(f"[DAILY_TOTALS] Recomputed {days_recomputed} user-days")
+    return days_recomputed
+
+
+async def _recompute_days(db, user, days: List[datetime]):
+    """Rewrite the buckets of some days of one user, then drop stale ones"""
+    refreshed_at = _now()
+    match = {"$and": [
+        user_match(user),
+        {"$or": [{"date": {"$gte": day, "$lt": day + timedelta(days=1)}} for day in days]}
+    ]}
+    await db.transactions.aggregate(bucket_pipeline(match, refreshed_at)).to_list(length=None)
+
+    # Buckets of these days that were not rewritten lost all their transactions
+    await db[COLLECTION].delete_many({
+        "user": user,
+        "date": {"$in": days},
+        "updatedAt": {"$lt": refreshed_at}
+    })
+
+
+async def acquire_lease(db, seconds: float) -> bool:
+    """Take the updater lease, or renew it if held by this process"""
+    now = _now()
+    try:
+        await db[STATE_COLLECTION].update_one(
+            {"_id": LEASE_ID, "$or": [{"owner": INSTANCE_ID}, {"expiresAt": {"$lt": now}}]},
+            {"$set": {"owner": INSTANCE_ID, "expiresAt": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The lease exists and another live instance holds it
+        return False
+    return True
+
+
+async def release_lease(db):
+    await db[STATE_COLLECTION].delete_one({"_id": LEASE_ID, "owner": INSTANCE_ID})
+
+
+async def run_updater(interval: int):
+    """Keep daily_totals current (background task started by the API)"""
+    db = get_database()
+    try:
+        await ensure_indexes(db)
+    except Exception as e:
+        print(f"[DAILY_TOTALS ERROR] Could not create indexes: {type(e).__name__}: {e}")
+
+    leader = False
+    try:
+        while True:
+            try:
+                holds_lease = await acquire_lease(db, interval * LEASE_INTERVALS)
+                if holds_lease != leader:
+                    leader = holds_lease
+                    print(f"[DAILY_TOTALS] {'Acquired' if leader else 'Lost'} the updater lease ({INSTANCE_ID})")
+                if leader:
+                    await update(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[DAILY_TOTALS ERROR] Update failed: {type(e).__name__}: {e}")
+            await asyncio.sleep(interval)
+    finally:
+        if leader:
+            # Let another instance take over without waiting for expiry
+            await asyncio.shield(release_lease(db))
+
+
+async def _main(args):
+    await connect_to_mongo()
+    try:
+        db = get_database()
+        if args.backfill:
+            await backfill(db, args.user)
+        else:
+            await update(db)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the daily_totals collection")
+    parser.add_argument("--backfill", action="store_true", help="rebuild from all transactions")
+    parser.add_argument("--user", help="only rebuild this user (with --backfill)")
+    asyncio.run(_main(parser.parse_args()))
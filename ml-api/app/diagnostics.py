@@ -0,0 +1,95 @@
+"""
+Memory diagnostics for /debug/memory.
+
+Reports the process RSS (current and peak), the top allocation sites
+recorded by tracemalloc (only when TRACEMALLOC_FRAMES > 0, since tracing
+slows every allocation down), the Keras models still alive and the sizes
+of the in-process caches: the compiled-network pool, the warm-start weight
+registry and the forecast cache.
+"""
+import gc
+import resource
+import sys
+import tracemalloc
+from typing import Dict, Optional
+
+from app.forecast_cache import forecast_cache
+from app.ml.lstm_predictor import TENSORFLOW_AVAILABLE, model_pool, registry_stats
+
+if TENSORFLOW_AVAILABLE:
+    from tensorflow import keras
+
+
+def start_tracing(frames: int):
+    """Start tracemalloc with this many frames per allocation (0 leaves it off)"""
+    if frames > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def _mb(size: Optional[int]) -> Optional[float]:
+    return round(size / 2 ** 20, 1) if size is not None else None
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size (Linux /proc), None where unavailable"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _top_allocations(top: int) -> Dict:
+    if not tracemalloc.is_tracing():
+        return {"enabled": False}
+
+    current, peak = tracemalloc.get_traced_memory()
+    statistics = tracemalloc.take_snapshot().statistics("lineno")[:top]
+    return {
+        "enabled": True,
+        "traced_mb": _mb(current),
+        "traced_peak_mb": _mb(peak),
+        "top": [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count
+            }
+            for stat in statistics
+        ]
+    }
+
+
+def _live_keras_models() -> Optional[int]:
+    if not TENSORFLOW_AVAILABLE:
+        return None
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, keras.Model))
+
+
+def memory_report(top: int = 10) -> Dict:
+    """Memory report (walks the heap, so it runs in a lane, not on the event loop)"""
+    registry = registry_stats()
+    return {
+        "rss_mb": _mb(rss_bytes()),
+        "peak_rss_mb": _mb(peak_rss_bytes()),
+        "tracemalloc": _top_allocations(top),
+        "keras_models": _live_keras_models(),
+        "caches": {
+            "model_pool": model_pool.stats(),
+            "lstm_registry": {
+                "entries": registry["entries"],
+                "mb": _mb(registry["bytes"]),
+                "max_mb": _mb(registry["max_bytes"])
+            },
+            "forecast_cache": forecast_cache.stats()
+        }
+    }
@@ -0,0 +1,131 @@
+"""
+Max-horizon forecast cache.
+
+Forecasts of every model are deterministic prefixes of each other: the
+first N days of a 365-day forecast are the N-day forecast (linear and ETS
+evaluate each day independently, the LSTM rollout repeats the same first N
+steps). So each user/category/model series is forecast once at
+MAX_DAYS_AHEAD, and every request is answered by slicing that forecast and
+recomputing the totals, average and trend on the slice.
+
+Entries are keyed by (scope, user, category, model) and remember a
+fingerprint of the transaction columns they were computed from; a request whose
+transactions differ recomputes the entry. Concurrent misses for the same key
+share one computation.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.models.schemas import MAX_DAYS_AHEAD
+from app.ml.linear_predictor import LinearPredictor
+from app.ml.lstm_predictor import LSTMPredictor
+from app.ml.ets_predictor import ETSPredictor
+
+# Trend rule of each model, applied again to the sliced forecast
+TREND_RULES = {
+    "linear": LinearPredictor._calculate_trend,
+    "ets": ETSPredictor._calculate_trend,
+    "lstm": LSTMPredictor._calculate_trend
+}
+
+
+def fingerprint(transactions: pd.DataFrame) -> str:
+    """Digest of the dates, amounts and categories a forecast is computed from"""
+    row_hashes = pd.util.hash_pandas_object(transactions[["date", "amount", "category"]], index=False)
+    return hashlib.blake2b(row_hashes.values.tobytes(), digest_size=16).hexdigest()
+
+
+def forecast_entry(result: Dict) -> Dict:
+    """Max-horizon predictor result plus its amounts as an array for slicing"""
+    return {
+        "result": result,
+        "amounts": np.array([p["predicted_amount"] for p in result["predictions"]], dtype=float)
+    }
+
+
+def slice_forecast(entry: Dict, days_ahead: int, model_type: str) -> Dict:
+    """The first days_ahead days of a cached forecast, in the predictor response shape"""
+    amounts = entry["amounts"][:days_ahead]
+    result = entry["result"]
+
+    return {
+        **result,
+        "predictions": result["predictions"][:days_ahead],
+        "total_predicted": float(amounts.sum()),
+        "avg_daily_spending": float(amounts.mean()) if len(amounts) else 0.0,
+        "trend": TREND_RULES[model_type](amounts)
+    }
+
+
+class ForecastCache:
+    """LRU of max-horizon forecasts with a time-to-live"""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._pending: Dict[Tuple, asyncio.Future] = {}
+
+    async def get_or_compute(
+        self,
+        key: Tuple,
+        digest: str,
+        compute: Callable[[], Awaitable[object]]
+    ) -> Tuple[object, bool]:
+        """
+        Cached value for key if it was computed from the same data, else the
+        result of compute(). Returns (value, cached).
+        """
+        # Only touched from the event loop thread, so no lock is needed
+        entry = self._entries.get(key)
+        if entry is not None and entry["digest"] == digest and entry["expires"] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"], True
+
+        pending = self._pending.get((key, digest))
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending), True
+
+        self.misses += 1
+        pending = asyncio.ensure_future(compute())
+        self._pending[(key, digest)] = pending
+        pending.add_done_callback(lambda future: self._store(key, digest, future))
+        # Shielded so a disconnecting client does not cancel a shared computation
+        return await asyncio.shield(pending), False
+
+    def _store(self, key: Tuple, digest: str, future: asyncio.Future):
+        self._pending.pop((key, digest), None)
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        self._entries[key] = {
+            "digest": digest,
+            "value": future.result(),
+            "expires": time.monotonic() + self.ttl
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "horizon": MAX_DAYS_AHEAD
+        }
+
+
+forecast_cache = ForecastCache(settings.FORECAST_CACHE_SIZE, settings.FORECAST_CACHE_TTL)
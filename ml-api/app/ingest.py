@@ -0,0 +1,147 @@
+"""
+Columnar transaction ingestion.
+
+Predictors only need the date, amount and category of each transaction, so
+queries are read straight into columns: date as timestamp[ms] (int64),
+amount as float64 and category as a dictionary-encoded (categorical) column.
+A count column holds the number of transactions per row: 1 for raw
+transactions, the bucket's count for daily_totals.
+
+When PyMongoArrow is installed the cursor's raw BSON batches are decoded
+into an Arrow table in C, with no Python object per document; the query
+runs on the synchronous collection behind the Motor one, in a worker
+thread. Otherwise the documents are fetched with a projection of those
+three fields and turned into the same columns once.
+
+get_user_transactions is the query every consumer uses (the prediction
+routes and the LSTM retrainer): one user's expenses, optionally of one
+category, from raw transactions or daily_totals.
+"""
+import asyncio
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+from app.config import settings
+from app.database import get_database
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pymongoarrow.api import Schema, find_arrow_all
+    PYMONGOARROW_AVAILABLE = True
+except ImportError:
+    PYMONGOARROW_AVAILABLE = False
+
+COLUMNS = ["date", "amount", "category", "count"]
+PROJECTION = {"_id": 0, **{column: 1 for column in COLUMNS}}
+
+if PYMONGOARROW_AVAILABLE:
+    ARROW_SCHEMA = Schema({
+        "date": pa.timestamp("ms"), "amount": pa.float64(), "category": pa.string(), "count": pa.int64()
+    })
+
+
+def empty_frame() -> pd.DataFrame:
+    """Transaction columns with no rows"""
+    return pd.DataFrame({
+        "date": pd.Series(dtype="datetime64[ms]"),
+        "amount": pd.Series(dtype=np.float64),
+        "category": pd.Series(dtype="category"),
+        "count": pd.Series(dtype=np.int64)
+    })
+
+
+def frame_from_arrow(table) -> pd.DataFrame:
+    """Transaction columns from an Arrow table (the timestamps are not copied)"""
+    table = table.set_column(
+        table.schema.get_field_index("category"),
+        "category",
+        table.column("category").dictionary_encode()
+    )
+    table = table.set_column(
+        table.schema.get_field_index("count"),
+        "count",
+        pc.fill_null(table.column("count"), 1)
+    )
+    return table.to_pandas()
+
+
+def frame_from_documents(documents) -> pd.DataFrame:
+    """Transaction columns from projected documents"""
+    if not documents:
+        return empty_frame()
+
+    df = pd.DataFrame(documents, columns=COLUMNS)
+    return df.assign(
+        date=pd.to_datetime(df["date"]).astype("datetime64[ms]"),
+        amount=df["amount"].astype(np.float64),
+        category=df["category"].astype("category"),
+        count=pd.to_numeric(df["count"]).fillna(1).astype(np.int64)
+    )
+
+
+async def load_transactions(collection, query: Dict, limit: Optional[int] = None) -> pd.DataFrame:
+    """Run query on a Motor collection, sorted by date, as transaction columns"""
+    if PYMONGOARROW_AVAILABLE and settings.ARROW_INGESTION:
+        table = await asyncio.to_thread(
+            find_arrow_all,
+            collection.delegate,
+            query,
+            schema=ARROW_SCHEMA,
+            sort=[("date", 1)],
+            limit=limit or 0
+        )
+        return frame_from_arrow(table)
+
+    cursor = collection.find(query, PROJECTION).sort("date", 1)
+    return frame_from_documents(await cursor.to_list(length=limit))
+
+async def get_user_transactions(user_id: str, category: str = None, source: str = None) -> pd.DataFrame:
+    """
+    Fetch user expenses from MongoDB as date/amount/category columns.
+
+    With source="daily_totals" (default: settings.TRANSACTIONS_SOURCE) the
+    pre-aggregated daily buckets are read instead of raw transactions; they
+    have the same user/type/category/date/amount fields, so the result feeds
+    the predictors unchanged with one row per bucket. The count column says
+    how many transactions each row stands for (see transaction_count).
+    """
+    source = source or settings.TRANSACTIONS_SOURCE
+    try:
+        print(f"[DB] Fetching {source} for user_id={user_id}, category={category}")
+        db = get_database()
+
+        if db is None:
+            print("[DB ERROR] Database connection is None!")
+            return empty_frame()
+
+        transactions_collection = db[source]
+
+        # Convert user_id string to ObjectId for MongoDB query
+        try:
+            user_object_id = ObjectId(user_id)
+            query = {"user": user_object_id, "type": "expense"}
+        except Exception as e:
+            print(f"[DB ERROR] Invalid ObjectId format for user_id={user_id}: {e}")
+            # Fallback: try as string in case some records use string
+            query = {"user": user_id, "type": "expense"}
+
+        if category:
+            query["category"] = category
+
+        print(f"[DB] Query: {query}")
+        # Buckets are compact (at most a few per day), so read the whole history
+        transactions = await load_transactions(
+            transactions_collection, query, limit=None if source == "daily_totals" else 1000
+        )
+        print(f"[DB] Retrieved {len(transactions)} transactions")
+
+        return transactions
+    except Exception as e:
+        print(f"[DB ERROR] Error fetching transactions: {type(e).__name__}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return empty_frame()
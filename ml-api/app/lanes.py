@@ -0,0 +1,99 @@
+"""
+Execution lanes for CPU-bound model work.
+
+Model code is synchronous and CPU-bound, so it must not run on the event
+loop. Each lane is a small thread pool with admission control: a request is
+admitted while fewer than `workers + queue_size` jobs are running or
+waiting, otherwise LaneFull is raised and the route answers 503 with a
+Retry-After hint. Cheap models (linear, ETS, simulations) use the fast lane;
+LSTM training uses the slow lane, whose worker count is the cap on
+concurrent trainings in this process.
+"""
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+from app.config import settings
+
+
+class LaneFull(Exception):
+    """Raised when a lane has no room for another job"""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"{lane} lane is full, retry in {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    """Bounded thread pool with a queue limit and a running job-time average"""
+
+    def __init__(self, name: str, workers: int, queue_size: int, default_retry_after: int):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.default_retry_after = default_retry_after
+        self.in_flight = 0
+        self.avg_seconds: Optional[float] = None
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-lane")
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the average job time"""
+        if self.avg_seconds is None:
+            return self.default_retry_after
+        waves = math.ceil((self.in_flight - self.workers + 1) / self.workers)
+        return max(1, math.ceil(self.avg_seconds * max(waves, 1)))
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run func(*args, **kwargs) in the lane, or raise LaneFull"""
+        # Admission happens on the event loop thread, so the counter needs no lock
+        if self.in_flight >= self.capacity:
+            raise LaneFull(self.name, self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        started = loop.time()
+        try:
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+            elapsed = loop.time() - started
+            self.avg_seconds = elapsed if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * elapsed
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "avg_seconds": round(self.avg_seconds, 3) if self.avg_seconds is not None else None
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+fast_lane = Lane(
+    "fast",
+    workers=settings.FAST_LANE_WORKERS,
+    queue_size=settings.FAST_LANE_QUEUE,
+    default_retry_after=1
+)
+slow_lane = Lane(
+    "slow",
+    workers=settings.MAX_CONCURRENT_TRAININGS,
+    queue_size=settings.TRAINING_QUEUE_SIZE,
+    default_retry_after=settings.TRAINING_RETRY_AFTER
+)
+
+
+def lane_for(model_type: str) -> Lane:
+    """Lane that runs predictions of the given model type"""
+    return slow_lane if model_type == "lstm" else fast_lane
+
+
+def shutdown_lanes():
+    """Shut down both lanes (called on application shutdown)"""
+    fast_lane.shutdown()
+    slow_lane.shutdown()
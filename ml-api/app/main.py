@@ -1,17 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
+import asyncio
+from typing import Optional
 import uvicorn
 from app.config import settings
 from app.database import connect_to_mongo, close_mongo_connection
 from app.routers import predictions
+from app.ml.backtest import shutdown_executor
+from app.ml.lstm_predictor import configure_threads, configure_memory
+from app.lanes import LaneFull, fast_lane, slow_lane, shutdown_lanes
+from app.forecast_cache import forecast_cache
+from app.daily_totals import run_updater
+from app.retrain import run_retrainer
+from app.spending_stats import run_consumer
+from app import warmup
+from app.diagnostics import memory_report, start_tracing
+from app.affinity import AffinityMiddleware, affinity
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    configure_threads(settings.TF_INTRA_OP_THREADS, settings.TF_INTER_OP_THREADS)
+    configure_memory(settings.LSTM_MODEL_POOL_SIZE, settings.LSTM_REGISTRY_MAX_MB)
+    start_tracing(settings.TRACEMALLOC_FRAMES)
     await connect_to_mongo()
+    tasks = []
+    if settings.WARMUP_ENABLED:
+        tasks.append(asyncio.create_task(warmup.warm_up()))
+    else:
+        warmup.mark_ready()
+    if settings.DAILY_TOTALS_REFRESH_SECONDS > 0:
+        tasks.append(asyncio.create_task(run_updater(settings.DAILY_TOTALS_REFRESH_SECONDS)))
+    if settings.LSTM_RETRAIN_INTERVAL_HOURS > 0:
+        tasks.append(asyncio.create_task(run_retrainer(settings.LSTM_RETRAIN_INTERVAL_HOURS)))
+    if settings.ANOMALY_STREAM_ENABLED:
+        tasks.append(asyncio.create_task(run_consumer()))
     yield
     # Shutdown
+    for task in tasks:
+        task.cancel()
+    shutdown_executor()
+    shutdown_lanes()
+    await affinity.close()
     await close_mongo_connection()
 
 app = FastAPI(
@@ -21,6 +53,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Send each user's prediction requests to the instance that owns the user
+# (added before CORS so CORS headers also wrap proxied and redirected responses)
+app.add_middleware(AffinityMiddleware)
+
 # CORS Configuration - Allow all origins for simplicity
 # In production, replace ["*"] with specific URLs
 app.add_middleware(
@@ -46,9 +82,32 @@ async def root():
 async def health_check():
     return {
         "status": "healthy",
-        "service": "ml-api"
+        "service": "ml-api",
+        "lanes": {"fast": fast_lane.stats(), "slow": slow_lane.stats()},
+        "forecast_cache": forecast_cache.stats()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """200 once the models are warmed up and MongoDB answers, 503 until then"""
+    readiness = await warmup.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["status"] == "ready" else 503)
+
+@app.get("/cluster")
+async def cluster_status(user_id: Optional[str] = None):
+    """Hash ring of the ML API instances: peers, ownership share, forwarding counters and a user's owner"""
+    return affinity.status(user_id)
+
+@app.get("/debug/memory")
+async def debug_memory(top: int = Query(default=10, ge=1, le=100)):
+    """RSS, tracemalloc top allocators, live Keras models and cache sizes"""
+    if not settings.DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    try:
+        return await fast_lane.run(memory_report, top)
+    except LaneFull as e:
+        raise predictions.lane_unavailable(e)
+
 if __name__ == "__main__":
     uvicorn.run(
         "app.main:app",
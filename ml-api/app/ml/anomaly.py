@@ -0,0 +1,87 @@
+import math
+from typing import Dict, Optional
+
+class AnomalyScorer:
+    """
+    Streaming anomaly scoring of expenses.
+
+    Every (user, category) keeps a small stats document: Welford running
+    mean/variance of all amounts, an exponentially weighted mean/variance of
+    recent amounts and a Welford profile per day of the week. Scoring and
+    updating touch a fixed number of fields, so each event costs O(1)
+    whatever the history length.
+    """
+
+    # Weight of the newest amount in the EWMA statistics
+    EWMA_ALPHA = 0.1
+    # Observations needed before a statistic is used for scoring
+    MIN_COUNT = 5
+    # z-score from which an expense is flagged
+    Z_THRESHOLD = 3.0
+    # Standard deviation floor, relative to the mean (steady amounts such as
+    # subscriptions would otherwise flag any small change)
+    MIN_STD_FRACTION = 0.1
+
+    @staticmethod
+    def empty_stats() -> Dict:
+        """Stats of a series with no observations"""
+        return {
+            "count": 0,
+            "mean": 0.0,
+            "m2": 0.0,
+            "ewma": 0.0,
+            "ewvar": 0.0,
+            "weekday": [{"count": 0, "mean": 0.0, "m2": 0.0} for _ in range(7)]
+        }
+
+    @staticmethod
+    def _welford(stats: Dict, amount: float):
+        stats["count"] += 1
+        delta = amount - stats["mean"]
+        stats["mean"] += delta / stats["count"]
+        stats["m2"] += delta * (amount - stats["mean"])
+
+    def update(self, stats: Dict, amount: float, weekday: int) -> Dict:
+        """Fold one amount into the stats (in place) and return them"""
+        if stats["count"] == 0:
+            stats["ewma"] = amount
+        else:
+            diff = amount - stats["ewma"]
+            increment = self.EWMA_ALPHA * diff
+            stats["ewma"] += increment
+            stats["ewvar"] = (1 - self.EWMA_ALPHA) * (stats["ewvar"] + diff * increment)
+
+        self._welford(stats, amount)
+        self._welford(stats["weekday"][weekday], amount)
+        return stats
+
+    def _z(self, amount: float, mean: float, variance: float) -> float:
+        std = max(math.sqrt(max(variance, 0.0)), self.MIN_STD_FRACTION * abs(mean), 1e-9)
+        return (amount - mean) / std
+
+    def score(self, stats: Dict, amount: float, weekday: int, threshold: Optional[float] = None) -> Dict:
+        """
+        Score an amount against the stats (before it is folded in). The
+        score is the largest of the z-scores against the overall, recent and
+        same-weekday amounts that have enough observations; only unusually
+        high expenses count as anomalies.
+        """
+        threshold = self.Z_THRESHOLD if threshold is None else threshold
+        z_scores = {}
+
+        if stats["count"] >= self.MIN_COUNT:
+            z_scores["overall"] = self._z(amount, stats["mean"], stats["m2"] / (stats["count"] - 1))
+            z_scores["recent"] = self._z(amount, stats["ewma"], stats["ewvar"])
+
+        day = stats["weekday"][weekday]
+        if day["count"] >= self.MIN_COUNT:
+            z_scores["weekday"] = self._z(amount, day["mean"], day["m2"] / (day["count"] - 1))
+
+        score = max(z_scores.values()) if z_scores else None
+        return {
+            "score": score,
+            "is_anomaly": score is not None and score >= threshold,
+            "z_scores": z_scores,
+            "expected_amount": stats["mean"] if stats["count"] else None,
+            "observations": stats["count"]
+        }
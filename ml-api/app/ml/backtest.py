@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import List, Dict, Optional, Tuple
+
+from app.ml.linear_predictor import LinearPredictor
+from app.ml.lstm_predictor import LSTMPredictor, TENSORFLOW_AVAILABLE, configure_threads
+from app.ml.ets_predictor import ETSPredictor
+
+# Lazily created pool shared by every backtest request of this worker
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def available_models() -> List[str]:
+    """Model types that can be evaluated in this environment"""
+    models = ["linear", "ets"]
+    if TENSORFLOW_AVAILABLE:
+        models.append("lstm")
+    return models
+
+
+def build_predictor(model_type: str):
+    """Create a fresh, untrained predictor for the given model type"""
+    if model_type == "lstm":
+        return LSTMPredictor(lookback=7)
+    if model_type == "ets":
+        return ETSPredictor()
+    return LinearPredictor()
+
+
+def get_executor(max_workers: int, tf_threads: Tuple[int, int] = (0, 0)) -> ProcessPoolExecutor:
+    """
+    Return the shared process pool, creating it on first use. Every worker
+    limits TensorFlow to tf_threads = (intra_op, inter_op) threads.
+    """
+    global _executor
+    if _executor is None:
+        # 'spawn' keeps TensorFlow state from leaking into forked children
+        _executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_threads,
+            initargs=tf_threads
+        )
+    return _executor
+
+
+def shutdown_executor():
+    """Shut down the shared process pool (called on application shutdown)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def daily_series(transactions: pd.DataFrame) -> pd.Series:
+    """Daily expense totals indexed by day, with missing days filled with 0"""
+    df = pd.DataFrame(transactions)
+    df['date'] = pd.to_datetime(df['date']).dt.normalize()
+    daily = df.groupby('date')['amount'].sum()
+    full_range = pd.date_range(daily.index.min(), daily.index.max(), freq='D')
+    return daily.reindex(full_range, fill_value=0.0)
+
+
+def rolling_origins(series: pd.Series, horizon: int, folds: int, min_train_days: int) -> List[pd.Timestamp]:
+    """
+    Cutoff dates for rolling-origin evaluation.
+
+    The last fold ends on the last observed day; earlier folds step back by
+    one horizon each, as long as enough history remains before the cutoff.
+    """
+    last_day = series.index.max()
+    first_day = series.index.min()
+    origins = []
+    for k in range(folds, 0, -1):
+        cutoff = last_day - timedelta(days=k * horizon)
+        if (cutoff - first_day).days + 1 >= min_train_days:
+            origins.append(cutoff)
+    return origins
+
+
+def forecast_errors(
+    actual: np.ndarray,
+    predicted: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray
+) -> Dict[str, float]:
+    """
+    Vectorized error metrics over a (folds, horizon) block of forecasts.
+
+    MAPE only considers days with non-zero actual spending, since most
+    daily expense series contain many empty days.
+    """
+    abs_err = np.abs(actual - predicted)
+    nonzero = actual != 0
+    mape = (
+        float(np.mean(abs_err[nonzero] / np.abs(actual[nonzero])) * 100)
+        if nonzero.any() else None
+    )
+    return {
+        "mae": float(abs_err.mean()),
+        "rmse": float(np.sqrt(np.mean(abs_err ** 2))),
+        "mape": mape,
+        "coverage": float(np.mean((actual >= lower) & (actual <= upper)))
+    }
+
+
+def evaluate_model(
+    transactions: pd.DataFrame,
+    model_type: str,
+    horizon: int,
+    folds: int
+) -> Dict:
+    """
+    Rolling-origin evaluation of one model on one series.
+
+    Runs inside a worker process, so it only takes and returns plain
+    picklable objects.
+    """
+    series = daily_series(transactions)
+    min_train_days = 8 if model_type == "lstm" else 2
+    origins = rolling_origins(series, horizon, folds, min_train_days)
+
+    if not origins:
+        return {"model_type": model_type, "folds": 0, "error": "Not enough history for backtesting"}
+
+    dates = pd.DatetimeIndex(transactions['date']).normalize()
+    shape = (len(origins), horizon)
+    actual = np.zeros(shape)
+    predicted = np.zeros(shape)
+    lower = np.zeros(shape)
+    upper = np.zeros(shape)
+
+    for i, cutoff in enumerate(origins):
+        in_train = dates <= cutoff
+        train = transactions[in_train]
+        window = pd.date_range(cutoff + timedelta(days=1), periods=horizon, freq='D')
+
+        # Predictors forecast from their last observed day, which may be
+        # before the cutoff, so ask for enough days to cover the window
+        gap = (cutoff - dates[in_train].max()).days
+        result = build_predictor(model_type).predict(train, horizon + gap)
+
+        points = pd.DataFrame(result["predictions"])
+        points.index = pd.to_datetime(points['date'])
+        points = points.reindex(window).fillna(0.0)
+
+        actual[i] = series.reindex(window, fill_value=0.0).values
+        predicted[i] = points['predicted_amount'].values
+        lower[i] = points['confidence_lower'].values
+        upper[i] = points['confidence_upper'].values
+
+    metrics = forecast_errors(actual, predicted, lower, upper)
+    metrics.update({"model_type": model_type, "folds": len(origins)})
+    return metrics
+
+
+def run_jobs(
+    executor: ProcessPoolExecutor,
+    series: Dict[Optional[str], pd.DataFrame],
+    jobs: List[Tuple[Optional[str], str]],
+    horizon: int,
+    folds: int
+) -> List:
+    """
+    Evaluate (category, model_type) jobs on the process pool and wait for
+    all of them; a failed job's exception is returned in its place.
+
+    Blocks until the whole backtest is done, so the API runs it as one
+    slow-lane job: a backtest holds a training slot while its processes
+    train, and a full lane turns new backtests away with a 503.
+    """
+    futures = [
+        executor.submit(evaluate_model, series[category], model_type, horizon, folds)
+        for category, model_type in jobs
+    ]
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
+
+
+def select_best_model(metrics: List[Dict]) -> Optional[str]:
+    """Pick the model with the lowest MAE among successful evaluations"""
+    valid = [m for m in metrics if m.get("folds") and m.get("mae") is not None]
+    if not valid:
+        return None
+    return min(valid, key=lambda m: m["mae"])["model_type"]
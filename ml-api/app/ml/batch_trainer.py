@@ -0,0 +1,408 @@
+"""
+Batch training of many single-series LSTMs in one Keras graph.
+
+Retraining every registered series with its own model.fit is dominated by
+per-call graph building and Python overhead. BatchLSTMTrainer stacks G
+independent copies of LSTMPredictor's network into one grouped model: every
+layer holds (G, ...) weight tensors and applies group g's weights to group
+g's inputs with batched matmuls, so groups share the graph but never
+parameters or gradients. All series of a group train together in a single
+fit over padded (batch, G, lookback, 1) batches, where a sample weight of 0
+masks the padding of series with fewer windows. Early stopping is tracked
+per group, series that stopped are dropped between rounds of epochs, and
+each group's best weights are split out and registered the same way
+LSTMPredictor.train registers them.
+
+A grouped fit pays a few seconds of graph tracing per round, so groups of
+fewer than MIN_GROUP_SIZE series are trained one by one with
+LSTMPredictor.fit on pooled networks instead, which is faster for them.
+"""
+import copy
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.ml.lstm_predictor import LSTMPredictor, TENSORFLOW_AVAILABLE, model_pool, register
+
+if TENSORFLOW_AVAILABLE:
+    import tensorflow as tf
+    from tensorflow import keras
+    from sklearn.preprocessing import MinMaxScaler
+
+    def _stacked(initializer, groups: int):
+        """Initializer drawing an independent tensor for every group"""
+        def initialize(shape, dtype=None):
+            return tf.stack([initializer(shape[1:], dtype=dtype) for _ in range(groups)])
+        return initialize
+
+    class GroupedLSTM(keras.layers.Layer):
+        """
+        G independent LSTM layers with relu activations (the math and weight
+        layout of keras.layers.LSTM: gates i, f, c, o)
+        """
+
+        def __init__(self, groups: int, units: int, return_sequences: bool = False, **kwargs):
+            super().__init__(**kwargs)
+            self.groups = groups
+            self.units = units
+            self.return_sequences = return_sequences
+
+        def build(self, input_shape):
+            features = input_shape[-1]
+            self.kernel = self.add_weight(
+                name="kernel",
+                shape=(self.groups, features, 4 * self.units),
+                initializer=_stacked(keras.initializers.GlorotUniform(), self.groups)
+            )
+            self.recurrent_kernel = self.add_weight(
+                name="recurrent_kernel",
+                shape=(self.groups, self.units, 4 * self.units),
+                initializer=_stacked(keras.initializers.Orthogonal(), self.groups)
+            )
+            self.bias = self.add_weight(
+                name="bias",
+                shape=(self.groups, 4 * self.units),
+                initializer=self._bias_initializer
+            )
+
+        def _bias_initializer(self, shape, dtype=None):
+            # Forget gates start at 1 (unit_forget_bias)
+            bias = np.zeros(shape, dtype=np.float32)
+            bias[:, self.units:2 * self.units] = 1.0
+            return tf.constant(bias, dtype=dtype)
+
+        def call(self, inputs):
+            # inputs: (batch, groups, steps, features)
+            state_shape = tf.stack([tf.shape(inputs)[0], self.groups, self.units])
+            h = tf.zeros(state_shape, dtype=inputs.dtype)
+            c = tf.zeros(state_shape, dtype=inputs.dtype)
+
+            outputs = []
+            for t in range(inputs.shape[2]):
+                z = (
+                    tf.einsum("bgf,gfk->bgk", inputs[:, :, t, :], self.kernel)
+                    + tf.einsum("bgu,guk->bgk", h, self.recurrent_kernel)
+                    + self.bias
+                )
+                i, f, g, o = tf.split(z, 4, axis=-1)
+                c = tf.sigmoid(f) * c + tf.sigmoid(i) * tf.nn.relu(g)
+                h = tf.sigmoid(o) * tf.nn.relu(c)
+                outputs.append(h)
+
+            return tf.stack(outputs, axis=2) if self.return_sequences else h
+
+    class GroupedDense(keras.layers.Layer):
+        """G independent Dense layers"""
+
+        def __init__(self, groups: int, units: int, activation=None, **kwargs):
+            super().__init__(**kwargs)
+            self.groups = groups
+            self.units = units
+            self.activation = keras.activations.get(activation)
+
+        def build(self, input_shape):
+            self.kernel = self.add_weight(
+                name="kernel",
+                shape=(self.groups, input_shape[-1], self.units),
+                initializer=_stacked(keras.initializers.GlorotUniform(), self.groups)
+            )
+            self.bias = self.add_weight(name="bias", shape=(self.groups, self.units), initializer="zeros")
+
+        def call(self, inputs):
+            return self.activation(tf.einsum("bgi,gio->bgo", inputs, self.kernel) + self.bias)
+
+    class GroupedNetwork(keras.Model):
+        """G copies of LSTMPredictor.build_model stacked along a group axis (keep both in sync)"""
+
+        def __init__(self, groups: int, outputs: int = 1, **kwargs):
+            super().__init__(**kwargs)
+            self.lstm_1 = GroupedLSTM(groups, 50, return_sequences=True)
+            self.dropout_1 = keras.layers.Dropout(0.2)
+            self.lstm_2 = GroupedLSTM(groups, 50)
+            self.dropout_2 = keras.layers.Dropout(0.2)
+            self.dense_1 = GroupedDense(groups, 25, activation="relu")
+            self.dense_2 = GroupedDense(groups, outputs)
+            self.groups = groups
+
+        def build(self, input_shape):
+            # Build the layers eagerly: left to Keras, the first call builds
+            # them while tracing, and every stacked initializer runs in the
+            # graph (seconds per network)
+            steps, features = input_shape[2], input_shape[3]
+            self.lstm_1.build((None, self.groups, steps, features))
+            self.lstm_2.build((None, self.groups, steps, self.lstm_1.units))
+            self.dense_1.build((None, self.groups, self.lstm_2.units))
+            self.dense_2.build((None, self.groups, self.dense_1.units))
+            self.built = True
+
+        def call(self, inputs, training=False):
+            x = self.dropout_1(self.lstm_1(inputs), training=training)
+            x = self.dropout_2(self.lstm_2(x), training=training)
+            return self.dense_2(self.dense_1(x))
+
+        @property
+        def group_variables(self) -> List:
+            """Variables in the order of a single model's get_weights()"""
+            return [
+                self.lstm_1.kernel, self.lstm_1.recurrent_kernel, self.lstm_1.bias,
+                self.lstm_2.kernel, self.lstm_2.recurrent_kernel, self.lstm_2.bias,
+                self.dense_1.kernel, self.dense_1.bias,
+                self.dense_2.kernel, self.dense_2.bias
+            ]
+
+        def group_weights(self, group: int) -> List[np.ndarray]:
+            """Weights of one group, loadable with set_weights into LSTMPredictor.build_model"""
+            return [np.array(v.numpy()[group]) for v in self.group_variables]
+
+        def set_group_weights(self, weights: Dict[int, List[np.ndarray]]):
+            """Load single-model weights into some groups"""
+            if not weights:
+                return
+            for i, variable in enumerate(self.group_variables):
+                values = variable.numpy()
+                for group, group_weights in weights.items():
+                    values[group] = group_weights[i]
+                variable.assign(values)
+
+    def group_errors(network, x: np.ndarray, y: np.ndarray, w: np.ndarray, chunk: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        """Masked MSE and MAE of every group over padded (samples, groups, ...) arrays"""
+        sq = np.zeros(w.shape[1])
+        ab = np.zeros(w.shape[1])
+        for start in range(0, len(x), chunk):
+            err = network(x[start:start + chunk], training=False).numpy() - y[start:start + chunk]
+            weight = w[start:start + chunk]
+            sq += np.sum(np.mean(err ** 2, axis=-1) * weight, axis=0)
+            ab += np.sum(np.mean(np.abs(err), axis=-1) * weight, axis=0)
+        count = np.maximum(w.sum(axis=0), 1)
+        return sq / count, ab / count
+
+    class GroupEarlyStopping(keras.callbacks.Callback):
+        """
+        EarlyStopping(restore_best_weights=True) tracked for every group on
+        its own. The per-group state arrays are updated in place, so they
+        carry over between rounds.
+        """
+
+        def __init__(self, x, y, w, state: Dict[str, np.ndarray], patience: int, min_delta: float = 1e-4):
+            super().__init__()
+            self.x, self.y, self.w = x, y, w
+            self.state = state
+            self.patience = patience
+            self.min_delta = min_delta
+            self.epochs_run = 0
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.epochs_run += 1
+            loss, _ = group_errors(self.model, self.x, self.y, self.w)
+            state = self.state
+            active = ~state["stopped"]
+            state["epochs"][active] += 1
+
+            improved = active & (loss < state["best"] - self.min_delta)
+            state["best"][improved] = loss[improved]
+            state["wait"][improved] = 0
+            state["wait"][active & ~improved] += 1
+            state["stopped"] |= state["wait"] >= self.patience
+
+            if improved.any():
+                for best, variable in zip(state["best_weights"], self.model.group_variables):
+                    best[improved] = variable.numpy()[improved]
+
+            if state["stopped"].all():
+                self.model.stop_training = True
+
+class BatchLSTMTrainer:
+    """Train many single-series LSTMs (LSTMPredictor's network) in a few grouped fits"""
+
+    # Series per grouped model (bounds memory), fewest series worth a grouped
+    # model, windows per batch and series, and epochs between dropping the
+    # series that stopped
+    GROUP_SIZE = 256
+    MIN_GROUP_SIZE = 12
+    BATCH_SIZE = 32
+    ROUND_EPOCHS = 10
+
+    def __init__(self, lookback: int = 7):
+        self.lookback = lookback
+
+    def train(self, series: Dict[str, np.ndarray]) -> Dict[str, Dict]:
+        """
+        Train one model per key on its (days x 1) daily amounts and register
+        the weights under that key. Returns the training info of every key.
+        """
+        if not TENSORFLOW_AVAILABLE:
+            raise RuntimeError("TensorFlow is not available. Cannot train LSTM models.")
+
+        results: Dict[str, Dict] = {}
+        jobs: Dict[bool, List[Dict]] = {False: [], True: []}
+
+        for key, amounts in series.items():
+            if len(amounts) < self.lookback + 1:
+                results[key] = {"error": f"Need at least {self.lookback + 1} days of data"}
+                continue
+
+            # Same warm-start rule and scaling as LSTMPredictor.fit
+            predictor = LSTMPredictor(self.lookback, model_key=key)
+            entry = predictor.warm_start_entry(amounts, None)
+            scaler = copy.deepcopy(entry["scaler"]) if entry is not None else MinMaxScaler().fit(amounts)
+            X, y = predictor.prepare_sequences(scaler.transform(amounts).astype(np.float32))
+            jobs[entry is not None].append({
+                "key": key, "amounts": amounts, "X": X, "y": y, "scaler": scaler, "entry": entry
+            })
+
+        # Warm and cold starts differ in learning rate and epochs, so they train
+        # apart; series of similar length share a group to limit padding.
+        # The grouped networks are released with Keras' session once done.
+        with model_pool.in_use():
+            for warm, items in jobs.items():
+                items.sort(key=lambda item: len(item["X"]))
+                for start in range(0, len(items), self.GROUP_SIZE):
+                    group = items[start:start + self.GROUP_SIZE]
+                    if len(group) < self.MIN_GROUP_SIZE:
+                        results.update(self._fit_each(group))
+                    else:
+                        results.update(self._fit_group(group, warm))
+
+        return results
+
+    def _fit_each(self, items: List[Dict]) -> Dict[str, Dict]:
+        """
+        Train a few series one by one (LSTMPredictor.fit registers each one).
+        A series whose fit fails gets {"error": ...} and the rest still train.
+        """
+        results = {}
+        for item in items:
+            predictor = LSTMPredictor(self.lookback, model_key=item["key"])
+            try:
+                results[item["key"]] = predictor.fit(item["amounts"])
+            except Exception as e:
+                print(f"[BATCH_TRAIN ERROR] {item['key']}: {type(e).__name__}: {e}")
+                results[item["key"]] = {"error": f"{type(e).__name__}: {e}"}
+            finally:
+                predictor.release()
+        return results
+
+    def _pad(self, parts: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Stack per-series (X, y) windows into (samples, groups, ...) arrays plus a 0/1 mask"""
+        n_max = max(len(X) for X, _ in parts)
+        x = np.zeros((n_max, len(parts), self.lookback, 1), dtype=np.float32)
+        y = np.zeros((n_max, len(parts), 1), dtype=np.float32)
+        w = np.zeros((n_max, len(parts)), dtype=np.float32)
+        for g, (X_g, y_g) in enumerate(parts):
+            x[:len(X_g), g] = X_g
+            y[:len(y_g), g] = y_g
+            w[:len(X_g), g] = 1.0
+        return x, y, w
+
+    def _network(self, items: List[Dict], x: np.ndarray, weights_key: str):
+        """Grouped network for some series, loaded with their weights_key weights where set"""
+        network = GroupedNetwork(len(items))
+        network(x[:1])
+        network.set_group_weights({
+            g: item[weights_key] for g, item in enumerate(items) if item.get(weights_key) is not None
+        })
+        return network
+
+    def _fit_group(self, items: List[Dict], warm: bool) -> Dict[str, Dict]:
+        """
+        Train a group of series in grouped models and register each one. If
+        the grouped fit fails, every series of the group gets {"error": ...}
+        and the other groups still train.
+        """
+        try:
+            return self._train_group(items, warm)
+        except Exception as e:
+            print(f"[BATCH_TRAIN ERROR] Group of {len(items)} series: {type(e).__name__}: {e}")
+            return {item["key"]: {"error": f"{type(e).__name__}: {e}"} for item in items}
+
+    def _train_group(self, items: List[Dict], warm: bool) -> Dict[str, Dict]:
+        """Grouped fit of _fit_group"""
+        started = time.perf_counter()
+
+        # Chronological split per series: the most recent windows validate
+        for item in items:
+            n_val = int(len(item["X"]) * LSTMPredictor.VALIDATION_SPLIT)
+            n_train = len(item["X"]) - n_val
+            item["train"] = (item["X"][:n_train], item["y"][:n_train])
+            # Without validation windows, monitor the training loss (like monitor='loss')
+            item["monitor"] = (item["X"][n_train:], item["y"][n_train:]) if n_val else item["train"]
+            item["has_val"] = n_val > 0
+            item["weights"] = item["entry"]["weights"] if warm else None
+            item["best"], item["wait"], item["epochs"], item["stopped"] = np.inf, 0, 0, False
+
+        max_epochs = LSTMPredictor.WARM_MAX_EPOCHS if warm else LSTMPredictor.MAX_EPOCHS
+        epochs_done = 0
+        active = items
+
+        # Train in rounds and drop the series that stopped after each one, so
+        # a few slow series do not keep the whole group training (the
+        # optimizer state restarts with each round)
+        while active and epochs_done < max_epochs:
+            x_train, y_train, w_train = self._pad([item["train"] for item in active])
+            x_mon, y_mon, w_mon = self._pad([item["monitor"] for item in active])
+
+            network = self._network(active, x_train, "weights")
+            network.compile(
+                optimizer=keras.optimizers.Adam(
+                    learning_rate=LSTMPredictor.WARM_LEARNING_RATE if warm else LSTMPredictor.LEARNING_RATE
+                ),
+                loss="mse"
+            )
+
+            state = {
+                name: np.array([item[name] for item in active])
+                for name in ("best", "wait", "epochs", "stopped")
+            }
+            state["best_weights"] = [v.numpy() for v in network.group_variables]
+            for g, item in enumerate(active):
+                for i, best in enumerate(item.get("best_weights") or []):
+                    state["best_weights"][i][g] = best
+
+            stopper = GroupEarlyStopping(x_mon, y_mon, w_mon, state, patience=LSTMPredictor.PATIENCE)
+            network.fit(
+                x_train,
+                y_train,
+                sample_weight=w_train,
+                batch_size=self.BATCH_SIZE,
+                epochs=min(self.ROUND_EPOCHS, max_epochs - epochs_done),
+                callbacks=[stopper],
+                shuffle=False,
+                verbose=0
+            )
+            epochs_done += stopper.epochs_run
+
+            for g, item in enumerate(active):
+                item["weights"] = network.group_weights(g)
+                item["best_weights"] = [np.array(best[g]) for best in state["best_weights"]]
+                for name in ("best", "wait", "epochs", "stopped"):
+                    item[name] = state[name][g]
+            active = [item for item in active if not item["stopped"]]
+
+        # Final errors with every series' best weights
+        x_train, y_train, w_train = self._pad([item["train"] for item in items])
+        loss, mae = group_errors(self._network(items, x_train, "best_weights"), x_train, y_train, w_train)
+        elapsed = time.perf_counter() - started
+        trained_at = datetime.now()
+
+        results = {}
+        for g, item in enumerate(items):
+            register(item["key"], {
+                "weights": item["best_weights"],
+                "scaler": item["scaler"],
+                "lookback": self.lookback,
+                "columns": None,
+                "trained_at": trained_at
+            })
+            results[item["key"]] = {
+                "loss": float(loss[g]),
+                "mae": float(mae[g]),
+                "val_loss": float(item["best"]) if item["has_val"] else None,
+                "epochs_trained": int(item["epochs"]),
+                "training_time": round(elapsed / len(items), 3),
+                "warm_start": warm
+            }
+
+        print(f"[BATCH_TRAIN] {len(items)} {'warm' if warm else 'cold'} series in {elapsed:.1f}s")
+        return results
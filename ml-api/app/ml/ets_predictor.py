@@ -0,0 +1,304 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import List, Dict, Tuple
+
+class ETSPredictor:
+    """
+    Holt-Winters exponential smoothing (additive damped trend, additive
+    weekly season) for expense prediction.
+
+    All the work is vectorized over series, so a whole user's categories
+    are fitted at once: the recursion runs once over the days, and every
+    step updates the states of all series and all candidate parameters
+    together.
+    """
+
+    # Candidate smoothing parameters, searched jointly for every series
+    ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5])
+    BETAS = np.array([0.0, 0.01, 0.05, 0.1])
+    GAMMAS = np.array([0.05, 0.1, 0.2, 0.3])
+
+    def __init__(self, season_length: int = 7, damping: float = 0.98):
+        self.season_length = season_length
+        self.damping = damping
+        self.is_trained = False
+
+    def prepare_data(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """Prepare transaction data as a daily series (missing days filled with 0)"""
+        if len(transactions) == 0:
+            return pd.DataFrame()
+
+        df = pd.DataFrame(transactions)
+        df['date'] = pd.to_datetime(df['date']).dt.normalize()
+
+        daily_expenses = df.groupby('date')['amount'].sum()
+        date_range = pd.date_range(
+            start=daily_expenses.index.min(),
+            end=daily_expenses.index.max(),
+            freq='D'
+        )
+        daily_expenses = daily_expenses.reindex(date_range, fill_value=0.0).reset_index()
+        daily_expenses.columns = ['date', 'amount']
+
+        return daily_expenses
+
+    @staticmethod
+    def prepare_matrix(groups: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """
+        Daily totals of several transaction groups as one (days x groups)
+        frame on a shared calendar, missing days filled with 0
+        """
+        frames = []
+        for key, transactions in groups.items():
+            df = pd.DataFrame(transactions, columns=['date', 'amount'])
+            df['date'] = pd.to_datetime(df['date']).dt.normalize()
+            frames.append(df.assign(key=key))
+
+        df = pd.concat(frames, ignore_index=True)
+        matrix = df.pivot_table(index='date', columns='key', values='amount', aggfunc='sum', fill_value=0.0)
+        date_range = pd.date_range(matrix.index.min(), matrix.index.max(), freq='D')
+        return matrix.reindex(date_range, fill_value=0.0)[list(groups.keys())]
+
+    def _initial_states(self, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Level, trend and seasonal indices estimated from the first seasons"""
+        m = self.season_length
+        n_series, n_days = Y.shape
+
+        if n_days >= 2 * m:
+            first = Y[:, :m].mean(axis=1)
+            second = Y[:, m:2 * m].mean(axis=1)
+            level = first
+            trend = (second - first) / m
+            season = Y[:, :m] - first[:, None]
+        else:
+            # Too short to estimate a season: plain damped Holt
+            level = Y[:, 0].astype(float)
+            trend = np.zeros(n_series)
+            season = np.zeros((n_series, m))
+
+        return level, trend, season
+
+    def _smooth(
+        self,
+        Y: np.ndarray,
+        alpha: np.ndarray,
+        beta: np.ndarray,
+        gamma: np.ndarray,
+        keep_errors: bool = False
+    ) -> Dict[str, np.ndarray]:
+        """
+        Run the Holt-Winters recursion for every series at once.
+
+        Parameters broadcast against the series axis, so (P, 1) grids give
+        (P, S) outputs and (S,) per-series parameters give (S,) outputs.
+        Returns the final states and the sum of squared one-step errors
+        (plus the errors themselves, after warmup, if keep_errors is set).
+        """
+        m = self.season_length
+        phi = self.damping
+        n_series, n_days = Y.shape
+
+        level0, trend0, season0 = self._initial_states(Y)
+        shape = np.broadcast_shapes(np.shape(alpha), (n_series,))
+
+        level = np.broadcast_to(level0, shape).copy()
+        trend = np.broadcast_to(trend0, shape).copy()
+        season = np.broadcast_to(season0, shape + (m,)).copy()
+        sse = np.zeros(shape)
+
+        # Errors of the first season only reflect the initialization
+        warmup = m if n_days >= 2 * m else 1
+        errors = np.zeros(shape + (n_days - warmup,)) if keep_errors else None
+
+        for t in range(n_days):
+            idx = t % m
+            y = Y[:, t]
+            s = season[..., idx]
+            damped_trend = phi * trend
+
+            if t >= warmup:
+                err = y - (level + damped_trend + s)
+                sse += err ** 2
+                if keep_errors:
+                    errors[..., t - warmup] = err
+
+            new_level = alpha * (y - s) + (1 - alpha) * (level + damped_trend)
+            trend = beta * (new_level - level) + (1 - beta) * damped_trend
+            season[..., idx] = gamma * (y - new_level) + (1 - gamma) * s
+            level = new_level
+
+        return {
+            "level": level,
+            "trend": trend,
+            "season": season,
+            "sse": sse,
+            "errors": errors,
+            "warmup": warmup,
+            "n_errors": max(n_days - warmup, 1)
+        }
+
+    def fit_many(self, Y: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Fit one model per row of a (series x days) matrix.
+
+        Every parameter combination is evaluated for every series in a single
+        pass; each series keeps the combination with the lowest one-step SSE.
+        """
+        Y = np.asarray(Y, dtype=float)
+        if Y.shape[1] < 2:
+            raise ValueError("Need at least 2 days of data to train the ETS model")
+
+        a, b, g = np.meshgrid(self.ALPHAS, self.BETAS, self.GAMMAS, indexing='ij')
+        grid = np.stack([a.ravel(), b.ravel(), g.ravel()], axis=1)
+
+        search = self._smooth(Y, grid[:, 0:1], grid[:, 1:2], grid[:, 2:3])
+        best = np.argmin(search["sse"], axis=0)
+
+        alpha, beta, gamma = grid[best, 0], grid[best, 1], grid[best, 2]
+        fitted = self._smooth(Y, alpha, beta, gamma, keep_errors=True)
+
+        scored = Y[:, fitted["warmup"]:]
+        sst = np.sum((scored - scored.mean(axis=1, keepdims=True)) ** 2, axis=1)
+        r2 = np.where(sst > 0, 1 - fitted["sse"] / np.maximum(sst, 1e-12), 0.0)
+
+        self.params_ = {
+            "alpha": alpha,
+            "beta": beta,
+            "gamma": gamma,
+            "level": fitted["level"],
+            "trend": fitted["trend"],
+            "season": fitted["season"],
+            "sigma": np.sqrt(fitted["sse"] / fitted["n_errors"]),
+            "residuals": fitted["errors"],
+            "r2": np.clip(r2, 0.0, 1.0),
+            "n_days": Y.shape[1]
+        }
+        self.is_trained = True
+        return self.params_
+
+    def forecast_many(self, days_ahead: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Point forecasts and 95% bands as (series x days_ahead) arrays"""
+        p = self.params_
+        h = np.arange(1, days_ahead + 1)
+
+        damped_steps = np.cumsum(self.damping ** h)
+        season_idx = (p["n_days"] + h - 1) % self.season_length
+
+        forecast = (
+            p["level"][:, None]
+            + damped_steps[None, :] * p["trend"][:, None]
+            + p["season"][:, season_idx]
+        )
+        forecast = np.maximum(forecast, 0)
+
+        # Error variance grows with the horizon as the level keeps absorbing shocks
+        spread = 1.96 * p["sigma"][:, None] * np.sqrt(1 + (h[None, :] - 1) * p["alpha"][:, None] ** 2)
+
+        return forecast, np.maximum(forecast - spread, 0), forecast + spread
+
+    def train(self, transactions: pd.DataFrame) -> Dict[str, float]:
+        """Train the ETS model on a single series"""
+        daily_expenses = self.prepare_data(transactions)
+        params = self.fit_many(daily_expenses['amount'].values[None, :])
+
+        return {
+            "alpha": float(params["alpha"][0]),
+            "beta": float(params["beta"][0]),
+            "gamma": float(params["gamma"][0]),
+            "r2_score": float(params["r2"][0])
+        }
+
+    def predict(
+        self,
+        transactions: pd.DataFrame,
+        days_ahead: int = 30
+    ) -> Dict:
+        """Make predictions for future expenses"""
+        daily_expenses = self.prepare_data(transactions)
+
+        if len(daily_expenses) == 0:
+            return self._empty_prediction(days_ahead)
+
+        self.fit_many(daily_expenses['amount'].values[None, :])
+        last_date = daily_expenses['date'].max()
+
+        return self._build_results(last_date, days_ahead)[0]
+
+    def predict_many(
+        self,
+        groups: Dict[str, pd.DataFrame],
+        days_ahead: int = 30
+    ) -> Dict[str, Dict]:
+        """Fit and forecast several transaction groups (e.g. categories) at once"""
+        matrix = self.prepare_matrix(groups)
+        self.fit_many(matrix.values.T)
+
+        results = self._build_results(matrix.index.max(), days_ahead)
+        return dict(zip(matrix.columns, results))
+
+    def _build_results(self, last_date: datetime, days_ahead: int) -> List[Dict]:
+        """Format the fitted forecasts in the common predictor response shape"""
+        forecast, lower, upper = self.forecast_many(days_ahead)
+        trends = self._calculate_trends(forecast)
+        dates = [
+            (last_date + timedelta(days=i + 1)).strftime("%Y-%m-%d")
+            for i in range(days_ahead)
+        ]
+
+        results = []
+        for k in range(forecast.shape[0]):
+            results.append({
+                "predictions": [
+                    {
+                        "date": date,
+                        "predicted_amount": float(pred),
+                        "confidence_lower": float(lo),
+                        "confidence_upper": float(hi)
+                    }
+                    for date, pred, lo, hi in zip(dates, forecast[k], lower[k], upper[k])
+                ],
+                "total_predicted": float(forecast[k].sum()),
+                "avg_daily_spending": float(forecast[k].mean()),
+                "trend": trends[k],
+                "accuracy_score": float(self.params_["r2"][k])
+            })
+        return results
+
+    @staticmethod
+    def _calculate_trend(predictions: np.ndarray) -> str:
+        """Calculate trend of a single forecast"""
+        return ETSPredictor._calculate_trends(np.asarray(predictions)[None, :])[0]
+
+    @staticmethod
+    def _calculate_trends(forecast: np.ndarray) -> List[str]:
+        """Calculate trend of every forecast row from its fitted slope"""
+        if forecast.shape[1] < 2:
+            return ["stable"] * forecast.shape[0]
+
+        x = np.arange(forecast.shape[1])
+        slopes = np.polyfit(x, forecast.T, 1)[0]
+
+        return [
+            "increasing" if slope > 0.1 else "decreasing" if slope < -0.1 else "stable"
+            for slope in slopes
+        ]
+
+    def _empty_prediction(self, days_ahead: int) -> Dict:
+        """Return empty prediction when no data available"""
+        today = datetime.now()
+        return {
+            "predictions": [
+                {
+                    "date": (today + timedelta(days=i)).strftime("%Y-%m-%d"),
+                    "predicted_amount": 0.0,
+                    "confidence_lower": 0.0,
+                    "confidence_upper": 0.0
+                }
+                for i in range(1, days_ahead + 1)
+            ],
+            "total_predicted": 0.0,
+            "avg_daily_spending": 0.0,
+            "trend": "stable",
+            "accuracy_score": 0.0
+        }
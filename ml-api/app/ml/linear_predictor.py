@@ -13,9 +13,9 @@ class LinearPredictor:
         self.scaler = StandardScaler()
         self.is_trained = False
 
-    def prepare_data(self, transactions: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+    def prepare_data(self, transactions: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
         """Prepare transaction data for training"""
-        if not transactions:
+        if len(transactions) == 0:
             return np.array([]), np.array([])
 
         # Convert to DataFrame
@@ -41,7 +41,7 @@ class LinearPredictor:
 
         return X, y
 
-    def train(self, transactions: List[Dict]) -> Dict[str, float]:
+    def train(self, transactions: pd.DataFrame) -> Dict[str, float]:
         """Train the linear regression model"""
         X, y = self.prepare_data(transactions)
 
@@ -66,7 +66,7 @@ class LinearPredictor:
 
     def predict(
         self,
-        transactions: List[Dict],
+        transactions: pd.DataFrame,
         days_ahead: int = 30
     ) -> Dict:
         """Make predictions for future expenses"""
@@ -126,7 +126,8 @@ class LinearPredictor:
             )) if len(X) > 1 else 0.0
         }
 
-    def _calculate_trend(self, predictions: np.ndarray) -> str:
+    @staticmethod
+    def _calculate_trend(predictions: np.ndarray) -> str:
         """Calculate trend from predictions"""
         if len(predictions) < 2:
             return "stable"
@@ -1,43 +1,139 @@
 import numpy as np
 import pandas as pd
+import copy
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import List, Dict, Tuple, Optional
+
+from app.ml.ets_predictor import ETSPredictor
+from app.ml.model_pool import ModelPool
 import warnings
 warnings.filterwarnings('ignore')
 
 try:
+    import tensorflow as tf
     from tensorflow import keras
     from tensorflow.keras.models import Sequential
     from tensorflow.keras.layers import LSTM, Dense, Dropout
+    from tensorflow.keras.callbacks import EarlyStopping
     from sklearn.preprocessing import MinMaxScaler
     TENSORFLOW_AVAILABLE = True
 except ImportError:
     TENSORFLOW_AVAILABLE = False
     print("TensorFlow not available. LSTM predictions will fall back to linear regression.")
 
+# Weights of the last model trained for each key (e.g. user/category), used
+# to warm-start the next training of the same series. Least recently used
+# entries are dropped once their weights exceed _registry_max_bytes.
+_registry: "OrderedDict[str, Dict]" = OrderedDict()
+_registry_lock = threading.Lock()
+_registry_bytes = 0
+_registry_max_bytes = 256 * 1024 * 1024
+
+# Compiled networks reused across trainings
+model_pool = ModelPool(max_idle=4)
+
+
+def configure_threads(intra_op: int, inter_op: int):
+    """
+    Limit TensorFlow's thread pools (0 keeps TensorFlow's default). Must run
+    before TensorFlow executes its first op in this process.
+    """
+    if not TENSORFLOW_AVAILABLE:
+        return
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError as e:
+        print(f"[TF] Could not set thread limits: {e}")
+
+
+def configure_memory(pool_size: int, registry_max_mb: int):
+    """Cap the idle compiled networks and the registered warm-start weights"""
+    global _registry_max_bytes
+    model_pool.max_idle = pool_size
+    _registry_max_bytes = registry_max_mb * 1024 * 1024
+
+
+def _entry_bytes(entry: Dict) -> int:
+    return sum(weights.nbytes for weights in entry["weights"])
+
+
+def get_registered(model_key: str) -> Optional[Dict]:
+    """Registered weights and scaler for a model key, if any"""
+    with _registry_lock:
+        entry = _registry.get(model_key)
+        if entry is not None:
+            _registry.move_to_end(model_key)
+        return entry
+
+
+def register(model_key: str, entry: Dict):
+    """Register the weights and scaler of a freshly trained model"""
+    global _registry_bytes
+    with _registry_lock:
+        previous = _registry.pop(model_key, None)
+        if previous is not None:
+            _registry_bytes -= _entry_bytes(previous)
+        _registry[model_key] = entry
+        _registry_bytes += _entry_bytes(entry)
+        while _registry_bytes > _registry_max_bytes and len(_registry) > 1:
+            _, evicted = _registry.popitem(last=False)
+            _registry_bytes -= _entry_bytes(evicted)
+
+
+def registered_keys() -> List[str]:
+    """Keys that currently have registered weights"""
+    with _registry_lock:
+        return list(_registry)
+
+
+def registry_stats() -> Dict:
+    with _registry_lock:
+        return {"entries": len(_registry), "bytes": _registry_bytes, "max_bytes": _registry_max_bytes}
+
+
 class LSTMPredictor:
     """LSTM model for time series expense prediction"""
 
-    def __init__(self, lookback: int = 7):
+    # Training schedule: cold starts train longer than warm-started fine-tuning
+    MAX_EPOCHS = 100
+    WARM_MAX_EPOCHS = 20
+    LEARNING_RATE = 1e-3
+    WARM_LEARNING_RATE = 3e-4
+    PATIENCE = 5
+    VALIDATION_SPLIT = 0.2
+
+    # Warm-start only while new data stays inside the registered scaling range
+    WARM_START_RANGE_TOLERANCE = 0.25
+
+    def __init__(self, lookback: int = 7, model_key: Optional[str] = None):
         self.lookback = lookback
+        self.model_key = model_key
         self.model = None
+        self._lease = None
         self.scaler = MinMaxScaler()
         self.is_trained = False
+        self.training_info = None
 
     def prepare_sequences(
         self,
         data: np.ndarray
     ) -> Tuple[np.ndarray, np.ndarray]:
-        """Prepare sequences for LSTM training"""
-        X, y = [], []
-        for i in range(len(data) - self.lookback):
-            X.append(data[i:i + self.lookback])
-            y.append(data[i + self.lookback])
-        return np.array(X), np.array(y)
-
-    def prepare_data(self, transactions: List[Dict]) -> pd.DataFrame:
+        """
+        Prepare sequences for LSTM training as zero-copy sliding windows over
+        a (days x series) array: X is (samples, lookback, series) and y is
+        (samples, series), both views on data
+        """
+        windows = sliding_window_view(data, self.lookback + 1, axis=0)
+        return windows[:, :, :-1].transpose(0, 2, 1), windows[:, :, -1]
+
+    def prepare_data(self, transactions: pd.DataFrame) -> pd.DataFrame:
         """Prepare transaction data for LSTM"""
-        if not transactions:
+        if len(transactions) == 0:
             return pd.DataFrame()
 
         df = pd.DataFrame(transactions)
@@ -69,12 +165,34 @@ class LSTMPredictor:
             LSTM(50, activation='relu'),
             Dropout(0.2),
             Dense(25, activation='relu'),
-            Dense(1)
+            Dense(input_shape[-1])
         ])
-        model.compile(optimizer='adam', loss='mse', metrics=['mae'])
         return model
 
-    def train(self, transactions: List[Dict]) -> Dict[str, float]:
+    def warm_start_entry(self, amounts: np.ndarray, columns: Optional[List[str]]) -> Optional[Dict]:
+        """Registered entry usable to warm-start training on these amounts"""
+        if self.model_key is None:
+            return None
+
+        entry = get_registered(self.model_key)
+        if entry is None or entry["lookback"] != self.lookback or entry.get("columns") != columns:
+            return None
+
+        data_min, data_max = entry["scaler"].data_min_, entry["scaler"].data_max_
+        margin = (data_max - data_min) * self.WARM_START_RANGE_TOLERANCE
+        if np.any(amounts.min(axis=0) < data_min - margin) or np.any(amounts.max(axis=0) > data_max + margin):
+            return None
+        return entry
+
+    def _dataset(self, X: np.ndarray, y: np.ndarray, batch_size: int):
+        """tf.data pipeline over the windows, batched and prefetched"""
+        return (
+            tf.data.Dataset.from_tensor_slices((X, y))
+            .batch(batch_size)
+            .prefetch(tf.data.AUTOTUNE)
+        )
+
+    def train(self, transactions: pd.DataFrame) -> Dict[str, float]:
         """Train the LSTM model"""
         if not TENSORFLOW_AVAILABLE:
             raise RuntimeError("TensorFlow is not available. Cannot train LSTM model.")
@@ -84,9 +202,27 @@ class LSTMPredictor:
         if len(daily_expenses) < self.lookback + 1:
             raise ValueError(f"Need at least {self.lookback + 1} days of data to train LSTM model")
 
-        # Scale data
-        amounts = daily_expenses['amount'].values.reshape(-1, 1)
-        amounts_scaled = self.scaler.fit_transform(amounts)
+        return self.fit(daily_expenses['amount'].values.reshape(-1, 1))
+
+    def fit(self, amounts: np.ndarray, columns: Optional[List[str]] = None) -> Dict[str, float]:
+        """
+        Train on a (days x series) matrix of daily amounts. Each series is
+        scaled on its own and the network predicts the next day of all of
+        them at once; columns names the series (None for a single series).
+        """
+        if len(amounts) < self.lookback + 1:
+            raise ValueError(f"Need at least {self.lookback + 1} days of data to train LSTM model")
+
+        started = time.perf_counter()
+
+        # Warm start: reuse the registered scaler (so the weights still apply)
+        # and fine-tune from the registered weights
+        entry = self.warm_start_entry(amounts, columns)
+        if entry is not None:
+            self.scaler = copy.deepcopy(entry["scaler"])
+        else:
+            self.scaler.fit(amounts)
+        amounts_scaled = self.scaler.transform(amounts).astype(np.float32)
 
         # Prepare sequences
         X, y = self.prepare_sequences(amounts_scaled)
@@ -94,108 +230,182 @@ class LSTMPredictor:
         if len(X) == 0:
             raise ValueError("Not enough data to create sequences")
 
-        # Reshape for LSTM
-        X = X.reshape((X.shape[0], X.shape[1], 1))
+        # Chronological split: the most recent windows validate
+        n_val = int(len(X) * self.VALIDATION_SPLIT)
+        n_train = len(X) - n_val
+        batch_size = int(np.clip(n_train // 16, 8, 64))
 
-        # Build and train model
-        self.model = self.build_model((X.shape[1], 1))
+        train_data = self._dataset(X[:n_train], y[:n_train], batch_size)
+        val_data = self._dataset(X[n_train:], y[n_train:], batch_size) if n_val else None
+
+        # Lease a compiled network and load the warm-start or initial weights
+        self._acquire((self.lookback, amounts.shape[1]))
+        self._lease.reset(
+            entry["weights"] if entry is not None else self._lease.initial_weights,
+            self.WARM_LEARNING_RATE if entry is not None else self.LEARNING_RATE
+        )
 
-        # Train with early stopping to prevent overfitting
+        # Stop once validation loss stops improving and keep the best epoch
+        early_stopping = EarlyStopping(
+            monitor='val_loss' if n_val else 'loss',
+            patience=self.PATIENCE,
+            min_delta=1e-4,
+            restore_best_weights=True
+        )
         history = self.model.fit(
-            X, y,
-            epochs=50,
-            batch_size=8,
-            validation_split=0.2,
-            verbose=0,
-            shuffle=False
+            train_data,
+            validation_data=val_data,
+            epochs=self.WARM_MAX_EPOCHS if entry is not None else self.MAX_EPOCHS,
+            callbacks=[early_stopping],
+            verbose=0
         )
 
         self.is_trained = True
+        if self.model_key is not None:
+            register(self.model_key, {
+                "weights": self.model.get_weights(),
+                "scaler": copy.deepcopy(self.scaler),
+                "lookback": self.lookback,
+                "columns": columns,
+                "trained_at": datetime.now()
+            })
 
         # Calculate final loss
         final_loss = history.history['loss'][-1]
         final_mae = history.history['mae'][-1]
+        val_loss = history.history.get('val_loss')
 
-        return {
+        self.training_info = {
             "loss": float(final_loss),
             "mae": float(final_mae),
-            "epochs_trained": len(history.history['loss'])
+            "val_loss": float(min(val_loss)) if val_loss else None,
+            "epochs_trained": len(history.history['loss']),
+            "training_time": round(time.perf_counter() - started, 3),
+            "warm_start": entry is not None
         }
+        return self.training_info
+
+    def _compiled_model(self, input_shape: Tuple) -> Sequential:
+        model = self.build_model(input_shape)
+        model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=self.LEARNING_RATE),
+            loss='mse',
+            metrics=['mae']
+        )
+        return model
+
+    def _acquire(self, input_shape: Tuple):
+        """Lease a compiled network for this input shape from the model pool"""
+        if self._lease is not None and self._lease.key != input_shape:
+            self.release()
+        if self._lease is None:
+            self._lease = model_pool.acquire(input_shape, lambda: self._compiled_model(input_shape))
+        self.model = self._lease.model
+
+    def release(self):
+        """Give the network back to the model pool (predict does this once it has forecast)"""
+        if self._lease is not None:
+            model_pool.release(self._lease)
+        self._lease = None
+        self.model = None
+        self.is_trained = False
 
     def predict(
         self,
-        transactions: List[Dict],
+        transactions: pd.DataFrame,
         days_ahead: int = 30
     ) -> Dict:
         """Make predictions for future expenses"""
         if not TENSORFLOW_AVAILABLE:
             raise RuntimeError("TensorFlow is not available. Cannot make LSTM predictions.")
 
-        if not self.is_trained:
-            self.train(transactions)
+        try:
+            if not self.is_trained:
+                self.train(transactions)
 
-        daily_expenses = self.prepare_data(transactions)
+            daily_expenses = self.prepare_data(transactions)
 
-        if len(daily_expenses) < self.lookback:
-            return self._empty_prediction(days_ahead)
+            if len(daily_expenses) < self.lookback:
+                return self._empty_prediction(days_ahead)
 
-        # Get last lookback days
-        amounts = daily_expenses['amount'].values.reshape(-1, 1)
-        amounts_scaled = self.scaler.transform(amounts)
-        last_sequence = amounts_scaled[-self.lookback:]
-
-        # Make predictions
-        predictions = []
-        current_sequence = last_sequence.copy()
+            amounts = daily_expenses['amount'].values.reshape(-1, 1)
+            return self._forecast(amounts, daily_expenses['date'].max(), days_ahead)[0]
+        finally:
+            self.release()
 
-        for _ in range(days_ahead):
-            # Reshape for prediction
-            current_input = current_sequence.reshape((1, self.lookback, 1))
+    def predict_many(
+        self,
+        groups: Dict[str, pd.DataFrame],
+        days_ahead: int = 30
+    ) -> Dict[str, Dict]:
+        """
+        Train one network on the daily (days x groups) matrix of several
+        transaction groups (e.g. categories) and forecast all of them in a
+        single rollout
+        """
+        if not TENSORFLOW_AVAILABLE:
+            raise RuntimeError("TensorFlow is not available. Cannot make LSTM predictions.")
 
-            # Predict next value
-            next_pred = self.model.predict(current_input, verbose=0)[0][0]
-            predictions.append(next_pred)
+        matrix = ETSPredictor.prepare_matrix(groups)
+        amounts = matrix.values.astype(float)
+        try:
+            self.fit(amounts, columns=list(matrix.columns))
+            results = self._forecast(amounts, matrix.index.max(), days_ahead)
+        finally:
+            self.release()
+        return dict(zip(matrix.columns, results))
+
+    def _forecast(self, amounts: np.ndarray, last_date: datetime, days_ahead: int) -> List[Dict]:
+        """Forecast every column of a (days x series) matrix with the trained network"""
+        # Get last lookback days
+        last_sequence = self.scaler.transform(amounts[-self.lookback:])
 
-            # Update sequence (shift and add new prediction)
-            current_sequence = np.append(current_sequence[1:], [[next_pred]], axis=0)
+        # Make predictions (each one is fed back as the next input)
+        predictions = self._rollout(last_sequence, days_ahead)
 
         # Inverse transform predictions
-        predictions = np.array(predictions).reshape(-1, 1)
         predictions = self.scaler.inverse_transform(predictions)
-        predictions = np.maximum(predictions.flatten(), 0)  # Ensure non-negative
+        predictions = np.maximum(predictions, 0)  # Ensure non-negative
 
         # Calculate confidence intervals using historical variance
-        residuals = amounts[-len(amounts)//2:].flatten() - amounts[-len(amounts)//2:].flatten().mean()
-        std_error = np.std(residuals)
-
-        # Prepare response
-        last_date = daily_expenses['date'].max()
-        prediction_points = []
-
-        for i, pred in enumerate(predictions):
-            pred_date = last_date + timedelta(days=i + 1)
-            prediction_points.append({
-                "date": pred_date.strftime("%Y-%m-%d"),
-                "predicted_amount": float(pred),
-                "confidence_lower": float(max(0, pred - 1.96 * std_error)),
-                "confidence_upper": float(pred + 1.96 * std_error)
-            })
-
-        # Calculate trend
-        trend = self._calculate_trend(predictions)
+        recent = amounts[-len(amounts)//2:]
+        std_error = np.std(recent - recent.mean(axis=0), axis=0)
 
         # Calculate accuracy (using MAE from last training)
-        accuracy = 1.0 - min(1.0, std_error / (np.mean(amounts) + 1e-8))
+        accuracy = 1.0 - np.minimum(1.0, std_error / (np.mean(amounts, axis=0) + 1e-8))
+
+        dates = [
+            (last_date + timedelta(days=i + 1)).strftime("%Y-%m-%d")
+            for i in range(days_ahead)
+        ]
+
+        results = []
+        for k in range(amounts.shape[1]):
+            series = predictions[:, k]
+            results.append({
+                "predictions": [
+                    {
+                        "date": date,
+                        "predicted_amount": float(pred),
+                        "confidence_lower": float(max(0, pred - 1.96 * std_error[k])),
+                        "confidence_upper": float(pred + 1.96 * std_error[k])
+                    }
+                    for date, pred in zip(dates, series)
+                ],
+                "total_predicted": float(np.sum(series)),
+                "avg_daily_spending": float(np.mean(series)),
+                "trend": self._calculate_trend(series),
+                "accuracy_score": float(max(0.0, accuracy[k])),
+                "training": self.training_info
+            })
+        return results
 
-        return {
-            "predictions": prediction_points,
-            "total_predicted": float(np.sum(predictions)),
-            "avg_daily_spending": float(np.mean(predictions)),
-            "trend": trend,
-            "accuracy_score": float(max(0.0, accuracy))
-        }
+    def _rollout(self, sequence: np.ndarray, steps: int) -> np.ndarray:
+        """Recursive multi-step forecast with the leased network's compiled rollout"""
+        return self._lease.rollout(sequence, steps)
 
-    def _calculate_trend(self, predictions: np.ndarray) -> str:
+    @staticmethod
+    def _calculate_trend(predictions: np.ndarray) -> str:
         """Calculate trend from predictions"""
         if len(predictions) < 2:
             return "stable"
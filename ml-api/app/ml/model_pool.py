@@ -0,0 +1,152 @@
+"""
+Pool of compiled LSTM networks.
+
+Building and compiling a Keras model per request costs seconds of graph
+tracing and leaves TensorFlow state behind, so a long-running worker's RSS
+keeps growing. Instead, LSTMPredictor leases a compiled network of the
+right architecture (lookback, number of series) from this pool, loads the
+weights it needs (fresh initial weights or registered warm-start weights),
+resets the optimizer and gives it back when the forecast is done. Reused
+networks keep their traced training and rollout functions.
+
+At most max_idle networks wait in the pool; the least recently used ones
+are dropped beyond that, and once no network is leased Keras' global state
+is cleared (keras.backend.clear_session) so dropped models are released.
+"""
+import gc
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+try:
+    import tensorflow as tf
+    from tensorflow import keras
+    TENSORFLOW_AVAILABLE = True
+except ImportError:
+    TENSORFLOW_AVAILABLE = False
+
+
+class PooledModel:
+    """A compiled network, its initial weights and its compiled rollout"""
+
+    def __init__(self, key: Tuple, model):
+        self.key = key
+        self.model = model
+        self.initial_weights = model.get_weights()
+        self._rollout = None
+
+    def reset(self, weights: List[np.ndarray], learning_rate: float):
+        """Load weights and start the optimizer from scratch at learning_rate"""
+        self.model.set_weights(weights)
+        for variable in self.model.optimizer.variables:
+            if "learning_rate" not in variable.name:
+                variable.assign(tf.zeros_like(variable))
+        self.model.optimizer.learning_rate = learning_rate
+
+    def rollout(self, sequence: np.ndarray, steps: int) -> np.ndarray:
+        """
+        Recursive multi-step forecast, run as one compiled TensorFlow loop
+        (calling the model eagerly costs tens of milliseconds per step).
+        Traced once per network: the step count is a tensor argument.
+        """
+        if self._rollout is None:
+            model = self.model
+
+            @tf.function
+            def run(window, steps):
+                outputs = tf.TensorArray(tf.float32, size=steps)
+                for i in tf.range(steps):
+                    next_value = model(window, training=False)
+                    outputs = outputs.write(i, next_value[0])
+                    # Shift the window and append the new prediction
+                    window = tf.concat([window[:, 1:, :], next_value[:, None, :]], axis=1)
+                return outputs.stack()
+
+            self._rollout = run
+
+        window = tf.constant(sequence[None, :, :], dtype=tf.float32)
+        return self._rollout(window, tf.constant(steps, dtype=tf.int32)).numpy()
+
+
+class ModelPool:
+    """Idle compiled networks by architecture, with a cap on how many are kept"""
+
+    def __init__(self, max_idle: int):
+        self.max_idle = max_idle
+        self.leased = 0
+        self.built = 0
+        self.reused = 0
+        self.evicted = 0
+        self.clears = 0
+        # Models dropped since Keras' global state was last cleared
+        self._dropped = 0
+        self._idle: "OrderedDict[int, PooledModel]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Tuple, build: Callable[[], object]) -> PooledModel:
+        """Lease an idle network with this key, or build and compile a new one"""
+        with self._lock:
+            self.leased += 1
+            for slot, pooled in self._idle.items():
+                if pooled.key == key:
+                    del self._idle[slot]
+                    self.reused += 1
+                    return pooled
+
+        # Built outside the lock: tracing a new model takes a while
+        try:
+            pooled = PooledModel(key, build())
+        except Exception:
+            self._return(dropped=0)
+            raise
+        with self._lock:
+            self.built += 1
+        return pooled
+
+    def release(self, pooled: PooledModel):
+        """Give a leased network back (dropping the oldest idle ones beyond the cap)"""
+        with self._lock:
+            self._idle[id(pooled)] = pooled
+            dropped = 0
+            while len(self._idle) > self.max_idle:
+                self._idle.popitem(last=False)
+                dropped += 1
+            self.evicted += dropped
+        self._return(dropped)
+
+    @contextmanager
+    def in_use(self):
+        """Count models built outside the pool (e.g. batch training) as a lease, dropped on exit"""
+        with self._lock:
+            self.leased += 1
+        try:
+            yield
+        finally:
+            self._return(dropped=1)
+
+    def _return(self, dropped: int):
+        """End a lease; once nothing is leased, clear Keras' global state if models were dropped"""
+        with self._lock:
+            self.leased -= 1
+            self._dropped += dropped
+            if self.leased or not self._dropped:
+                return
+            self._dropped = 0
+            self.clears += 1
+            keras.backend.clear_session()
+        gc.collect()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "max_idle": self.max_idle,
+                "leased": self.leased,
+                "built": self.built,
+                "reused": self.reused,
+                "evicted": self.evicted,
+                "session_clears": self.clears
+            }
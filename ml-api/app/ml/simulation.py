@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from scipy.sparse import csr_matrix
+from typing import List, Dict, Optional, Tuple
+
+from app.ml.ets_predictor import ETSPredictor
+
+class MonteCarloSimulator:
+    """
+    Monte Carlo simulation of future spending.
+
+    A baseline model is fitted to the daily series of every category, and
+    future paths are drawn by adding bootstrapped in-sample residuals to the
+    baseline forecast. Residuals are resampled by whole historical days, so
+    the same random day index is used for every category and the
+    correlation between categories is preserved in the totals.
+
+    Because the day index is shared, every value a path can take is known
+    up front: max(forecast[category, day] + residual[historical day,
+    category], 0). simulate builds that (day x historical day x category)
+    table once, gathers the daily totals of all paths from its sum over
+    categories, and gets every category's path totals at once as a sparse
+    (paths x cells) selection matrix times the table. Days are processed in
+    blocks so a table block stays under MAX_TABLE_ELEMENTS values.
+
+    Daily totals are kept in float32 as (day x path), so the cumulative fan
+    is one in-place sort per day row; its quantiles are read at the sorted
+    ranks with the same linear interpolation as np.quantile.
+    """
+
+    # Values per block of the (day x historical day x category) table (64 MB in float64)
+    MAX_TABLE_ELEMENTS = 2 ** 23
+
+    def __init__(self, model_type: str = "ets", n_paths: int = 10000, seed: Optional[int] = None):
+        self.model_type = model_type
+        self.n_paths = n_paths
+        self.rng = np.random.default_rng(seed)
+
+    def fit_baseline(self, Y: np.ndarray, days_ahead: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Baseline forecasts (categories x days_ahead) and aligned residuals
+        (days x categories) for a (days x categories) matrix
+        """
+        n_days = Y.shape[0]
+        if n_days < 2:
+            raise ValueError("Need at least 2 days of data to run a simulation")
+
+        if self.model_type == "ets":
+            predictor = ETSPredictor()
+            params = predictor.fit_many(Y.T)
+            forecast, _, _ = predictor.forecast_many(days_ahead)
+            return forecast, params["residuals"].T
+
+        # Straight line per category, all fitted in one least-squares call
+        x = np.arange(n_days)
+        slope, intercept = np.polyfit(x, Y, 1)
+        residuals = Y - (intercept[None, :] + slope[None, :] * x[:, None])
+
+        future_x = np.arange(n_days, n_days + days_ahead)
+        forecast = np.maximum(intercept[:, None] + slope[:, None] * future_x[None, :], 0)
+        return forecast, residuals
+
+    def simulate(
+        self,
+        matrix: pd.DataFrame,
+        days_ahead: int,
+        threshold: Optional[float] = None,
+        quantiles: Tuple[float, ...] = (0.05, 0.25, 0.5, 0.75, 0.95)
+    ) -> Dict:
+        """
+        Simulate n_paths futures for every column of a daily (days x
+        categories) frame. Returns total and per-category statistics plus a
+        daily fan of cumulative spending.
+        """
+        forecast, residuals = self.fit_baseline(matrix.values.astype(float), days_ahead)
+        forecast = forecast.astype(np.float32)
+        residuals = residuals.astype(np.float32)
+        n_history, n_categories = residuals.shape
+
+        # One random historical day per (path, future day), shared by all categories
+        day_idx = self.rng.integers(0, n_history, size=(self.n_paths, days_ahead), dtype=np.int32)
+
+        q = np.asarray(quantiles)
+        daily_totals = np.empty((days_ahead, self.n_paths), dtype=np.float32)
+        category_totals = np.zeros((n_categories, self.n_paths))
+        block = max(1, self.MAX_TABLE_ELEMENTS // (n_history * n_categories))
+
+        for start in range(0, days_ahead, block):
+            stop = min(start + block, days_ahead)
+            days = stop - start
+
+            # (day, historical day, category) -> simulated amount
+            table = np.maximum(forecast[:, start:stop].T[:, None, :] + residuals[None, :, :], 0)
+
+            # Cell (day, historical day) drawn by every path on every day of the block
+            cells = day_idx[:, start:stop] + np.arange(days, dtype=np.int32) * n_history
+            daily_totals[start:stop] = table.sum(axis=2).reshape(-1)[cells].T
+
+            selection = csr_matrix(
+                (np.ones(cells.size, dtype=np.float32), cells.reshape(-1), np.arange(0, cells.size + 1, days)),
+                shape=(self.n_paths, days * n_history)
+            )
+            category_totals += (selection @ table.reshape(-1, n_categories)).T
+
+        category_quantiles = np.quantile(category_totals, q, axis=1)
+        categories = [
+            {
+                "category": category,
+                "expected_total": float(category_totals[c].mean()),
+                "quantiles": self._format_quantiles(q, category_quantiles[:, c])
+            }
+            for c, category in enumerate(matrix.columns)
+        ]
+
+        cumulative = np.cumsum(daily_totals, axis=0, dtype=np.float32)
+        totals = cumulative[-1].astype(np.float64)
+        cumulative.sort(axis=1)
+        fan = self._sorted_quantiles(cumulative, q)
+
+        last_date = matrix.index.max()
+        daily = [
+            {
+                "date": (last_date + timedelta(days=i + 1)).strftime("%Y-%m-%d"),
+                "quantiles": self._format_quantiles(q, fan[:, i])
+            }
+            for i in range(days_ahead)
+        ]
+
+        return {
+            "expected_total": float(totals.mean()),
+            "quantiles": self._format_quantiles(q, np.quantile(totals, q)),
+            "probability_exceed": float(np.mean(totals > threshold)) if threshold is not None else None,
+            "categories": categories,
+            "daily": daily
+        }
+
+    def _sorted_quantiles(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        """
+        Quantiles q of every row of an already sorted (rows x values)
+        array, as (len(q) x rows), interpolated like np.quantile
+        """
+        position = q * (rows.shape[1] - 1)
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, rows.shape[1] - 1)
+        weight = (position - lower)[:, None]
+        low = rows[:, lower].T.astype(np.float64)
+        return low + (rows[:, upper].T - low) * weight
+
+    def _format_quantiles(self, q: np.ndarray, values: np.ndarray) -> Dict[str, float]:
+        """Quantile values keyed as p5, p50, p95, ..."""
+        return {f"p{level * 100:g}": float(value) for level, value in zip(q, values)}
@@ -1,7 +1,10 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Optional, Dict
 from datetime import datetime
 
+# Longest forecast horizon; forecasts are computed and cached at this length
+MAX_DAYS_AHEAD = 365
+
 class BaseSchema(BaseModel):
     # Allow fields starting with 'model_' (e.g., model_type) without warnings
     model_config = ConfigDict(protected_namespaces=())
@@ -17,8 +20,8 @@ class Transaction(BaseSchema):
 class PredictionRequest(BaseSchema):
     user_id: str
     category: Optional[str] = None
-    days_ahead: int = Field(default=30, ge=1, le=365)
-    model_type: str = Field(default="linear", pattern="^(linear|lstm)$")
+    days_ahead: int = Field(default=30, ge=1, le=MAX_DAYS_AHEAD)
+    model_type: str = Field(default="linear", pattern="^(linear|lstm|ets|auto)$")
 
 class PredictionPoint(BaseSchema):
     date: str
@@ -26,6 +29,14 @@ class PredictionPoint(BaseSchema):
     confidence_lower: Optional[float] = None
     confidence_upper: Optional[float] = None
 
+class TrainingInfo(BaseSchema):
+    loss: float
+    mae: float
+    val_loss: Optional[float] = None
+    epochs_trained: int
+    training_time: float  # seconds
+    warm_start: bool = False
+
 class PredictionResponse(BaseSchema):
     user_id: str
     category: Optional[str]
@@ -35,6 +46,7 @@ class PredictionResponse(BaseSchema):
     total_predicted: float
     avg_daily_spending: float
     trend: str  # "increasing", "decreasing", "stable"
+    training: Optional[TrainingInfo] = None  # set when a model was trained for this request
     created_at: datetime = Field(default_factory=datetime.now)
 
 class CategoryInsights(BaseSchema):
@@ -50,3 +62,78 @@ class InsightsResponse(BaseSchema):
     categories: List[CategoryInsights]
     overall_trend: str
     created_at: datetime = Field(default_factory=datetime.now)
+
+class BacktestMetrics(BaseSchema):
+    model_type: str
+    folds: int
+    mae: Optional[float] = None
+    rmse: Optional[float] = None
+    mape: Optional[float] = None
+    coverage: Optional[float] = None
+    error: Optional[str] = None
+
+class CategoryBacktest(BaseSchema):
+    category: Optional[str]  # None = all categories combined
+    best_model: Optional[str]
+    metrics: List[BacktestMetrics]
+
+class BacktestResponse(BaseSchema):
+    user_id: str
+    horizon: int
+    folds: int
+    categories: List[CategoryBacktest]
+    created_at: datetime = Field(default_factory=datetime.now)
+
+class SimulationRequest(BaseSchema):
+    user_id: str
+    category: Optional[str] = None
+    days_ahead: int = Field(default=30, ge=1, le=MAX_DAYS_AHEAD)
+    model_type: str = Field(default="ets", pattern="^(linear|ets)$")
+    n_paths: int = Field(default=10000, ge=100, le=50000)
+    threshold: Optional[float] = Field(default=None, gt=0)
+    seed: Optional[int] = None
+
+class SimulationDay(BaseSchema):
+    date: str
+    quantiles: Dict[str, float]  # cumulative spending up to this day
+
+class CategorySimulation(BaseSchema):
+    category: str
+    expected_total: float
+    quantiles: Dict[str, float]
+
+class SimulationResponse(BaseSchema):
+    user_id: str
+    category: Optional[str]
+    days_ahead: int
+    n_paths: int
+    model_type: str
+    expected_total: float
+    quantiles: Dict[str, float]
+    threshold: Optional[float] = None
+    probability_exceed: Optional[float] = None
+    categories: List[CategorySimulation]
+    daily: List[SimulationDay]
+    created_at: datetime = Field(default_factory=datetime.now)
+
+class ScoreRequest(BaseSchema):
+    user_id: str
+    category: str
+    amount: float = Field(gt=0)
+    date: Optional[datetime] = None  # defaults to now (used for the day-of-week profile)
+    transaction_id: Optional[str] = None
+    update: bool = False  # also fold the expense into the stats (when no change stream runs)
+    threshold: Optional[float] = Field(default=None, gt=0)
+
+class ScoreResponse(BaseSchema):
+    user_id: str
+    category: str
+    amount: float
+    score: Optional[float] = None  # None while there are too few observations
+    is_anomaly: bool
+    z_scores: Dict[str, float]
+    expected_amount: Optional[float] = None
+    observations: int
+    baseline: str  # "category" or "user" (all categories)
+    message: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
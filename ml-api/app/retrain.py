@@ -0,0 +1,58 @@
+"""
+Periodic batch retraining of the registered LSTM models.
+
+Every single-series LSTM trained by this process registers its weights
+under its "<user_id>:<category or *>" key. The retrainer refetches the
+current data of every registered key and retrains all of them with
+BatchLSTMTrainer (a few grouped fits instead of one fit per series), so the
+next request for any of them warm-starts from fresh weights. The API starts
+it when LSTM_RETRAIN_INTERVAL_HOURS > 0.
+"""
+import asyncio
+from typing import Dict
+
+from app.ingest import get_user_transactions
+from app.lanes import LaneFull, slow_lane
+from app.ml.batch_trainer import BatchLSTMTrainer
+from app.ml.lstm_predictor import LSTMPredictor, get_registered, registered_keys
+
+
+async def retrain_registered() -> Dict[str, Dict]:
+    """Retrain every registered single-series LSTM on its current data"""
+    series = {}
+    for key in registered_keys():
+        entry = get_registered(key)
+        # Multivariate (by-category) models have their own columns; they retrain on request
+        if entry is None or entry.get("columns") is not None:
+            continue
+
+        user_id, category = key.split(":", 1)
+        transactions = await get_user_transactions(user_id, None if category == "*" else category)
+        if len(transactions) == 0:
+            continue
+        amounts = LSTMPredictor(entry["lookback"]).prepare_data(transactions)["amount"].values
+        series[key] = amounts.reshape(-1, 1)
+
+    if not series:
+        return {}
+
+    # One slow-lane slot for the whole batch, so it respects the training cap
+    while True:
+        try:
+            return await slow_lane.run(BatchLSTMTrainer().train, series)
+        except LaneFull as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def run_retrainer(interval_hours: int):
+    """Retrain the registered LSTMs every interval_hours (background task started by the API)"""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            results = await retrain_registered()
+            failed = sum(1 for result in results.values() if "error" in result)
+            print(f"[RETRAIN] Retrained {len(results) - failed} LSTM series ({failed} skipped or failed)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[RETRAIN ERROR] Batch retraining failed: {type(e).__name__}: {e}")
@@ -1,59 +1,120 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from app.models.schemas import (
     PredictionRequest,
     PredictionResponse,
     InsightsResponse,
-    CategoryInsights
+    CategoryInsights,
+    BacktestResponse,
+    CategoryBacktest,
+    BacktestMetrics,
+    SimulationRequest,
+    SimulationResponse,
+    ScoreRequest,
+    ScoreResponse,
+    MAX_DAYS_AHEAD
 )
+from app.config import settings
 from app.database import get_database
 from app.ml.linear_predictor import LinearPredictor
 from app.ml.lstm_predictor import LSTMPredictor, TENSORFLOW_AVAILABLE
+from app.ml.ets_predictor import ETSPredictor
+from app.ml.simulation import MonteCarloSimulator
+from app.ml import backtest
+from app.lanes import LaneFull, fast_lane, slow_lane, lane_for
+from app.ingest import get_user_transactions
+from app.forecast_cache import forecast_cache, fingerprint, forecast_entry, slice_forecast
+from app import spending_stats
 from datetime import datetime
-from typing import List, Dict
-from bson import ObjectId
+from typing import List, Dict, Optional
+import pandas as pd
 
 router = APIRouter()
 
-async def get_user_transactions(user_id: str, category: str = None) -> List[Dict]:
-    """Fetch user transactions from MongoDB"""
-    try:
-        print(f"[DB] Fetching transactions for user_id={user_id}, category={category}")
-        db = get_database()
-
-        if db is None:
-            print("[DB ERROR] Database connection is None!")
-            return []
-
-        transactions_collection = db.transactions
-
-        # Convert user_id string to ObjectId for MongoDB query
-        try:
-            user_object_id = ObjectId(user_id)
-            query = {"user": user_object_id, "type": "expense"}
-        except Exception as e:
-            print(f"[DB ERROR] Invalid ObjectId format for user_id={user_id}: {e}")
-            # Fallback: try as string in case some records use string
-            query = {"user": user_id, "type": "expense"}
-
-        if category:
-            query["category"] = category
-
-        print(f"[DB] Query: {query}")
-        cursor = transactions_collection.find(query).sort("date", 1)
-        transactions = await cursor.to_list(length=1000)
-        print(f"[DB] Retrieved {len(transactions)} transactions")
-
-        # Convert MongoDB ObjectId to string
-        for trans in transactions:
-            trans['_id'] = str(trans['_id'])
-            trans['user'] = str(trans['user'])
+def transaction_count(transactions: pd.DataFrame) -> int:
+    """Number of transactions in a frame (rows are daily buckets with source=daily_totals)"""
+    return int(transactions['count'].sum())
+
+def lane_unavailable(error: LaneFull) -> HTTPException:
+    """503 telling the client when to retry a request that found its lane full"""
+    print(f"[LANES] {error}")
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
 
-        return transactions
-    except Exception as e:
-        print(f"[DB ERROR] Error fetching transactions: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return []
+def lstm_model_key(user_id: str, category: Optional[str] = None, by_category: bool = False) -> str:
+    """
+    Key under which the LSTM weights of a user/category series are
+    registered (by_category: the multivariate model over all categories)
+    """
+    if by_category:
+        return f"{user_id}:by_category"
+    return f"{user_id}:{category or '*'}"
+
+def build_predictor(model_type: str, user_id: str, category: Optional[str] = None):
+    """New predictor of the given model type for a user/category series"""
+    if model_type == "lstm":
+        return LSTMPredictor(lookback=7, model_key=lstm_model_key(user_id, category))
+    if model_type == "ets":
+        return ETSPredictor()
+    return LinearPredictor()
+
+async def cached_forecast(
+    user_id: str,
+    category: Optional[str],
+    model_type: str,
+    transactions: pd.DataFrame,
+    days_ahead: int
+) -> Dict:
+    """
+    Prediction for days_ahead days, sliced from the forecast of this series
+    at MAX_DAYS_AHEAD (computed in the model's lane on a cache miss)
+    """
+    async def compute():
+        predictor = build_predictor(model_type, user_id, category)
+        print(f"[PREDICT] Forecasting {MAX_DAYS_AHEAD} days with {predictor.__class__.__name__}")
+        result = await lane_for(model_type).run(predictor.predict, transactions, MAX_DAYS_AHEAD)
+        return forecast_entry(result)
+
+    entry, cached = await forecast_cache.get_or_compute(
+        ("predict", user_id, category, model_type), fingerprint(transactions), compute
+    )
+    result = slice_forecast(entry, days_ahead, model_type)
+    if cached:
+        # No model was trained for this request
+        result["training"] = None
+    return result
+
+async def get_selected_model(user_id: str, category: Optional[str] = None) -> str:
+    """Model chosen for this user/category by the latest backtest (defaults to linear)"""
+    db = get_database()
+    if db is None:
+        return "linear"
+
+    selection = await db.model_selections.find_one({"user": user_id, "category": category})
+    model_type = selection["best_model"] if selection else "linear"
+
+    if model_type == "lstm" and not TENSORFLOW_AVAILABLE:
+        model_type = "linear"
+    return model_type
+
+async def save_model_selection(user_id: str, result: CategoryBacktest, horizon: int):
+    """Persist the backtest winner so model_type="auto" can use it"""
+    db = get_database()
+    if db is None or result.best_model is None:
+        return
+
+    await db.model_selections.update_one(
+        {"user": user_id, "category": result.category},
+        {"$set": {
+            "best_model": result.best_model,
+            "metrics": [m.model_dump() for m in result.metrics],
+            "horizon": horizon,
+            "updated_at": datetime.now()
+        }},
+        upsert=True
+    )
 
 @router.post("/predict", response_model=PredictionResponse)
 async def predict_expenses(request: PredictionRequest):
@@ -67,27 +128,28 @@ async def predict_expenses(request: PredictionRequest):
         transactions = await get_user_transactions(request.user_id, request.category)
         print(f"[PREDICT] Found {len(transactions)} transactions")
 
-        if not transactions:
+        if transactions.empty:
             raise HTTPException(
                 status_code=404,
                 detail="No transaction data found for this user"
             )
 
-        # Select model based on request
-        if request.model_type == "lstm":
-            if not TENSORFLOW_AVAILABLE:
-                raise HTTPException(
-                    status_code=503,
-                    detail="LSTM model not available. TensorFlow is not installed. Using linear regression instead."
-                )
-            predictor = LSTMPredictor(lookback=7)
-        else:
-            predictor = LinearPredictor()
+        # Resolve "auto" to the model picked by the latest backtest
+        model_type = request.model_type
+        if model_type == "auto":
+            model_type = await get_selected_model(request.user_id, request.category)
+            print(f"[PREDICT] Auto model selection: {model_type}")
 
-        print(f"[PREDICT] Using predictor: {predictor.__class__.__name__}")
+        if model_type == "lstm" and not TENSORFLOW_AVAILABLE:
+            raise HTTPException(
+                status_code=503,
+                detail="LSTM model not available. TensorFlow is not installed. Using linear regression instead."
+            )
 
-        # Make predictions
-        result = predictor.predict(transactions, request.days_ahead)
+        # Make predictions (LSTM training runs in the slow lane, the rest in the fast lane)
+        result = await cached_forecast(
+            request.user_id, request.category, model_type, transactions, request.days_ahead
+        )
         print(f"[PREDICT] Prediction successful: total={result['total_predicted']}, trend={result['trend']}")
 
         # Prepare response
@@ -95,17 +157,20 @@ async def predict_expenses(request: PredictionRequest):
             user_id=request.user_id,
             category=request.category,
             predictions=result["predictions"],
-            model_type=request.model_type,
+            model_type=model_type,
             accuracy_score=result.get("accuracy_score"),
             total_predicted=result["total_predicted"],
             avg_daily_spending=result["avg_daily_spending"],
-            trend=result["trend"]
+            trend=result["trend"],
+            training=result.get("training")
         )
 
         return response
 
     except HTTPException:
         raise
+    except LaneFull as e:
+        raise lane_unavailable(e)
     except ValueError as e:
         print(f"[PREDICT ERROR] ValueError: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -116,62 +181,73 @@ async def predict_expenses(request: PredictionRequest):
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 @router.get("/insights/{user_id}", response_model=InsightsResponse)
-async def get_spending_insights(user_id: str, days_ahead: int = 30):
+async def get_spending_insights(
+    user_id: str,
+    days_ahead: int = Query(default=30, ge=1, le=MAX_DAYS_AHEAD),
+    model_type: str = Query(default="linear", pattern="^(linear|ets|lstm)$")
+):
     """
     Get spending insights across all categories
     """
     try:
+        if model_type == "lstm" and not TENSORFLOW_AVAILABLE:
+            raise HTTPException(
+                status_code=503,
+                detail="LSTM model not available. TensorFlow is not installed."
+            )
+
         # Fetch all transactions
         transactions = await get_user_transactions(user_id)
 
-        if not transactions:
+        if transactions.empty:
             raise HTTPException(
                 status_code=404,
                 detail="No transaction data found for this user"
             )
 
-        # Get unique categories
-        categories = list(set([t['category'] for t in transactions]))
-
-        category_insights = []
-        total_predicted = 0.0
+        # Group transactions by category
+        groups = {
+            category: cat_transactions
+            for category, cat_transactions in transactions.groupby('category', observed=True, sort=False)
+            if transaction_count(cat_transactions) >= 2
+        }
 
-        predictor = LinearPredictor()
+        async def compute():
+            results = await lane_for(model_type).run(
+                _predict_categories, groups, model_type, MAX_DAYS_AHEAD, user_id
+            )
+            return {category: forecast_entry(result) for category, result in results.items()}
 
-        for category in categories:
-            # Filter transactions by category
-            cat_transactions = [t for t in transactions if t['category'] == category]
+        # ETS and LSTM fit all categories on a shared calendar, so insights have their own entries
+        entries, _ = await forecast_cache.get_or_compute(
+            ("insights", user_id, None, model_type), fingerprint(transactions), compute
+        )
+        results = {
+            category: slice_forecast(entry, days_ahead, model_type)
+            for category, entry in entries.items()
+        }
 
-            if len(cat_transactions) < 2:
-                continue
+        category_insights = []
+        total_predicted = 0.0
 
-            # Make predictions
-            try:
-                result = predictor.predict(cat_transactions, days_ahead)
-
-                # Calculate current average
-                import pandas as pd
-                df = pd.DataFrame(cat_transactions)
-                current_avg = df['amount'].mean()
-
-                # Create insight
-                insight = CategoryInsights(
-                    category=category,
-                    current_avg=float(current_avg),
-                    predicted_avg=result["avg_daily_spending"],
-                    trend=result["trend"],
-                    recommendation=_generate_recommendation(
-                        result["trend"],
-                        result["avg_daily_spending"],
-                        float(current_avg)
-                    )
+        for category, result in results.items():
+            # Calculate current average (per transaction, also over daily buckets)
+            current_avg = float(groups[category]['amount'].sum() / transaction_count(groups[category]))
+
+            # Create insight
+            insight = CategoryInsights(
+                category=category,
+                current_avg=current_avg,
+                predicted_avg=result["avg_daily_spending"],
+                trend=result["trend"],
+                recommendation=_generate_recommendation(
+                    result["trend"],
+                    result["avg_daily_spending"],
+                    current_avg
                 )
-                category_insights.append(insight)
-                total_predicted += result["total_predicted"]
-
-            except Exception as e:
-                print(f"Error predicting for category {category}: {e}")
-                continue
+            )
+            category_insights.append(insight)
+            total_predicted += result["total_predicted"]
 
         # Determine overall trend
         increasing_count = sum(1 for ci in category_insights if ci.trend == "increasing")
@@ -195,9 +271,37 @@ async def get_spending_insights(user_id: str, days_ahead: int = 30):
 
     except HTTPException:
         raise
+    except LaneFull as e:
+        raise lane_unavailable(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Insights error: {str(e)}")
 
+def _predict_categories(
+    groups: Dict[str, pd.DataFrame],
+    model_type: str,
+    days_ahead: int,
+    user_id: str
+) -> Dict[str, Dict]:
+    """Predictions for every category group (runs in the model's lane)"""
+    if model_type == "ets":
+        # One vectorized fit for all categories
+        return ETSPredictor().predict_many(groups, days_ahead) if groups else {}
+
+    if model_type == "lstm":
+        # One multivariate network and one rollout for all categories
+        predictor = LSTMPredictor(lookback=7, model_key=lstm_model_key(user_id, by_category=True))
+        return predictor.predict_many(groups, days_ahead) if groups else {}
+
+    results = {}
+    for category, cat_transactions in groups.items():
+        try:
+            results[category] = LinearPredictor().predict(cat_transactions, days_ahead)
+        except Exception as e:
+            print(f"Error predicting for category {category}: {e}")
+    return results
+
 @router.get("/category/{user_id}/{category}")
 async def predict_category(
     user_id: str,
@@ -217,22 +321,21 @@ async def predict_category(
     return await predict_expenses(request)
 
 @router.get("/compare/{user_id}")
-async def compare_models(user_id: str, days_ahead: int = 30):
+async def compare_models(user_id: str, days_ahead: int = Query(default=30, ge=1, le=MAX_DAYS_AHEAD)):
     """
     Compare predictions from both Linear Regression and LSTM models
     """
     try:
         transactions = await get_user_transactions(user_id)
 
-        if not transactions:
+        if transactions.empty:
             raise HTTPException(
                 status_code=404,
                 detail="No transaction data found for this user"
             )
 
         # Linear prediction
-        linear_predictor = LinearPredictor()
-        linear_result = linear_predictor.predict(transactions, days_ahead)
+        linear_result = await cached_forecast(user_id, None, "linear", transactions, days_ahead)
 
         result = {
             "user_id": user_id,
@@ -245,16 +348,28 @@ async def compare_models(user_id: str, days_ahead: int = 30):
             }
         }
 
+        # Exponential smoothing prediction
+        try:
+            ets_result = await cached_forecast(user_id, None, "ets", transactions, days_ahead)
+            result["ets"] = {
+                "total_predicted": ets_result["total_predicted"],
+                "avg_daily_spending": ets_result["avg_daily_spending"],
+                "trend": ets_result["trend"],
+                "accuracy_score": ets_result.get("accuracy_score", 0.0)
+            }
+        except Exception as e:
+            result["ets_error"] = str(e)
+
         # LSTM prediction (if available)
-        if TENSORFLOW_AVAILABLE and len(transactions) >= 8:
+        if TENSORFLOW_AVAILABLE and transaction_count(transactions) >= 8:
             try:
-                lstm_predictor = LSTMPredictor()
-                lstm_result = lstm_predictor.predict(transactions, days_ahead)
+                lstm_result = await cached_forecast(user_id, None, "lstm", transactions, days_ahead)
                 result["lstm"] = {
                     "total_predicted": lstm_result["total_predicted"],
                     "avg_daily_spending": lstm_result["avg_daily_spending"],
                     "trend": lstm_result["trend"],
-                    "accuracy_score": lstm_result.get("accuracy_score", 0.0)
+                    "accuracy_score": lstm_result.get("accuracy_score", 0.0),
+                    "training": lstm_result.get("training")
                 }
             except Exception as e:
                 result["lstm_error"] = str(e)
@@ -265,9 +380,186 @@ async def compare_models(user_id: str, days_ahead: int = 30):
 
     except HTTPException:
         raise
+    except LaneFull as e:
+        raise lane_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Comparison error: {str(e)}")
 
+@router.post("/simulate", response_model=SimulationResponse)
+async def simulate_spending(request: SimulationRequest):
+    """
+    Monte Carlo simulation of future spending by bootstrapping the residuals
+    of the fitted model. Returns quantiles of the total and the probability
+    of exceeding `threshold` over the horizon.
+    """
+    try:
+        transactions = await get_user_transactions(request.user_id, request.category)
+
+        if transactions.empty:
+            raise HTTPException(
+                status_code=404,
+                detail="No transaction data found for this user"
+            )
+
+        groups = dict(tuple(transactions.groupby('category', observed=True, sort=False)))
+
+        matrix = ETSPredictor().prepare_matrix(groups)
+        simulator = MonteCarloSimulator(request.model_type, request.n_paths, request.seed)
+        result = await fast_lane.run(simulator.simulate, matrix, request.days_ahead, request.threshold)
+        print(f"[SIMULATE] user_id={request.user_id}, categories={len(groups)}, paths={request.n_paths}, expected_total={result['expected_total']:.2f}")
+
+        return SimulationResponse(
+            user_id=request.user_id,
+            category=request.category,
+            days_ahead=request.days_ahead,
+            n_paths=request.n_paths,
+            model_type=request.model_type,
+            threshold=request.threshold,
+            **result
+        )
+
+    except HTTPException:
+        raise
+    except LaneFull as e:
+        raise lane_unavailable(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"[SIMULATE ERROR] Exception: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Simulation error: {str(e)}")
+
+@router.post("/score", response_model=ScoreResponse)
+async def score_transaction(request: ScoreRequest):
+    """
+    Anomaly score of one expense against the running stats of its user and
+    category. O(1): one indexed read (plus two small writes with update=true),
+    so it can be called inline when a transaction is inserted.
+    """
+    try:
+        db = get_database()
+        if db is None:
+            raise HTTPException(status_code=503, detail="Database not available")
+
+        # Without an id the consumer's insert event would fold the same expense again
+        if request.update and not request.transaction_id and (
+            settings.ANOMALY_STREAM_ENABLED or await spending_stats.consumer_active(db)
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail="transaction_id is required with update=true while the change-stream consumer runs"
+            )
+
+        result = await spending_stats.score(
+            db, request.user_id, request.category, request.amount, request.date, request.threshold
+        )
+
+        if request.update:
+            await spending_stats.update(
+                db,
+                spending_stats.object_id_or_str(request.user_id),
+                request.category,
+                request.amount,
+                request.date,
+                spending_stats.object_id_or_str(request.transaction_id) if request.transaction_id else None
+            )
+
+        message = None
+        if result["is_anomaly"]:
+            message = (
+                f"Gasto de {request.amount:.2f} em {request.category} está bem acima do habitual "
+                f"(média de {result['expected_amount']:.2f})."
+            )
+            print(f"[SCORE] Anomaly: user_id={request.user_id}, category={request.category}, score={result['score']:.2f}")
+
+        return ScoreResponse(
+            user_id=request.user_id,
+            category=request.category,
+            amount=request.amount,
+            message=message,
+            **result
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[SCORE ERROR] Exception: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Scoring error: {str(e)}")
+
+@router.get("/backtest/{user_id}", response_model=BacktestResponse)
+async def backtest_models(
+    user_id: str,
+    horizon: int = settings.BACKTEST_HORIZON,
+    folds: int = settings.BACKTEST_FOLDS
+):
+    """
+    Rolling-origin backtest of every available model, for the user's overall
+    spending and for each category. Runs in parallel on a process pool,
+    admitted as one slow-lane job, and stores the best model per category
+    for model_type="auto".
+    """
+    try:
+        if not 1 <= horizon <= 365 or not 1 <= folds <= 12:
+            raise HTTPException(
+                status_code=400,
+                detail="horizon must be between 1 and 365 and folds between 1 and 12"
+            )
+
+        transactions = await get_user_transactions(user_id)
+
+        if transactions.empty:
+            raise HTTPException(
+                status_code=404,
+                detail="No transaction data found for this user"
+            )
+
+        series = {None: transactions}
+        by_category = transactions.groupby('category', observed=True)
+        for category, cat_transactions in sorted(by_category, key=lambda group: group[0]):
+            if category and transaction_count(cat_transactions) >= 2:
+                series[category] = cat_transactions
+
+        models = backtest.available_models()
+        jobs = [(category, model_type) for category in series for model_type in models]
+        print(f"[BACKTEST] user_id={user_id}: {len(series)} series x {len(models)} models, horizon={horizon}, folds={folds}")
+
+        executor = backtest.get_executor(
+            settings.BACKTEST_MAX_WORKERS,
+            (settings.TF_INTRA_OP_THREADS, settings.TF_INTER_OP_THREADS)
+        )
+        outcomes = await slow_lane.run(backtest.run_jobs, executor, series, jobs, horizon, folds)
+
+        metrics_by_category: Dict[Optional[str], List[Dict]] = {category: [] for category in series}
+        for (category, model_type), outcome in zip(jobs, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"[BACKTEST ERROR] {category}/{model_type}: {type(outcome).__name__}: {outcome}")
+                outcome = {"model_type": model_type, "folds": 0, "error": str(outcome)}
+            metrics_by_category[category].append(outcome)
+
+        results = []
+        for category, metrics in metrics_by_category.items():
+            result = CategoryBacktest(
+                category=category,
+                best_model=backtest.select_best_model(metrics),
+                metrics=[BacktestMetrics(**m) for m in metrics]
+            )
+            await save_model_selection(user_id, result, horizon)
+            results.append(result)
+
+        return BacktestResponse(
+            user_id=user_id,
+            horizon=horizon,
+            folds=folds,
+            categories=results
+        )
+
+    except HTTPException:
+        raise
+    except LaneFull as e:
+        raise lane_unavailable(e)
+    except Exception as e:
+        print(f"[BACKTEST ERROR] Exception: {type(e).__name__}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Backtest error: {str(e)}")
+
 def _generate_recommendation(trend: str, predicted_avg: float, current_avg: float) -> str:
     """Generate spending recommendation based on trend"""
     if trend == "increasing":
@@ -0,0 +1,301 @@
+"""
+Running spending statistics for streaming anomaly scoring.
+
+The `spending_stats` collection holds one small document per (user,
+category) plus one per user over all categories (category "*"), with the
+AnomalyScorer stats of their expenses. Scoring a new expense reads the two
+documents of its user in one indexed query; folding it in rewrites them.
+Neither depends on the history length.
+
+Expenses are folded in by a change-stream consumer on `transactions`
+(needs a replica set; enable it with ANOMALY_STREAM_ENABLED in exactly one
+instance), or by POST /score with update=true where change streams are not
+available. Each document keeps the _ids of the last RECENT_IDS transactions
+folded in, so a replayed event (consumer resume, or both paths seeing the
+same insert) is not counted twice whatever order the ids arrive in. While
+the consumer runs, /score only folds expenses that carry a transaction_id.
+The resume token and whether the consumer is running live in
+`spending_stats_state`. Existing history is loaded with a backfill:
+
+    python -m app.spending_stats --backfill [--user USER_ID]
+"""
+import argparse
+import asyncio
+import heapq
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from app.database import connect_to_mongo, close_mongo_connection, get_database
+from app.daily_totals import user_match
+from app.ml.anomaly import AnomalyScorer
+
+COLLECTION = "spending_stats"
+STATE_COLLECTION = "spending_stats_state"
+STATE_ID = "transactions"
+
+ALL_CATEGORIES = "*"
+
+# Events between resume-token saves (replays after a restart are skipped by recentIds)
+SAVE_TOKEN_EVERY = 50
+# Transaction ids remembered per stats document (well above the events a resume replays)
+RECENT_IDS = 500
+# Attempts of an optimistic stats update before giving up on an event
+MAX_UPDATE_ATTEMPTS = 5
+# Seconds before reopening a change stream that failed
+STREAM_RETRY_SECONDS = 5
+# Server error codes: change streams unsupported (standalone), resume token too old
+NOT_REPLICA_SET = 40573
+HISTORY_LOST = 286
+
+scorer = AnomalyScorer()
+
+
+def stats_key(user, category: str) -> str:
+    return f"{user}|{category}"
+
+
+def object_id_or_str(value: str):
+    """Ids as stored in transactions: ObjectIds (older records may use strings)"""
+    try:
+        return ObjectId(value)
+    except Exception:
+        return value
+
+
+def _weekday(date: Optional[datetime]) -> int:
+    return (date or datetime.utcnow()).weekday()
+
+
+def _folded(transaction_id, doc: Optional[Dict]) -> bool:
+    """Whether a transaction was already folded into a stats document (unknown ids never are)"""
+    return transaction_id is not None and doc is not None and transaction_id in doc.get("recentIds", [])
+
+
+async def score(
+    db,
+    user_id: str,
+    category: str,
+    amount: float,
+    date: Optional[datetime] = None,
+    threshold: Optional[float] = None
+) -> Dict:
+    """
+    Score an expense against the stats of its category, or of all the
+    user's expenses while the category has too few observations.
+    """
+    keys = [stats_key(user_id, category), stats_key(user_id, ALL_CATEGORIES)]
+    docs = {doc["_id"]: doc async for doc in db[COLLECTION].find({"_id": {"$in": keys}})}
+
+    weekday = _weekday(date)
+    result = None
+    for key, baseline in zip(keys, ["category", "user"]):
+        stats = docs[key]["stats"] if key in docs else AnomalyScorer.empty_stats()
+        result = {**scorer.score(stats, amount, weekday, threshold), "baseline": baseline}
+        if result["score"] is not None:
+            break
+    return result
+
+
+async def _fold(db, user, category: str, amount: float, weekday: int, transaction_id) -> bool:
+    """Fold one amount into one stats document (optimistic, keyed on the count)"""
+    key = stats_key(user, category)
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        doc = await db[COLLECTION].find_one({"_id": key})
+        if _folded(transaction_id, doc):
+            return False
+
+        stats = doc["stats"] if doc is not None else AnomalyScorer.empty_stats()
+        previous_count = stats["count"]
+        recent_ids = (doc or {}).get("recentIds", [])
+        if transaction_id is not None:
+            recent_ids = (recent_ids + [transaction_id])[-RECENT_IDS:]
+        replacement = {
+            "user": user,
+            "category": category,
+            "stats": scorer.update(stats, amount, weekday),
+            "recentIds": recent_ids,
+            "updatedAt": datetime.utcnow()
+        }
+
+        if doc is None:
+            try:
+                await db[COLLECTION].insert_one({"_id": key, **replacement})
+                return True
+            except DuplicateKeyError:
+                continue
+
+        result = await db[COLLECTION].replace_one({"_id": key, "stats.count": previous_count}, replacement)
+        if result.modified_count:
+            return True
+
+    print(f"[ANOMALY ERROR] Gave up updating {key} after {MAX_UPDATE_ATTEMPTS} conflicting writes")
+    return False
+
+
+async def update(db, user, category: str, amount: float, date: Optional[datetime] = None, transaction_id=None) -> bool:
+    """Fold an expense into its category and all-categories stats"""
+    weekday = _weekday(date)
+    folded = await _fold(db, user, category, amount, weekday, transaction_id)
+    await _fold(db, user, ALL_CATEGORIES, amount, weekday, transaction_id)
+    return folded
+
+
+def _expense_fields(transaction: Dict):
+    """(user, category, amount, date) of an expense document, or None"""
+    user = transaction.get("userId") or transaction.get("user")
+    if transaction.get("type") != "expense" or user is None or transaction.get("amount") is None:
+        return None
+    return user, transaction.get("category") or "Outros", float(transaction["amount"]), transaction.get("date")
+
+
+async def apply_transaction(db, transaction: Dict) -> bool:
+    """Fold a transaction document into the stats (ignored unless it is an expense)"""
+    fields = _expense_fields(transaction)
+    if fields is None:
+        return False
+    user, category, amount, date = fields
+    return await update(db, user, category, amount, date, transaction.get("_id"))
+
+
+async def consumer_active(db) -> bool:
+    """Whether a change-stream consumer is folding expenses in (in any instance)"""
+    state = await db[STATE_COLLECTION].find_one({"_id": STATE_ID}, {"consumerActive": 1})
+    return bool(state and state.get("consumerActive"))
+
+
+async def _set_consumer_active(db, active: bool):
+    await db[STATE_COLLECTION].update_one(
+        {"_id": STATE_ID},
+        {"$set": {"consumerActive": active, "consumerChangedAt": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+async def _save_token(db, token):
+    await db[STATE_COLLECTION].update_one(
+        {"_id": STATE_ID},
+        {"$set": {"resumeToken": token, "savedAt": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+async def run_consumer():
+    """Fold newly inserted expenses into the stats (background task started by the API)"""
+    db = get_database()
+    token = None
+    try:
+        await db[COLLECTION].create_index([("user", 1)])
+        state = await db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        token = state.get("resumeToken") if state else None
+    except Exception as e:
+        print(f"[ANOMALY ERROR] Could not read consumer state: {type(e).__name__}: {e}")
+    pipeline = [{"$match": {"operationType": "insert", "fullDocument.type": "expense"}}]
+
+    while True:
+        unsaved = 0
+        try:
+            async with db.transactions.watch(pipeline, resume_after=token) as stream:
+                print("[ANOMALY] Watching transactions for new expenses")
+                await _set_consumer_active(db, True)
+                async for change in stream:
+                    try:
+                        await apply_transaction(db, change["fullDocument"])
+                    except Exception as e:
+                        print(f"[ANOMALY ERROR] Could not fold transaction: {type(e).__name__}: {e}")
+
+                    token = change["_id"]
+                    unsaved += 1
+                    if unsaved >= SAVE_TOKEN_EVERY:
+                        await _save_token(db, token)
+                        unsaved = 0
+        except asyncio.CancelledError:
+            if unsaved:
+                await asyncio.shield(_save_token(db, token))
+            await asyncio.shield(_set_consumer_active(db, False))
+            raise
+        except OperationFailure as e:
+            if e.code == NOT_REPLICA_SET:
+                print("[ANOMALY] Change streams need a replica set; consumer stopped (use /score with update=true)")
+                await _set_consumer_active(db, False)
+                return
+            if e.code == HISTORY_LOST:
+                print("[ANOMALY] Resume token expired; missed expenses need a backfill")
+                token = None
+            else:
+                print(f"[ANOMALY ERROR] Change stream failed: {type(e).__name__}: {e}")
+        except Exception as e:
+            print(f"[ANOMALY ERROR] Change stream failed: {type(e).__name__}: {e}")
+
+        if unsaved:
+            await _save_token(db, token)
+        await asyncio.sleep(STREAM_RETRY_SECONDS)
+
+
+async def backfill(db, user_id: Optional[str] = None) -> int:
+    """
+    Rebuild spending_stats from all expenses (in date order), for every user
+    or for one user. Returns the number of documents written.
+    """
+    query = {"type": "expense"}
+    if user_id:
+        query.update(user_match(object_id_or_str(user_id)))
+
+    documents: Dict[str, Dict] = {}
+    # Per document, a min-heap of the RECENT_IDS largest transaction ids (the latest inserted)
+    recent: Dict[str, List] = {}
+    cursor = db.transactions.find(query, {"user": 1, "userId": 1, "type": 1, "category": 1, "amount": 1, "date": 1})
+    async for transaction in cursor.sort("date", 1):
+        fields = _expense_fields(transaction)
+        if fields is None:
+            continue
+        user, category, amount, date = fields
+        for bucket in (category, ALL_CATEGORIES):
+            key = stats_key(user, bucket)
+            doc = documents.get(key)
+            if doc is None:
+                doc = documents[key] = {
+                    "_id": key, "user": user, "category": bucket,
+                    "stats": AnomalyScorer.empty_stats()
+                }
+                recent[key] = []
+            scorer.update(doc["stats"], amount, _weekday(date))
+            # ObjectId hex strings sort like the ids themselves
+            entry = (str(transaction["_id"]), transaction["_id"])
+            if len(recent[key]) < RECENT_IDS:
+                heapq.heappush(recent[key], entry)
+            else:
+                heapq.heappushpop(recent[key], entry)
+
+    for key, doc in documents.items():
+        doc["recentIds"] = [transaction_id for _, transaction_id in sorted(recent[key])]
+
+    await db[COLLECTION].delete_many({"user": object_id_or_str(user_id)} if user_id else {})
+    refreshed_at = datetime.utcnow()
+    if documents:
+        await db[COLLECTION].bulk_write(
+            [ReplaceOne({"_id": key}, {**doc, "updatedAt": refreshed_at}, upsert=True) for key, doc in documents.items()],
+            ordered=False
+        )
+    await db[COLLECTION].create_index([("user", 1)])
+
+    print(f"[ANOMALY] Backfill wrote {len(documents)} stats documents")
+    return len(documents)
+
+
+async def _main(args):
+    await connect_to_mongo()
+    try:
+        await backfill(get_database(), args.user)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the spending_stats collection")
+    parser.add_argument("--backfill", action="store_true", required=True, help="rebuild from all expenses")
+    parser.add_argument("--user", help="only rebuild this user")
+    asyncio.run(_main(parser.parse_args()))
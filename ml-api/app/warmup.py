@@ -0,0 +1,131 @@
+"""
+Startup warmup and readiness.
+
+A fresh worker pays for TensorFlow's runtime start, Keras graph building
+and the first-call overhead of every model on its first real requests. The
+API runs each enabled predictor once on a synthetic series, in the lane
+that serves it, as a background task started by the lifespan hook. /health
+answers as soon as the process is up; /ready only turns green once warmup
+has finished and MongoDB answers a ping, so load balancers keep cold
+workers out of rotation.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+import numpy as np
+import pandas as pd
+
+from app.config import settings
+from app.database import get_database
+from app.models.schemas import MAX_DAYS_AHEAD
+from app.lanes import fast_lane, slow_lane
+from app.forecast_cache import fingerprint
+from app.ml.linear_predictor import LinearPredictor
+from app.ml.ets_predictor import ETSPredictor
+from app.ml.lstm_predictor import LSTMPredictor, TENSORFLOW_AVAILABLE
+from app.ml.simulation import MonteCarloSimulator
+from app.ml.anomaly import AnomalyScorer
+
+# Days and categories of the synthetic series
+WARMUP_DAYS = 90
+WARMUP_CATEGORIES = ["Alimentação", "Transporte"]
+# One epoch is enough to build and trace the training and rollout graphs
+WARMUP_LSTM_EPOCHS = 1
+# Seconds /ready waits for the MongoDB ping
+PING_TIMEOUT = 2
+
+state: Dict = {
+    "done": False,
+    "seconds": None,
+    "models": {}
+}
+
+
+def synthetic_transactions(days: int = WARMUP_DAYS) -> pd.DataFrame:
+    """Daily expenses with a weekly pattern, in the columns the predictors read"""
+    rng = np.random.default_rng(0)
+    start = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    dates = pd.date_range(start, periods=days, freq="D").repeat(len(WARMUP_CATEGORIES))
+    weekly = np.where(dates.dayofweek >= 5, 20.0, 0.0)
+    return pd.DataFrame({
+        "date": dates.astype("datetime64[ms]"),
+        "amount": 30.0 + weekly + rng.gamma(2.0, 5.0, len(dates)),
+        "category": pd.Categorical(WARMUP_CATEGORIES * days)
+    })
+
+
+def _warm_lstm(transactions: pd.DataFrame):
+    """Short training (not registered) plus a full-horizon rollout"""
+    predictor = LSTMPredictor()
+    predictor.MAX_EPOCHS = WARMUP_LSTM_EPOCHS
+    predictor.predict(transactions, days_ahead=MAX_DAYS_AHEAD)
+
+
+def _warm_anomaly(transactions: pd.DataFrame):
+    scorer = AnomalyScorer()
+    stats = AnomalyScorer.empty_stats()
+    for date, amount in zip(transactions["date"], transactions["amount"]):
+        scorer.update(stats, amount, date.weekday())
+    scorer.score(stats, float(transactions["amount"].max()), 0)
+
+
+async def _step(name: str, lane, func: Callable, *args):
+    started = time.perf_counter()
+    try:
+        await lane.run(func, *args)
+        state["models"][name] = {"seconds": round(time.perf_counter() - started, 3)}
+    except Exception as e:
+        # A model that cannot warm up fails on its own requests; it does not keep the worker out
+        print(f"[WARMUP ERROR] {name}: {type(e).__name__}: {e}")
+        state["models"][name] = {"error": f"{type(e).__name__}: {e}"}
+
+
+async def warm_up():
+    """Run every enabled predictor once (background task started by the API)"""
+    started = time.perf_counter()
+    transactions = synthetic_transactions()
+    groups = dict(tuple(transactions.groupby("category", observed=True, sort=False)))
+
+    await _step("linear", fast_lane, LinearPredictor().predict, transactions, MAX_DAYS_AHEAD)
+    await _step("ets", fast_lane, ETSPredictor().predict_many, groups, MAX_DAYS_AHEAD)
+    await _step(
+        "simulation", fast_lane,
+        MonteCarloSimulator("ets", 1000, 0).simulate, ETSPredictor.prepare_matrix(groups), 30, None
+    )
+    await _step("anomaly", fast_lane, _warm_anomaly, transactions)
+    await _step("fingerprint", fast_lane, fingerprint, transactions)
+    if TENSORFLOW_AVAILABLE and settings.WARMUP_LSTM:
+        await _step("lstm", slow_lane, _warm_lstm, transactions)
+
+    state["seconds"] = round(time.perf_counter() - started, 3)
+    state["done"] = True
+    print(f"[WARMUP] Models warmed up in {state['seconds']}s")
+
+
+def mark_ready():
+    """Skip warmup (WARMUP_ENABLED=false)"""
+    state["done"] = True
+
+
+async def readiness() -> Dict:
+    """Warmup progress and a fresh MongoDB ping; status is "ready" once both are fine"""
+    database_error = None
+    try:
+        database = get_database()
+        if database is None:
+            raise RuntimeError("not connected")
+        await asyncio.wait_for(database.command("ping"), timeout=PING_TIMEOUT)
+    except Exception as e:
+        database_error = f"{type(e).__name__}: {e}"
+
+    return {
+        "status": "ready" if state["done"] and database_error is None else "not_ready",
+        "warmup": {
+            "done": state["done"],
+            "seconds": state["seconds"],
+            "models": state["models"]
+        },
+        "database": {"ok": database_error is None, "error": database_error}
+    }
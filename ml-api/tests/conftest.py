@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Run from ml-api/ (as CI does) with the app package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,96 @@
+"""The vectorized ETS recursion matches a scalar Holt-Winters loop"""
+import itertools
+
+import numpy as np
+import pytest
+
+from app.ml.ets_predictor import ETSPredictor
+
+
+def scalar_holt_winters(y, alpha, beta, gamma, m=7, phi=0.98):
+    """Additive damped Holt-Winters on one series, one day at a time"""
+    y = [float(v) for v in y]
+    n = len(y)
+    if n >= 2 * m:
+        first = sum(y[:m]) / m
+        second = sum(y[m:2 * m]) / m
+        level, trend = first, (second - first) / m
+        season = [v - first for v in y[:m]]
+        warmup = m
+    else:
+        level, trend = y[0], 0.0
+        season = [0.0] * m
+        warmup = 1
+
+    errors = []
+    for t in range(n):
+        s = season[t % m]
+        if t >= warmup:
+            errors.append(y[t] - (level + phi * trend + s))
+        new_level = alpha * (y[t] - s) + (1 - alpha) * (level + phi * trend)
+        trend = beta * (new_level - level) + (1 - beta) * phi * trend
+        season[t % m] = gamma * (y[t] - new_level) + (1 - gamma) * s
+        level = new_level
+
+    return {"level": level, "trend": trend, "season": season, "errors": errors}
+
+
+def scalar_forecast(state, n_days, alpha, sigma, days_ahead, m=7, phi=0.98):
+    forecast, lower, upper = [], [], []
+    damped = 0.0
+    for h in range(1, days_ahead + 1):
+        damped += phi ** h
+        point = max(state["level"] + damped * state["trend"] + state["season"][(n_days + h - 1) % m], 0.0)
+        spread = 1.96 * sigma * np.sqrt(1 + (h - 1) * alpha ** 2)
+        forecast.append(point)
+        lower.append(max(point - spread, 0.0))
+        upper.append(point + spread)
+    return forecast, lower, upper
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(7)
+    days = np.arange(60)
+    weekly = 10 * (days % 7 == 5)
+    return np.vstack([
+        rng.gamma(2, 10, 60) + weekly,
+        np.maximum(50 + 0.5 * days + rng.normal(0, 5, 60), 0),
+        np.where(rng.random(60) < 0.3, rng.gamma(2, 20, 60), 0.0)
+    ])
+
+
+@pytest.mark.parametrize("n_days", [60, 10])
+def test_smooth_matches_scalar_recursion(series, n_days):
+    Y = series[:, :n_days]
+    predictor = ETSPredictor()
+    params = np.array([[0.1, 0.01, 0.2], [0.3, 0.05, 0.1], [0.5, 0.0, 0.3]])
+
+    result = predictor._smooth(Y, params[:, 0], params[:, 1], params[:, 2], keep_errors=True)
+
+    for k, (alpha, beta, gamma) in enumerate(params):
+        expected = scalar_holt_winters(Y[k], alpha, beta, gamma)
+        assert result["level"][k] == pytest.approx(expected["level"])
+        assert result["trend"][k] == pytest.approx(expected["trend"])
+        np.testing.assert_allclose(result["season"][k], expected["season"])
+        np.testing.assert_allclose(result["errors"][k], expected["errors"])
+        assert result["sse"][k] == pytest.approx(sum(e ** 2 for e in expected["errors"]))
+
+
+def test_fit_many_and_forecast_many_match_scalar_search(series):
+    predictor = ETSPredictor()
+    params = predictor.fit_many(series)
+    forecast, lower, upper = predictor.forecast_many(30)
+
+    grid = list(itertools.product(ETSPredictor.ALPHAS, ETSPredictor.BETAS, ETSPredictor.GAMMAS))
+    for k, y in enumerate(series):
+        sse = [sum(e ** 2 for e in scalar_holt_winters(y, *p)["errors"]) for p in grid]
+        alpha, beta, gamma = grid[int(np.argmin(sse))]
+        assert (params["alpha"][k], params["beta"][k], params["gamma"][k]) == (alpha, beta, gamma)
+
+        state = scalar_holt_winters(y, alpha, beta, gamma)
+        sigma = np.sqrt(min(sse) / len(state["errors"]))
+        expected = scalar_forecast(state, len(y), alpha, sigma, 30)
+        np.testing.assert_allclose(forecast[k], expected[0])
+        np.testing.assert_allclose(lower[k], expected[1])
+        np.testing.assert_allclose(upper[k], expected[2])
@@ -0,0 +1,74 @@
+"""The table-based simulation matches a per-category loop over the same draws"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.ml.simulation import MonteCarloSimulator
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def loop_simulation(matrix, model_type, n_paths, seed, days_ahead, threshold):
+    """Paths built one category at a time, with the same random day draws"""
+    simulator = MonteCarloSimulator(model_type, n_paths, seed)
+    forecast, residuals = simulator.fit_baseline(matrix.values.astype(float), days_ahead)
+    forecast = forecast.astype(np.float32)
+    residuals = residuals.astype(np.float32)
+    day_idx = simulator.rng.integers(0, residuals.shape[0], size=(n_paths, days_ahead), dtype=np.int32)
+
+    total_paths = np.zeros((n_paths, days_ahead))
+    categories = []
+    for c in range(matrix.shape[1]):
+        paths = np.maximum(forecast[c] + residuals[:, c][day_idx], 0).astype(np.float64)
+        total_paths += paths
+        totals = paths.sum(axis=1)
+        categories.append((totals.mean(), np.quantile(totals, QUANTILES)))
+
+    cumulative = np.cumsum(total_paths, axis=1)
+    totals = cumulative[:, -1]
+    return {
+        "expected_total": totals.mean(),
+        "quantiles": np.quantile(totals, QUANTILES),
+        "probability_exceed": np.mean(totals > threshold),
+        "categories": categories,
+        "fan": np.quantile(cumulative, QUANTILES, axis=0)
+    }
+
+
+def values(quantiles):
+    return np.array(list(quantiles.values()))
+
+
+@pytest.fixture
+def matrix():
+    rng = np.random.default_rng(11)
+    return pd.DataFrame(
+        rng.gamma(2, 10, (120, 4)) * (rng.random((120, 4)) < 0.6),
+        index=pd.date_range("2024-01-01", periods=120),
+        columns=["food", "transport", "leisure", "health"]
+    )
+
+
+@pytest.mark.parametrize("model_type", ["ets", "linear"])
+@pytest.mark.parametrize("max_table_elements", [2 ** 23, 1000])
+def test_simulate_matches_per_category_loop(monkeypatch, matrix, model_type, max_table_elements):
+    # A small table forces several blocks of days
+    monkeypatch.setattr(MonteCarloSimulator, "MAX_TABLE_ELEMENTS", max_table_elements)
+    threshold = 800.0
+
+    result = MonteCarloSimulator(model_type, 2000, seed=5).simulate(matrix, 30, threshold, QUANTILES)
+    expected = loop_simulation(matrix, model_type, 2000, 5, 30, threshold)
+
+    # The simulation sums in float32, the loop in float64
+    assert result["expected_total"] == pytest.approx(expected["expected_total"], rel=1e-5)
+    np.testing.assert_allclose(values(result["quantiles"]), expected["quantiles"], rtol=1e-5)
+    assert result["probability_exceed"] == pytest.approx(expected["probability_exceed"], abs=1e-3)
+
+    assert [c["category"] for c in result["categories"]] == list(matrix.columns)
+    for category, (mean, quantiles) in zip(result["categories"], expected["categories"]):
+        assert category["expected_total"] == pytest.approx(mean, rel=1e-5)
+        np.testing.assert_allclose(values(category["quantiles"]), quantiles, rtol=1e-5)
+
+    fan = np.array([values(day["quantiles"]) for day in result["daily"]]).T
+    np.testing.assert_allclose(fan, expected["fan"], rtol=1e-5)
+    assert result["daily"][0]["date"] == "2024-04-30"
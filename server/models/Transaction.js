@@ -89,6 +89,8 @@ const TransactionSchema = new mongoose.Schema({
 TransactionSchema.index({ userId: 1, date: -1 });
 TransactionSchema.index({ userId: 1, category: 1 });
 TransactionSchema.index({ userId: 1, type: 1, date: -1 });
+// Atualização incremental do dashboard Streamlit (marca d'água de updatedAt)
+TransactionSchema.index({ updatedAt: 1 });
 
 // Middleware: atualizar updatedAt
 TransactionSchema.pre('save', function (next) {
@@ -96,6 +98,66 @@ TransactionSchema.pre('save', function (next) {
   next();
 });
 
+// Atualizações por query (findByIdAndUpdate, updateOne, updateMany) não
+// passam pelo pre('save'); sem isto o updatedAt não muda numa edição e o
+// dashboard e os totais diários não enxergam a alteração
+TransactionSchema.pre(['findOneAndUpdate', 'updateOne', 'updateMany'], function (next) {
+  this.set({ updatedAt: Date.now() });
+  next();
+});
+
+// Dias (usuário × dia UTC) que perderam ou podem ter perdido transações.
+// A atualização incremental de daily_totals (ml-api/app/daily_totals.py)
+// enxerga inserções e edições pela marca d'água de _id/updatedAt, mas não o
+// dia antigo de uma transação excluída ou que mudou de data; estes dias
+// ficam marcados aqui até a próxima atualização recalculá-los.
+const DIRTY_DAYS_COLLECTION = 'daily_totals_dirty';
+
+async function markDirtyDays(model, filter) {
+  const docs = await model.find(filter, { userId: 1, user: 1, date: 1 }).lean();
+  const markedAt = new Date();
+  const ops = [];
+  for (const doc of docs) {
+    const user = doc.userId || doc.user;
+    if (!user || !doc.date) continue;
+    const day = new Date(Date.UTC(doc.date.getUTCFullYear(), doc.date.getUTCMonth(), doc.date.getUTCDate()));
+    ops.push({
+      updateOne: {
+        filter: { _id: `${user}|${day.toISOString().slice(0, 10)}` },
+        update: { $set: { user, date: day, markedAt } },
+        upsert: true
+      }
+    });
+  }
+  if (ops.length) {
+    await model.db.collection(DIRTY_DAYS_COLLECTION).bulkWrite(ops, { ordered: false });
+  }
+}
+
+// Antes de excluir ou alterar por query, marca o dia atual de cada transação
+// afetada (o novo dia de uma edição entra pela marca d'água). Uma falha ao
+// marcar não impede a operação; o dia é corrigido no próximo --backfill
+TransactionSchema.pre(
+  ['findOneAndDelete', 'deleteOne', 'deleteMany', 'findOneAndUpdate', 'updateOne', 'updateMany'],
+  { document: false, query: true },
+  async function () {
+    try {
+      await markDirtyDays(this.model, this.getFilter());
+    } catch (err) {
+      console.error('❌ Falha ao marcar dias de daily_totals:', err.message);
+    }
+  }
+);
+
+// transaction.deleteOne() (middleware de documento)
+TransactionSchema.pre('deleteOne', { document: true, query: false }, async function () {
+  try {
+    await markDirtyDays(this.constructor, { _id: this._id });
+  } catch (err) {
+    console.error('❌ Falha ao marcar dias de daily_totals:', err.message);
+  }
+});
+
 // Prevenir exposição de dados criptografados
 TransactionSchema.methods.toJSON = function () {
   const obj = this.toObject();
@@ -1,10 +1,21 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from pymongo import MongoClient
+from bson import ObjectId, json_util
 from datetime import datetime, timedelta
 import os
+import hashlib
+import math
+import tempfile
+import threading
+import time
+import uuid
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 
 # Carregar variáveis de ambiente
@@ -51,47 +62,719 @@ def init_connection():
     mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/savemymoney')
     return MongoClient(mongo_uri)
 
-@st.cache_data(ttl=60)
-def load_data():
-    """Carrega transações do MongoDB"""
+# Campos usados pelo dashboard (campos criptografados nunca são lidos).
+# 'count' só existe em daily_totals; nas transações vale 1 por linha
+FIELDS = ['date', 'type', 'category', 'subcategory', 'paymentMethod', 'amount', 'count', 'description', 'updatedAt']
+
+# Coleção lida pelo dashboard: 'transactions' (transações brutas) ou
+# 'daily_totals' (totais diários materializados pela ML API)
+DATA_SOURCE = os.getenv('DASHBOARD_SOURCE', 'transactions')
+ROW_LABEL = 'totais diários' if DATA_SOURCE == 'daily_totals' else 'transações'
+
+# Intervalos da atualização incremental (segundos)
+REFRESH_SECONDS = 60
+RECONCILE_SECONDS = 600
+
+# Snapshots em disco (Arrow IPC) para partidas a frio rápidas
+SNAPSHOT_DIR = os.getenv(
+    'SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.snapshots')
+)
+SNAPSHOT_FORMAT = 2  # incrementar sempre que o esquema de prepare_frame mudar
+SNAPSHOT_MAX_FILES = 64
+
+def user_query(user_id):
+    """Filtro de usuário (registros novos usam userId, antigos usam user)"""
+    if not user_id:
+        return {}
+    user_oid = ObjectId(user_id)
+    return {'$or': [{'userId': user_oid}, {'user': user_oid}]}
+
+def build_query(user_id, types, categories):
+    """
+    Monta a query do MongoDB a partir dos filtros de usuário, tipo e
+    categoria. O período é filtrado em memória (ver FrameIndex), para que
+    trocar de data não recarregue as transações.
+    """
+    conditions = []
+
+    if user_id:
+        conditions.append(user_query(user_id))
+
+    conditions.append({'type': {'$in': list(types)}})
+
+    # Receitas entram sempre; despesas apenas das categorias selecionadas
+    conditions.append({'$or': [
+        {'type': 'income'},
+        {'category': {'$in': list(categories)}}
+    ]})
+
+    return {'$and': conditions}
+
+@st.cache_data(ttl=300)
+def load_users():
+    """Lista os usuários que possuem transações"""
+    client = init_connection()
+    db = client.savemymoney
+    users = set(db[DATA_SOURCE].distinct('userId')) | set(db[DATA_SOURCE].distinct('user'))
+    return sorted(str(u) for u in users if u is not None)
+
+@st.cache_data(ttl=300)
+def load_filter_options(user_id):
+    """Opções dos filtros (tipos, categorias, métodos, datas) sem carregar as transações"""
     client = init_connection()
     db = client.savemymoney
-    transactions = list(db.transactions.find())
+    base = user_query(user_id)
+
+    # Combinações distintas de tipo/categoria/subcategoria/método (poucas linhas)
+    combos = list(db[DATA_SOURCE].aggregate([
+        {'$match': base},
+        {'$group': {'_id': {
+            'type': '$type',
+            'category': '$category',
+            'subcategory': '$subcategory',
+            'paymentMethod': '$paymentMethod'
+        }}},
+        {'$replaceRoot': {'newRoot': '$_id'}}
+    ]))
+    options = pd.DataFrame(combos, columns=['type', 'category', 'subcategory', 'paymentMethod'])
+
+    first = db[DATA_SOURCE].find_one(base, {'date': 1}, sort=[('date', 1)])
+    last = db[DATA_SOURCE].find_one(base, {'date': 1}, sort=[('date', -1)])
+    date_bounds = (
+        (pd.to_datetime(first['date']).date(), pd.to_datetime(last['date']).date())
+        if first and last else None
+    )
+
+    return options, date_bounds
 
+# Colunas de baixa cardinalidade guardadas como categóricas
+CATEGORICAL_COLUMNS = ['type', 'category', 'subcategory', 'paymentMethod']
+ID_DTYPE = 'string[pyarrow]'
+
+def prepare_frame(transactions):
+    """
+    Monta o DataFrame compacto a partir de documentos do MongoDB: categorias
+    como dtype categórico, partes da data como inteiros pequenos e textos em
+    buffers Arrow. Rótulos (nome do mês, dia da semana, mês/ano) são
+    derivados só na hora de desenhar os gráficos.
+    """
     # Converter ObjectId para string e processar dados
     for t in transactions:
         t['_id'] = str(t['_id'])
-        if 'date' in t:
-            t['date'] = pd.to_datetime(t['date'])
-
-    df = pd.DataFrame(transactions)
 
-    if not df.empty:
-        # Adicionar colunas auxiliares
-        df['year'] = df['date'].dt.year
-        df['month'] = df['date'].dt.month
-        df['day'] = df['date'].dt.day
-        df['month_name'] = df['date'].dt.strftime('%B')
-        df['weekday'] = df['date'].dt.day_name()
-        df['quarter'] = df['date'].dt.quarter
+    df = pd.DataFrame(transactions, columns=['_id'] + FIELDS)
+
+    df['_id'] = df['_id'].astype(ID_DTYPE)
+    df['description'] = df['description'].astype(ID_DTYPE)
+    df['amount'] = pd.to_numeric(df['amount']).astype('float64')
+    df['count'] = pd.to_numeric(df['count']).fillna(1).astype('int32')
+    df['date'] = pd.to_datetime(df['date'])
+    df['updatedAt'] = pd.to_datetime(df['updatedAt'])
+    for col in CATEGORICAL_COLUMNS:
+        # object antes de category: colunas sem valores viriam como float
+        df[col] = df[col].astype(object).astype('category')
+
+    # Adicionar colunas auxiliares (inteiros pequenos)
+    df['year'] = df['date'].dt.year.astype('int16')
+    df['month'] = df['date'].dt.month.astype('int8')
+    df['day'] = df['date'].dt.day.astype('int8')
+    df['weekday'] = df['date'].dt.dayofweek.astype('int8')
+    df['quarter'] = df['date'].dt.quarter.astype('int8')
 
-        # Criar coluna de período (mês/ano)
-        df['period'] = df['date'].dt.strftime('%m/%Y')
+    return df
 
+def concat_frames(frames):
+    """Concatena frames compactos mantendo as colunas categóricas"""
+    non_empty = [f for f in frames if not f.empty]
+    if len(non_empty) <= 1:
+        return (non_empty or frames)[0].reset_index(drop=True)
+
+    # Sem categorias em comum o pandas voltaria a usar object
+    frames = non_empty
+    for col in CATEGORICAL_COLUMNS:
+        # Categorias ordenadas: a ordem dos códigos é a ordem alfabética
+        categories = pd.api.types.union_categoricals(
+            [f[col] for f in frames], sort_categories=True
+        ).categories
+        frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+def memory_report(frame):
+    """Uso de memória por coluna (bytes), para o painel de debug"""
+    usage = frame.memory_usage(deep=True, index=True)
+    report = pd.DataFrame({
+        'dtype': [str(frame.index.dtype)] + [str(frame[c].dtype) for c in frame.columns],
+        'KB': (usage / 1024).round(1).values
+    }, index=usage.index)
+    return report, int(usage.sum())
+
+def snapshot_path(query):
+    """Arquivo de snapshot de uma query (nome derivado do hash da query)"""
+    key = json_util.dumps(query, sort_keys=True)
+    digest = hashlib.sha1(f"{SNAPSHOT_FORMAT}:{DATA_SOURCE}:{key}".encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, f"transactions_{digest}.arrow")
+
+def read_snapshot(path):
+    """
+    Lê um snapshot para um frame pandas comum (o to_pandas copia as colunas,
+    então o arquivo é lido de uma vez, sem memory-map); retorna None se não
+    existir ou estiver inválido
+    """
+    try:
+        df = feather.read_table(path).to_pandas()
+    except Exception:
+        return None
+
+    # O Arrow devolve strings como string[python]
+    df['_id'] = df['_id'].astype(ID_DTYPE)
+    df['description'] = df['description'].astype(ID_DTYPE)
     return df
 
+def write_snapshot(path, frame):
+    """Grava o frame preparado de forma atômica (arquivo temporário + rename)"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        feather.write_feather(frame, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        prune_snapshots()
+    except Exception as e:
+        print(f"[SNAPSHOT] Falha ao gravar {path}: {type(e).__name__}: {e}")
+
+def prune_snapshots():
+    """Mantém apenas os SNAPSHOT_MAX_FILES snapshots usados mais recentemente"""
+    files = [
+        os.path.join(SNAPSHOT_DIR, name)
+        for name in os.listdir(SNAPSHOT_DIR)
+        if name.endswith('.arrow')
+    ]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for old in files[SNAPSHOT_MAX_FILES:]:
+        os.remove(old)
+
+def load_data(query, source=None):
+    """
+    Carrega do MongoDB apenas as transações e colunas que atendem à query.
+    Com source='daily_totals' lê os totais diários, que têm os mesmos campos
+    (um documento por dia × tipo × categoria × subcategoria × método).
+    """
+    client = init_connection()
+    db = client.savemymoney
+    return list(db[source or DATA_SOURCE].find(query, {field: 1 for field in FIELDS}))
+
+# Campos comparados na reconciliação (os que os gráficos usam, sem description)
+CONTENT_FIELDS = ['date', 'type', 'category', 'subcategory', 'paymentMethod', 'amount', 'count']
+
+def content_hash(frame):
+    """
+    Hash por linha de CONTENT_FIELDS, igual para o frame preparado e para os
+    documentos crus do MongoDB (valores normalizados antes do hash)
+    """
+    normalized = pd.DataFrame({
+        'date': pd.to_datetime(frame['date']).astype('datetime64[ns]'),
+        'amount': pd.to_numeric(frame['amount']).astype('float64'),
+        'count': pd.to_numeric(frame['count']).fillna(1).astype('int64'),
+        **{col: frame[col].astype(object).where(frame[col].notna(), None).astype(str) for col in CATEGORICAL_COLUMNS}
+    })
+    return pd.util.hash_pandas_object(normalized, index=False).values
+
+def parse_id(value):
+    """_id em texto de volta ao tipo do MongoDB (ObjectId ou chave de daily_totals)"""
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+class TransactionStore:
+    """
+    Transações de uma combinação de filtros, mantidas em memória e
+    atualizadas de forma incremental.
+
+    A cada REFRESH_SECONDS busca apenas documentos com _id ou updatedAt acima
+    da marca d'água e calcula as colunas auxiliares só para eles. A cada
+    RECONCILE_SECONDS compara um hash dos campos usados pelos gráficos
+    (CONTENT_FIELDS) de cada _id no MongoDB com o local, para remover
+    exclusões e recarregar alterações que não moveram a marca (por exemplo,
+    edições feitas sem atualizar updatedAt).
+
+    Cada versão do frame é gravada num snapshot em disco. Um processo novo
+    parte do snapshot e busca apenas o que mudou desde então.
+
+    sync() devolve a versão como "<id do store>-<contador>": os caches
+    (build_cube, get_index, filter_frames) usam essa chave, e um store
+    recriado depois de sair do get_store recomeça o contador com outro id.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.lock = threading.Lock()
+        self.store_id = uuid.uuid4().hex[:12]
+        self.frame = prepare_frame([])
+        self.version = 0
+        self.last_id = None
+        self.watermark = None
+        self.snapshot = snapshot_path(query)
+        self.from_snapshot = False
+
+        now = time.monotonic()
+        snapshot = read_snapshot(self.snapshot)
+
+        if snapshot is not None and not snapshot.empty:
+            # Partida a frio: snapshot + apenas os documentos novos
+            self.frame = snapshot
+            self.last_id = parse_id(snapshot['_id'].max())
+            max_updated = snapshot['updatedAt'].max()
+            self.watermark = max_updated if pd.notna(max_updated) else None
+            self.version = 1
+            self.from_snapshot = True
+            self._fetch_new()
+
+            # Exclusões feitas enquanto o processo estava parado entram na
+            # primeira reconciliação, que fica para depois do primeiro desenho
+            self.reconciled_at = now - RECONCILE_SECONDS + REFRESH_SECONDS
+        else:
+            self._merge(load_data(query))
+            self.reconciled_at = now
+
+        self.refreshed_at = now
+        write_snapshot(self.snapshot, self.frame)
+
+    def sync(self):
+        """Atualiza o frame se os intervalos venceram; retorna (frame, versão)"""
+        with self.lock:
+            now = time.monotonic()
+            version = self.version
+            if now - self.reconciled_at >= RECONCILE_SECONDS:
+                self._reconcile()
+                self.refreshed_at = self.reconciled_at = now
+            elif now - self.refreshed_at >= REFRESH_SECONDS:
+                self._fetch_new()
+                self.refreshed_at = now
+
+            if self.version != version:
+                write_snapshot(self.snapshot, self.frame)
+            return self.frame, f'{self.store_id}-{self.version}'
+
+    def stats(self):
+        """Resumo do estado da atualização (painel de debug)"""
+        return {
+            'linhas': len(self.frame),
+            'versão': f'{self.store_id}-{self.version}',
+            'último _id': str(self.last_id) if self.last_id else None,
+            'marca updatedAt': str(self.watermark) if self.watermark is not None else None,
+            'snapshot': os.path.basename(self.snapshot),
+            'iniciado do snapshot': self.from_snapshot
+        }
+
+    def _fetch_new(self):
+        """Busca apenas documentos novos ou alterados desde a marca d'água"""
+        newer = []
+        if self.last_id is not None:
+            newer.append({'_id': {'$gt': self.last_id}})
+        if self.watermark is not None:
+            newer.append({'updatedAt': {'$gt': self.watermark.to_pydatetime()}})
+
+        query = {'$and': [self.query, {'$or': newer}]} if newer else self.query
+        self._merge(load_data(query))
+
+    def _reconcile(self):
+        """Sincroniza exclusões e alterações comparando _id e o hash do conteúdo"""
+        client = init_connection()
+        db = client.savemymoney
+        remote = pd.DataFrame(
+            list(db[DATA_SOURCE].find(self.query, {field: 1 for field in CONTENT_FIELDS})),
+            columns=['_id'] + CONTENT_FIELDS
+        )
+        remote['_id'] = remote['_id'].astype(str).astype(ID_DTYPE)
+
+        local = pd.DataFrame({'_id': self.frame['_id'], 'hash': content_hash(self.frame)}).merge(
+            pd.DataFrame({'_id': remote['_id'], 'hash': content_hash(remote)}),
+            on='_id', how='outer', suffixes=('_local', ''), indicator=True
+        )
+        deleted = local.loc[local['_merge'] == 'left_only', '_id']
+        changed = local.loc[
+            (local['_merge'] == 'right_only') |
+            ((local['_merge'] == 'both') & (local['hash_local'] != local['hash'])),
+            '_id'
+        ]
+
+        if len(deleted):
+            self.frame = self.frame[~self.frame['_id'].isin(deleted)].reset_index(drop=True)
+            self.version += 1
+
+        if len(changed):
+            self._merge(load_data({'_id': {'$in': [parse_id(i) for i in changed]}}))
+
+    def _merge(self, transactions):
+        """Insere ou substitui (por _id) as linhas dos documentos recebidos"""
+        if not transactions:
+            return
+
+        last_id = max(t['_id'] for t in transactions)
+        if self.last_id is None or last_id > self.last_id:
+            self.last_id = last_id
+
+        new_rows = prepare_frame(transactions)
+        max_updated = new_rows['updatedAt'].max()
+        if pd.notna(max_updated) and (self.watermark is None or max_updated > self.watermark):
+            self.watermark = max_updated
+
+        if self.frame.empty:
+            self.frame = new_rows
+        else:
+            kept = self.frame[~self.frame['_id'].isin(new_rows['_id'])]
+            self.frame = concat_frames([kept, new_rows])
+        self.version += 1
+
+@st.cache_resource(max_entries=32)
+def get_store(user_id, types, categories):
+    """Store incremental de uma combinação de filtros (compartilhado entre sessões)"""
+    return TransactionStore(build_query(user_id, types, categories))
+
+# Dimensões do cubo pré-agregado
+CUBE_DIMENSIONS = ['day', 'type', 'category', 'subcategory', 'paymentMethod']
+
+@st.cache_data(max_entries=64)
+def build_cube(_df, load_args, version):
+    """
+    Cubo pré-agregado (dia × tipo × categoria × subcategoria × método → soma,
+    contagem), montado uma vez por versão dos dados. Todos os gráficos
+    agregados partem dele em vez de reagrupar as transações a cada rerun.
+    """
+    if _df.empty:
+        return pd.DataFrame(columns=CUBE_DIMENSIONS + ['amount', 'count'])
+
+    cube = (
+        _df.assign(day=_df['date'].dt.normalize())
+        .groupby(CUBE_DIMENSIONS, dropna=False, observed=True)
+        .agg(amount=('amount', 'sum'), count=('count', 'sum'))
+        .reset_index()
+    )
+    return cube
+
+def rollup(cube, by):
+    """Soma valores e contagens do cubo pelas dimensões pedidas"""
+    return cube.groupby(by, observed=True)[['amount', 'count']].sum().reset_index()
+
+@st.cache_data(max_entries=32)
+def daily_balances(_cube, state_key):
+    """
+    Receitas, despesas, saldo do dia e saldo acumulado (fim do dia) em um
+    calendário diário contínuo, calculados uma vez por estado de filtros a
+    partir do cubo. Dias sem transações entram com 0.
+    """
+    columns = ['date', 'income', 'expense', 'balance', 'cumulative_balance']
+    if _cube.empty:
+        return pd.DataFrame(columns=columns)
+
+    days = _cube['day'].to_numpy().astype('datetime64[D]')
+    first = days.min()
+    offsets = (days - first).astype(np.int64)
+    n_days = int(offsets.max()) + 1
+
+    amounts = _cube['amount'].to_numpy(dtype=np.float64)
+    is_income = (_cube['type'] == 'income').to_numpy()
+    is_expense = (_cube['type'] == 'expense').to_numpy()
+
+    # Somas por dia em uma passada (bincount), sem groupby/pivot
+    income = np.bincount(offsets, weights=np.where(is_income, amounts, 0.0), minlength=n_days)
+    expense = np.bincount(offsets, weights=np.where(is_expense, amounts, 0.0), minlength=n_days)
+    balance = income - expense
+
+    return pd.DataFrame({
+        'date': pd.date_range(pd.Timestamp(first), periods=n_days, freq='D'),
+        'income': income,
+        'expense': expense,
+        'balance': balance,
+        'cumulative_balance': np.cumsum(balance)
+    }, columns=columns)
+
+# Modo de grandes volumes: orçamento de pontos por gráfico
+POINT_BUDGET_OPTIONS = [1000, 2000, 5000, 10000, 20000, 50000]
+DEFAULT_POINT_BUDGET = 5000
+SCATTER_WEBGL_FACTOR = 10  # WebGL aguenta bem mais pontos que SVG
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: escolhe n_out pontos de uma série
+    ordenada por x preservando a forma visual (picos e vales).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 baldes entre o primeiro e o último ponto, que são sempre mantidos
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        # Área do triângulo (ponto anterior, candidato, média do próximo balde)
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+def minmax_indices(x, y, n_out):
+    """
+    Divide os pontos (ordenados por x) em n_out / 2 baldes de mesmo tamanho
+    e mantém o menor e o maior y de cada um, preservando os extremos.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    buckets = np.arange(n) * (n_out // 2) // n
+    values = pd.Series(y)
+    grouped = values.groupby(buckets)
+    return np.union1d(grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy())
+
+def downsample(frame, x, y, budget, group=None, method='lttb'):
+    """
+    Reduz o frame a no máximo `budget` pontos (dividido igualmente entre os
+    grupos de `group`, em que linhas sem valor formam um grupo próprio),
+    usando LTTB para linhas ou mín/máx para dispersão. Frames dentro do
+    orçamento são devolvidos sem alteração.
+    """
+    if len(frame) <= budget:
+        return frame
+
+    select = lttb_indices if method == 'lttb' else minmax_indices
+    groups = [frame] if group is None else [g for _, g in frame.groupby(group, observed=True, dropna=False)]
+    share = max(budget // max(len(groups), 1), 3)
+
+    parts = []
+    for part in groups:
+        part = part.sort_values(x)
+        xs = part[x].to_numpy()
+        if np.issubdtype(xs.dtype, np.datetime64):
+            xs = xs.astype('datetime64[ns]').astype(np.int64)
+        idx = select(xs.astype(np.float64), part[y].to_numpy(dtype=np.float64), share)
+        parts.append(part.iloc[idx])
+
+    return pd.concat(parts)
+
+def downsample_caption(shown, total):
+    """Aviso exibido quando um gráfico foi reduzido"""
+    if shown < total:
+        st.caption(
+            f"⚡ Modo de grandes volumes: exibindo {shown:,} de {total:,} pontos "
+            f"({shown / total:.1%})"
+        )
+
+# Colunas da tabela de transações e colunas que podem ordenar a tabela
+TABLE_COLUMNS = ['date', 'description', 'type', 'category', 'subcategory', 'amount', 'paymentMethod']
+SORTABLE_COLUMNS = {
+    'Data': 'date',
+    'Valor': 'amount',
+    'Tipo': 'type',
+    'Categoria': 'category',
+    'Subcategoria': 'subcategory',
+    'Método de Pagamento': 'paymentMethod'
+}
+
+@st.cache_data(max_entries=32)
+def sorted_positions(_df, state_key, sort_col, ascending):
+    """
+    Posições do frame ordenadas pela coluna pedida (valores vazios sempre no
+    fim), calculadas uma vez por estado de filtros/dados e ordenação.
+    """
+    values = _df[sort_col]
+    missing = values.isna().to_numpy()
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        keys = values.cat.codes.to_numpy()
+    else:
+        keys = values.to_numpy()
+
+    present = np.flatnonzero(~missing)
+    order = present[np.argsort(keys[present], kind='stable')]
+    if not ascending:
+        order = order[::-1]
+    return np.concatenate([order, np.flatnonzero(missing)])
+
+# Exportação: arquivos gerados sob demanda, em blocos de linhas
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'savemymoney_exports')
+EXPORT_CHUNK_ROWS = 50_000
+EXPORT_MAX_AGE_SECONDS = 3600
+EXPORT_MAX_BYTES = 512 * 1024 * 1024
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet')
+}
+
+def export_rows(frame, order, extension):
+    """
+    Grava as linhas do frame, na ordem dada, num arquivo temporário CSV ou
+    Parquet, um bloco de EXPORT_CHUNK_ROWS linhas por vez. Retorna o caminho.
+    Depois de gravar, limpa as exportações antigas (prune_exports).
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=f'.{extension}', dir=EXPORT_DIR)
+    os.close(fd)
+
+    # Pelo menos um bloco, para que uma exportação vazia ainda tenha cabeçalho
+    starts = range(0, max(len(order), 1), EXPORT_CHUNK_ROWS)
+
+    if extension == 'csv':
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            for start in starts:
+                chunk = frame.iloc[order[start:start + EXPORT_CHUNK_ROWS]][TABLE_COLUMNS]
+                chunk.to_csv(f, header=start == 0, index=False)
+    else:
+        writer = None
+        try:
+            for start in starts:
+                chunk = frame.iloc[order[start:start + EXPORT_CHUNK_ROWS]][TABLE_COLUMNS]
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    prune_exports(keep=path)
+    return path
+
+def prune_exports(keep=None):
+    """
+    Remove exportações com mais de EXPORT_MAX_AGE_SECONDS e, das mais novas
+    para as mais antigas, as que passam de EXPORT_MAX_BYTES no total. O
+    arquivo keep (a exportação recém-gerada) nunca é removido.
+    """
+    files = []
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # removido por outro processo
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    now = time.time()
+    total = 0
+    for mtime, size, path in sorted(files, reverse=True):
+        if path == keep or (now - mtime <= EXPORT_MAX_AGE_SECONDS and total + size <= EXPORT_MAX_BYTES):
+            total += size
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def discard_export(export):
+    """Remove o arquivo de uma exportação anterior, se ainda existir"""
+    if not export:
+        return
+    try:
+        os.remove(export['path'])
+    except FileNotFoundError:
+        pass  # já removido por prune_exports
+
+class FrameIndex:
+    """
+    Índice de um frame para os filtros em memória, montado uma vez por versão
+    dos dados.
+
+    Guarda um bitmap (array NumPy de bool) por valor de cada coluna
+    categórica e as datas como int64 ordenadas. Filtrar vira OR dos bitmaps
+    dos valores escolhidos dentro de uma coluna, AND entre colunas e
+    searchsorted para o período, sem varrer as colunas a cada rerun.
+    """
+
+    def __init__(self, frame, date_col):
+        self.size = len(frame)
+        self.bitmaps = {}
+        for col in CATEGORICAL_COLUMNS:
+            values = frame[col]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object).astype('category')
+            codes = values.cat.codes.to_numpy()
+            self.bitmaps[col] = {
+                value: codes == code
+                for code, value in enumerate(values.cat.categories)
+            }
+
+        dates = frame[date_col].to_numpy().astype('datetime64[ns]').astype(np.int64)
+        self.date_order = np.argsort(dates, kind='stable')
+        self.sorted_dates = dates[self.date_order]
+
+    def mask(self, col, values):
+        """Linhas cujo valor na coluna está entre os escolhidos (OR dos bitmaps)"""
+        result = np.zeros(self.size, dtype=bool)
+        for value in values:
+            bitmap = self.bitmaps[col].get(value)
+            if bitmap is not None:
+                result |= bitmap
+        return result
+
+    def date_positions(self, start_date, end_date):
+        """Posições (em ordem de data) das linhas dentro do período [início, fim]"""
+        if start_date is None or end_date is None:
+            return self.date_order
+
+        bounds = np.array([
+            pd.Timestamp(start_date).value,
+            (pd.Timestamp(end_date) + pd.Timedelta(days=1)).value
+        ], dtype=np.int64)
+        lo, hi = np.searchsorted(self.sorted_dates, bounds, side='left')
+        return self.date_order[lo:hi]
+
+    def select(self, start_date, end_date, subcategories, payment_methods):
+        """
+        Posições que passam pelo período, subcategorias e métodos de pagamento
+        (receitas não são filtradas por subcategoria nem por método)
+        """
+        positions = self.date_positions(start_date, end_date)
+        if not subcategories and not payment_methods:
+            return positions
+
+        income = self.mask('type', ['income'])
+        keep = np.ones(self.size, dtype=bool)
+        if subcategories:
+            keep &= income | self.mask('subcategory', subcategories)
+        if payment_methods:
+            keep &= income | self.mask('paymentMethod', payment_methods)
+        return positions[keep[positions]]
+
+@st.cache_resource(max_entries=64)
+def get_index(_frame, load_args, version, date_col):
+    """Índice de bitmaps de um frame (transações ou cubo) por versão dos dados"""
+    return FrameIndex(_frame, date_col)
+
+@st.cache_resource(max_entries=32)
+def filter_frames(_df, _cube, state_key):
+    """
+    Transações (em ordem de data) e cubo após os filtros em memória,
+    calculados uma vez por estado de filtros/dados a partir dos índices de
+    bitmaps. O resultado é compartilhado sem cópia, por isso quem o usa nunca
+    deve alterá-lo no lugar.
+    """
+    load_args, version, start_date, end_date, subcategories, payment_methods = state_key
+    filters = (start_date, end_date, list(subcategories), list(payment_methods))
+
+    df_index = get_index(_df, load_args, version, 'date')
+    cube_index = get_index(_cube, load_args, version, 'day')
+    return (
+        _df.iloc[df_index.select(*filters)],
+        _cube.iloc[cube_index.select(*filters)]
+    )
+
 # Título principal
 st.title("📊 Gráficos Dinâmicos - SaveMyMoney")
 st.markdown("### Crie visualizações personalizadas dos seus dados financeiros")
 
 # Carregar dados
 try:
-    df = load_data()
-
-    if df.empty:
-        st.warning("⚠️ Nenhuma transação encontrada no banco de dados.")
-        st.stop()
-
     # Sidebar - Filtros
     st.sidebar.header("🔍 Filtros")
 
@@ -101,11 +784,30 @@ try:
 
     st.sidebar.markdown("---")
 
+    # Filtro de Usuário
+    users = load_users()
+    selected_user = st.sidebar.selectbox(
+        "Usuário",
+        options=["Todos"] + users,
+        help="Restringe os dados a um único usuário"
+    )
+    if selected_user == "Todos":
+        selected_user = None
+
+    options, date_bounds = load_filter_options(selected_user)
+
+    if options.empty or date_bounds is None:
+        st.warning("⚠️ Nenhuma transação encontrada no banco de dados.")
+        st.stop()
+
+    min_date, max_date = date_bounds
+
     # Filtro de Tipo de Transação
+    type_options = options['type'].dropna().unique().tolist()
     transaction_types = st.sidebar.multiselect(
         "Tipo de Transação",
-        options=df['type'].unique().tolist(),
-        default=df['type'].unique().tolist(),
+        options=type_options,
+        default=type_options,
         help="Selecione Receita ou Despesa"
     )
 
@@ -114,8 +816,8 @@ try:
         st.sidebar.warning("⚠️ Tipo 'income' não selecionado - Receitas não serão exibidas!")
 
     # Filtro de Categorias
-    income_cats = df[df['type'] == 'income']['category'].dropna().unique().tolist()
-    expense_cats = df[df['type'] == 'expense']['category'].dropna().unique().tolist()
+    income_cats = options[options['type'] == 'income']['category'].dropna().unique().tolist()
+    expense_cats = options[options['type'] == 'expense']['category'].dropna().unique().tolist()
 
     # Mostrar informação sobre categorias disponíveis
     st.sidebar.markdown(f"**Categorias disponíveis:**")
@@ -124,7 +826,7 @@ try:
     if 'expense' in transaction_types and expense_cats:
         st.sidebar.markdown(f"💸 Despesas: {len(expense_cats)} categorias")
 
-    available_categories = df[df['type'].isin(transaction_types)]['category'].dropna().unique().tolist()
+    available_categories = options[options['type'].isin(transaction_types)]['category'].dropna().unique().tolist()
     selected_categories = st.sidebar.multiselect(
         "Categorias",
         options=sorted(available_categories),
@@ -140,9 +842,9 @@ try:
 
     # Filtro de Subcategorias (baseado nas categorias selecionadas)
     if selected_categories:
-        available_subcategories = df[
-            (df['type'].isin(transaction_types)) &
-            (df['category'].isin(selected_categories))
+        available_subcategories = options[
+            (options['type'].isin(transaction_types)) &
+            (options['category'].isin(selected_categories))
         ]['subcategory'].dropna().unique().tolist()
 
         selected_subcategories = st.sidebar.multiselect(
@@ -155,7 +857,7 @@ try:
         selected_subcategories = []
 
     # Filtro de Método de Pagamento
-    payment_methods = df['paymentMethod'].dropna().unique().tolist()
+    payment_methods = options['paymentMethod'].dropna().unique().tolist()
     selected_payment_methods = st.sidebar.multiselect(
         "Método de Pagamento",
         options=sorted(payment_methods),
@@ -172,18 +874,18 @@ try:
         help="Escolha como filtrar as datas"
     )
 
-    # Aplicar filtro de período baseado na seleção
+    # Converter o filtro de período em um intervalo [início, fim] de datas
     if filter_type == "Data Específica":
-        # Usar ontem como padrão (dia anterior)
-        yesterday = datetime.now() - timedelta(days=1)
+        # Usar ontem como padrão (dia anterior), dentro do intervalo disponível
+        yesterday = (datetime.now() - timedelta(days=1)).date()
         selected_date = st.sidebar.date_input(
             "Selecione a Data",
-            value=yesterday,
-            min_value=df['date'].min().date(),
-            max_value=df['date'].max().date(),
+            value=min(max(yesterday, min_date), max_date),
+            min_value=min_date,
+            max_value=max_date,
             format="DD/MM/YYYY"
         )
-        df_filtered = df[df['date'].dt.date == selected_date]
+        start_date, end_date = selected_date, selected_date
 
     elif filter_type == "Mês/Ano":
         col1, col2 = st.sidebar.columns(2)
@@ -196,68 +898,82 @@ try:
         with col2:
             selected_year = st.selectbox(
                 "Ano",
-                options=sorted(df['year'].unique().tolist(), reverse=True)
+                options=list(range(max_date.year, min_date.year - 1, -1))
             )
 
-        df_filtered = df[(df['month'] == selected_month) & (df['year'] == selected_year)]
+        start_date = datetime(selected_year, selected_month, 1).date()
+        end_date = (pd.Timestamp(start_date) + pd.offsets.MonthEnd(0)).date()
 
     elif filter_type == "Intervalo de Datas":
         col1, col2 = st.sidebar.columns(2)
         with col1:
             start_date = st.date_input(
                 "De",
-                value=df['date'].min().date(),
-                min_value=df['date'].min().date(),
-                max_value=df['date'].max().date(),
+                value=min_date,
+                min_value=min_date,
+                max_value=max_date,
                 format="DD/MM/YYYY"
             )
         with col2:
             end_date = st.date_input(
                 "Até",
-                value=df['date'].max().date(),
-                min_value=df['date'].min().date(),
-                max_value=df['date'].max().date(),
+                value=max_date,
+                min_value=min_date,
+                max_value=max_date,
                 format="DD/MM/YYYY"
             )
 
-        df_filtered = df[(df['date'].dt.date >= start_date) & (df['date'].dt.date <= end_date)]
-
     else:  # Todos
-        df_filtered = df.copy()
-
-    # Aplicar demais filtros
-    # Para receitas (income), não aplicar filtro de categoria se ela estiver vazia
-    # Para despesas (expense), aplicar filtro de categoria normalmente
-    mask_type = df_filtered['type'].isin(transaction_types)
-
-    # Criar máscara para categoria: incluir se for receita OU se categoria está na lista
-    mask_category = (
-        (df_filtered['type'] == 'income') |  # Incluir todas as receitas
-        (df_filtered['category'].isin(selected_categories))  # OU categoria selecionada
+        start_date, end_date = None, None
+
+    # Desempenho dos gráficos
+    st.sidebar.subheader("⚡ Desempenho")
+    point_budget = st.sidebar.select_slider(
+        "Pontos por gráfico",
+        options=POINT_BUDGET_OPTIONS,
+        value=DEFAULT_POINT_BUDGET,
+        help="Acima deste número de pontos, linhas são reduzidas (LTTB) e a dispersão usa WebGL"
     )
 
-    df_filtered = df_filtered[mask_type & mask_category]
-
-    # Filtro de subcategoria (apenas se houver seleção)
-    if selected_subcategories:
-        # Para receitas, não aplicar filtro de subcategoria se estiver vazio
-        mask_subcat = (
-            (df_filtered['type'] == 'income') |
-            (df_filtered['subcategory'].isin(selected_subcategories))
-        )
-        df_filtered = df_filtered[mask_subcat]
-
-    # Filtro de método de pagamento
-    if selected_payment_methods:
-        # Para receitas, não aplicar filtro de método de pagamento
-        mask_payment = (
-            (df_filtered['type'] == 'income') |
-            (df_filtered['paymentMethod'].isin(selected_payment_methods))
+    # Buscar no MongoDB apenas o que os filtros de usuário/tipo/categoria selecionam
+    load_args = (
+        selected_user,
+        tuple(transaction_types),
+        tuple(selected_categories)
+    )
+    store = get_store(*load_args)
+    df_filtered, data_version = store.sync()
+    cube = build_cube(df_filtered, load_args, data_version)
+
+    # Painel de debug
+    with st.sidebar.expander("🛠️ Debug"):
+        st.markdown("**Atualização incremental**")
+        st.json(store.stats())
+
+        st.markdown("**Memória**")
+        report, total_bytes = memory_report(df_filtered)
+        _, cube_bytes = memory_report(cube)
+        st.caption(
+            f"Transações: {total_bytes / 1024 ** 2:.2f} MB "
+            f"({total_bytes / max(len(df_filtered), 1):.0f} bytes/linha) · "
+            f"Cubo: {cube_bytes / 1024 ** 2:.2f} MB ({len(cube)} linhas)"
         )
-        df_filtered = df_filtered[mask_payment]
+        st.dataframe(report, use_container_width=True)
+
+    # Aplicar período, subcategoria e método de pagamento em memória (índices
+    # de bitmaps), uma vez por estado de filtros/dados
+    state_key = (
+        load_args,
+        data_version,
+        start_date,
+        end_date,
+        tuple(selected_subcategories),
+        tuple(selected_payment_methods)
+    )
+    df_filtered, cube = filter_frames(df_filtered, cube, state_key)
 
     # Verificar se há dados após filtragem
-    if df_filtered.empty:
+    if cube.empty:
         st.warning("⚠️ Nenhuma transação encontrada com os filtros selecionados.")
         st.stop()
 
@@ -265,16 +981,17 @@ try:
     st.markdown("---")
     col1, col2, col3, col4 = st.columns(4)
 
-    total_income = df_filtered[df_filtered['type'] == 'income']['amount'].sum()
-    total_expense = df_filtered[df_filtered['type'] == 'expense']['amount'].sum()
+    totals_by_type = rollup(cube, 'type').set_index('type')
+    total_income = totals_by_type['amount'].get('income', 0.0)
+    total_expense = totals_by_type['amount'].get('expense', 0.0)
     balance = total_income - total_expense
-    transaction_count = len(df_filtered)
+    transaction_count = int(totals_by_type['count'].sum())
 
     with col1:
-        st.metric("💰 Receitas", f"R$ {total_income:,.2f}", f"{len(df_filtered[df_filtered['type'] == 'income'])} transações")
+        st.metric("💰 Receitas", f"R$ {total_income:,.2f}", f"{int(totals_by_type['count'].get('income', 0))} transações")
 
     with col2:
-        st.metric("💸 Despesas", f"R$ {total_expense:,.2f}", f"{len(df_filtered[df_filtered['type'] == 'expense'])} transações")
+        st.metric("💸 Despesas", f"R$ {total_expense:,.2f}", f"{int(totals_by_type['count'].get('expense', 0))} transações")
 
     with col3:
         delta_color = "normal" if balance >= 0 else "inverse"
@@ -288,314 +1005,393 @@ try:
     # Seção de Gráficos Customizáveis
     st.header("📈 Visualizações Personalizadas")
 
-    # Seletor de tipo de gráfico
-    chart_type = st.selectbox(
-        "Selecione o Tipo de Gráfico",
-        options=[
-            "Barras - Categorias",
-            "Barras - Subcategorias",
-            "Barras - Período (Dia/Mês/Ano)",
-            "Linhas - Evolução Temporal",
-            "Pizza - Distribuição por Categoria",
-            "Pizza - Distribuição por Subcategoria",
-            "Scatter - Valor vs Data",
-            "Funil - Categorias Ordenadas",
-            "Treemap - Hierarquia de Gastos",
-            "Heatmap - Gastos por Dia da Semana/Mês"
-        ],
-        help="Escolha o tipo de visualização"
-    )
-
-    # Gerar gráficos baseado na seleção
-    if "Barras - Categorias" in chart_type:
-        st.subheader("📊 Gastos por Categoria")
+    # Fragmento: controles do gráfico reexecutam só esta seção, sobre os
+    # frames já filtrados da última execução completa
+    @st.fragment
+    def render_charts(df_filtered, cube, state_key, point_budget):
+        # Seletor de tipo de gráfico
+        chart_type = st.selectbox(
+            "Selecione o Tipo de Gráfico",
+            options=[
+                "Barras - Categorias",
+                "Barras - Subcategorias",
+                "Barras - Período (Dia/Mês/Ano)",
+                "Linhas - Evolução Temporal",
+                "Pizza - Distribuição por Categoria",
+                "Pizza - Distribuição por Subcategoria",
+                "Scatter - Valor vs Data",
+                "Funil - Categorias Ordenadas",
+                "Treemap - Hierarquia de Gastos",
+                "Heatmap - Gastos por Dia da Semana/Mês"
+            ],
+            help="Escolha o tipo de visualização"
+        )
 
-        group_by = st.radio("Agrupar por", ["Categoria", "Tipo"], horizontal=True)
+        # Gerar gráficos baseado na seleção
+        if "Barras - Categorias" in chart_type:
+            st.subheader("📊 Gastos por Categoria")
+
+            group_by = st.radio("Agrupar por", ["Categoria", "Tipo"], horizontal=True)
+
+            if group_by == "Categoria":
+                chart_data = rollup(cube, 'category').sort_values('amount', ascending=False)
+                fig = px.bar(
+                    chart_data,
+                    x='category',
+                    y='amount',
+                    title='Total por Categoria',
+                    labels={'category': 'Categoria', 'amount': 'Valor (R$)'},
+                    color='amount',
+                    color_continuous_scale='Turbo'
+                )
+            else:
+                chart_data = rollup(cube, ['category', 'type'])
+                fig = px.bar(
+                    chart_data,
+                    x='category',
+                    y='amount',
+                    color='type',
+                    title='Total por Categoria e Tipo',
+                    labels={'category': 'Categoria', 'amount': 'Valor (R$)', 'type': 'Tipo'},
+                    barmode='group',
+                    color_discrete_map={'income': '#10b981', 'expense': '#ef4444'}
+                )
+
+            fig.update_layout(height=500, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif "Barras - Subcategorias" in chart_type:
+            st.subheader("📊 Gastos por Subcategoria")
+
+            chart_data = rollup(cube, ['category', 'subcategory']).sort_values('amount', ascending=False)
+            chart_data = chart_data.head(20)  # Top 20
 
-        if group_by == "Categoria":
-            chart_data = df_filtered.groupby('category')['amount'].sum().sort_values(ascending=False).reset_index()
             fig = px.bar(
                 chart_data,
-                x='category',
+                x='subcategory',
                 y='amount',
-                title='Total por Categoria',
-                labels={'category': 'Categoria', 'amount': 'Valor (R$)'},
-                color='amount',
-                color_continuous_scale='Turbo'
+                color='category',
+                title='Top 20 Subcategorias',
+                labels={'subcategory': 'Subcategoria', 'amount': 'Valor (R$)', 'category': 'Categoria'},
+                color_discrete_sequence=px.colors.qualitative.Vivid
             )
-        else:
-            chart_data = df_filtered.groupby(['category', 'type'])['amount'].sum().reset_index()
+
+            fig.update_layout(height=500, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
+
+        elif "Barras - Período" in chart_type:
+            st.subheader("📊 Gastos por Período")
+
+            period_type = st.radio("Agrupar por", ["Dia", "Mês", "Ano", "Trimestre"], horizontal=True)
+
+            if period_type == "Dia":
+                chart_data = rollup(cube, 'day')[['day', 'amount']].rename(columns={'day': 'date'})
+                x_label = 'Data'
+            elif period_type == "Mês":
+                chart_data = rollup(cube.assign(month=cube['day'].dt.to_period('M')), 'month')
+                chart_data['period'] = chart_data['month'].dt.strftime('%m/%Y')
+                chart_data = chart_data[['period', 'amount']]
+                x_label = 'Mês/Ano'
+            elif period_type == "Ano":
+                chart_data = rollup(cube.assign(year=cube['day'].dt.year), 'year')[['year', 'amount']]
+                x_label = 'Ano'
+            else:  # Trimestre
+                chart_data = rollup(cube.assign(year=cube['day'].dt.year, quarter=cube['day'].dt.quarter), ['year', 'quarter'])
+                chart_data['period'] = chart_data['year'].astype(str) + '-Q' + chart_data['quarter'].astype(str)
+                chart_data = chart_data[['period', 'amount']]
+                x_label = 'Trimestre'
+
             fig = px.bar(
                 chart_data,
-                x='category',
+                x=chart_data.columns[0],
                 y='amount',
-                color='type',
-                title='Total por Categoria e Tipo',
-                labels={'category': 'Categoria', 'amount': 'Valor (R$)', 'type': 'Tipo'},
-                barmode='group',
-                color_discrete_map={'income': '#10b981', 'expense': '#ef4444'}
+                title=f'Total por {period_type}',
+                labels={chart_data.columns[0]: x_label, 'amount': 'Valor (R$)'},
+                color='amount',
+                color_continuous_scale='Blues'
             )
 
-        fig.update_layout(height=500, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif "Barras - Subcategorias" in chart_type:
-        st.subheader("📊 Gastos por Subcategoria")
-
-        chart_data = df_filtered.groupby(['category', 'subcategory'])['amount'].sum().sort_values(ascending=False).reset_index()
-        chart_data = chart_data.head(20)  # Top 20
-
-        fig = px.bar(
-            chart_data,
-            x='subcategory',
-            y='amount',
-            color='category',
-            title='Top 20 Subcategorias',
-            labels={'subcategory': 'Subcategoria', 'amount': 'Valor (R$)', 'category': 'Categoria'},
-            color_discrete_sequence=px.colors.qualitative.Vivid
-        )
-
-        fig.update_layout(height=500, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif "Barras - Período" in chart_type:
-        st.subheader("📊 Gastos por Período")
-
-        period_type = st.radio("Agrupar por", ["Dia", "Mês", "Ano", "Trimestre"], horizontal=True)
-
-        if period_type == "Dia":
-            chart_data = df_filtered.groupby(df_filtered['date'].dt.date)['amount'].sum().reset_index()
-            chart_data.columns = ['date', 'amount']
-            x_label = 'Data'
-        elif period_type == "Mês":
-            chart_data = df_filtered.groupby('period')['amount'].sum().reset_index()
-            x_label = 'Mês/Ano'
-        elif period_type == "Ano":
-            chart_data = df_filtered.groupby('year')['amount'].sum().reset_index()
-            chart_data.columns = ['year', 'amount']
-            x_label = 'Ano'
-        else:  # Trimestre
-            chart_data = df_filtered.groupby(['year', 'quarter'])['amount'].sum().reset_index()
-            chart_data['period'] = chart_data['year'].astype(str) + '-Q' + chart_data['quarter'].astype(str)
-            chart_data = chart_data[['period', 'amount']]
-            x_label = 'Trimestre'
-
-        fig = px.bar(
-            chart_data,
-            x=chart_data.columns[0],
-            y='amount',
-            title=f'Total por {period_type}',
-            labels={chart_data.columns[0]: x_label, 'amount': 'Valor (R$)'},
-            color='amount',
-            color_continuous_scale='Blues'
-        )
-
-        fig.update_layout(height=500, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif "Linhas - Evolução" in chart_type:
-        st.subheader("📈 Evolução Temporal")
-
-        metric_option = st.radio(
-            "Métrica",
-            ["Saldo Acumulado", "Receitas e Despesas", "Saldo Diário"],
-            horizontal=True
-        )
-
-        df_sorted = df_filtered.sort_values('date')
+            fig.update_layout(height=500, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
 
-        if metric_option == "Saldo Acumulado":
-            df_sorted['cumulative_income'] = df_sorted[df_sorted['type'] == 'income']['amount'].cumsum().fillna(method='ffill').fillna(0)
-            df_sorted['cumulative_expense'] = df_sorted[df_sorted['type'] == 'expense']['amount'].cumsum().fillna(method='ffill').fillna(0)
-            df_sorted['cumulative_balance'] = df_sorted['cumulative_income'] - df_sorted['cumulative_expense']
+        elif "Linhas - Evolução" in chart_type:
+            st.subheader("📈 Evolução Temporal")
 
-            fig = px.line(
-                df_sorted,
-                x='date',
-                y='cumulative_balance',
-                title='Saldo Acumulado ao Longo do Tempo',
-                labels={'date': 'Data', 'cumulative_balance': 'Saldo Acumulado (R$)'},
-                markers=True
-            )
-
-        elif metric_option == "Receitas e Despesas":
-            daily_data = df_filtered.groupby(['date', 'type'])['amount'].sum().reset_index()
-
-            fig = px.line(
-                daily_data,
-                x='date',
-                y='amount',
-                color='type',
-                title='Receitas e Despesas ao Longo do Tempo',
-                labels={'date': 'Data', 'amount': 'Valor (R$)', 'type': 'Tipo'},
-                markers=True,
-                color_discrete_map={'income': '#10b981', 'expense': '#ef4444'}
+            metric_option = st.radio(
+                "Métrica",
+                ["Saldo Acumulado", "Receitas e Despesas", "Saldo Diário"],
+                horizontal=True
             )
 
-        else:  # Saldo Diário
-            daily_income = df_filtered[df_filtered['type'] == 'income'].groupby('date')['amount'].sum()
-            daily_expense = df_filtered[df_filtered['type'] == 'expense'].groupby('date')['amount'].sum()
-            daily_balance = (daily_income - daily_expense).reset_index()
-            daily_balance.columns = ['date', 'balance']
-
-            fig = px.line(
-                daily_balance,
-                x='date',
-                y='balance',
-                title='Saldo Diário',
-                labels={'date': 'Data', 'balance': 'Saldo (R$)'},
-                markers=True
+            if metric_option == "Saldo Acumulado":
+                balances = daily_balances(cube, state_key)
+
+                total_points = len(balances)
+                line_data = downsample(balances, 'date', 'cumulative_balance', point_budget)
+
+                fig = px.line(
+                    line_data,
+                    x='date',
+                    y='cumulative_balance',
+                    title='Saldo Acumulado ao Longo do Tempo',
+                    labels={'date': 'Data', 'cumulative_balance': 'Saldo Acumulado (R$)'},
+                    markers=total_points <= point_budget
+                )
+
+            elif metric_option == "Receitas e Despesas":
+                daily_data = rollup(cube, ['day', 'type'])
+
+                total_points = len(daily_data)
+                line_data = downsample(daily_data, 'day', 'amount', point_budget, group='type')
+
+                fig = px.line(
+                    line_data,
+                    x='day',
+                    y='amount',
+                    color='type',
+                    title='Receitas e Despesas ao Longo do Tempo',
+                    labels={'day': 'Data', 'amount': 'Valor (R$)', 'type': 'Tipo'},
+                    markers=total_points <= point_budget,
+                    color_discrete_map={'income': '#10b981', 'expense': '#ef4444'}
+                )
+
+            else:  # Saldo Diário
+                balances = daily_balances(cube, state_key)
+
+                total_points = len(balances)
+                line_data = downsample(balances, 'date', 'balance', point_budget)
+
+                fig = px.line(
+                    line_data,
+                    x='date',
+                    y='balance',
+                    title='Saldo Diário',
+                    labels={'date': 'Data', 'balance': 'Saldo (R$)'},
+                    markers=total_points <= point_budget
+                )
+
+            fig.update_layout(height=500, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
+            downsample_caption(len(line_data), total_points)
+
+        elif "Pizza - Distribuição por Categoria" in chart_type:
+            st.subheader("🥧 Distribuição por Categoria")
+
+            chart_data = rollup(cube, 'category')
+
+            fig = px.pie(
+                chart_data,
+                values='amount',
+                names='category',
+                title='Distribuição de Gastos por Categoria',
+                hole=0.4,
+                color_discrete_sequence=px.colors.qualitative.Set3
             )
 
-        fig.update_layout(height=500, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif "Pizza - Distribuição por Categoria" in chart_type:
-        st.subheader("🥧 Distribuição por Categoria")
+            fig.update_traces(textposition='inside', textinfo='percent+label')
+            fig.update_layout(height=600, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
 
-        chart_data = df_filtered.groupby('category')['amount'].sum().reset_index()
+        elif "Pizza - Distribuição por Subcategoria" in chart_type:
+            st.subheader("🥧 Distribuição por Subcategoria")
 
-        fig = px.pie(
-            chart_data,
-            values='amount',
-            names='category',
-            title='Distribuição de Gastos por Categoria',
-            hole=0.4,
-            color_discrete_sequence=px.colors.qualitative.Set3
-        )
-
-        fig.update_traces(textposition='inside', textinfo='percent+label')
-        fig.update_layout(height=600, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
-
-    elif "Pizza - Distribuição por Subcategoria" in chart_type:
-        st.subheader("🥧 Distribuição por Subcategoria")
+            chart_data = rollup(cube, 'subcategory').sort_values('amount', ascending=False).head(10)
 
-        chart_data = df_filtered.groupby('subcategory')['amount'].sum().sort_values(ascending=False).head(10).reset_index()
-
-        fig = px.pie(
-            chart_data,
-            values='amount',
-            names='subcategory',
-            title='Top 10 Subcategorias',
-            hole=0.4,
-            color_discrete_sequence=px.colors.qualitative.Pastel
-        )
+            fig = px.pie(
+                chart_data,
+                values='amount',
+                names='subcategory',
+                title='Top 10 Subcategorias',
+                hole=0.4,
+                color_discrete_sequence=px.colors.qualitative.Pastel
+            )
 
-        fig.update_traces(textposition='inside', textinfo='percent+label')
-        fig.update_layout(height=600, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
+            fig.update_traces(textposition='inside', textinfo='percent+label')
+            fig.update_layout(height=600, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
 
-    elif "Scatter - Valor vs Data" in chart_type:
-        st.subheader("🔵 Dispersão: Valor vs Data")
+        elif "Scatter - Valor vs Data" in chart_type:
+            st.subheader("🔵 Dispersão: Valor vs Data")
 
-        color_by = st.radio("Colorir por", ["Tipo", "Categoria", "Método de Pagamento"], horizontal=True)
+            color_by = st.radio("Colorir por", ["Tipo", "Categoria", "Método de Pagamento"], horizontal=True)
 
-        color_map = {
-            "Tipo": ('type', {'income': '#10b981', 'expense': '#ef4444'}),
-            "Categoria": ('category', None),
-            "Método de Pagamento": ('paymentMethod', None)
-        }
+            color_map = {
+                "Tipo": ('type', {'income': '#10b981', 'expense': '#ef4444'}),
+                "Categoria": ('category', None),
+                "Método de Pagamento": ('paymentMethod', None)
+            }
 
-        color_col, color_discrete_map = color_map[color_by]
-
-        fig = px.scatter(
-            df_filtered,
-            x='date',
-            y='amount',
-            color=color_col,
-            size='amount',
-            hover_data=['description', 'category', 'subcategory'],
-            title='Dispersão de Transações',
-            labels={'date': 'Data', 'amount': 'Valor (R$)', color_col: color_by},
-            color_discrete_map=color_discrete_map
-        )
+            color_col, color_discrete_map = color_map[color_by]
 
-        fig.update_layout(height=600, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
+            # Acima do orçamento, WebGL (scattergl); muito acima, reduz mantendo os extremos
+            total_points = len(df_filtered)
+            large_data = total_points > point_budget
+            scatter_data = downsample(
+                df_filtered, 'date', 'amount', point_budget * SCATTER_WEBGL_FACTOR,
+                group=color_col, method='minmax'
+            )
 
-    elif "Funil - Categorias" in chart_type:
-        st.subheader("🔻 Funil de Categorias")
+            fig = px.scatter(
+                scatter_data,
+                x='date',
+                y='amount',
+                color=color_col,
+                size='amount',
+                hover_data=['description', 'category', 'subcategory'],
+                title='Dispersão de Transações',
+                labels={'date': 'Data', 'amount': 'Valor (R$)', color_col: color_by},
+                color_discrete_map=color_discrete_map,
+                render_mode='webgl' if large_data else 'svg'
+            )
 
-        chart_data = df_filtered.groupby('category')['amount'].sum().sort_values(ascending=False).head(10).reset_index()
+            fig.update_layout(height=600, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
+            if large_data:
+                st.caption(f"⚡ Modo de grandes volumes: renderização WebGL ({total_points:,} transações)")
+            downsample_caption(len(scatter_data), total_points)
 
-        fig = go.Figure(go.Funnel(
-            y=chart_data['category'],
-            x=chart_data['amount'],
-            textinfo="value+percent initial",
-            marker={"color": px.colors.sequential.Turbo}
-        ))
+        elif "Funil - Categorias" in chart_type:
+            st.subheader("🔻 Funil de Categorias")
 
-        fig.update_layout(
-            title='Top 10 Categorias - Funil',
-            height=600,
-            template='plotly_dark'
-        )
-        st.plotly_chart(fig, use_container_width=True)
+            chart_data = rollup(cube, 'category').sort_values('amount', ascending=False).head(10)
 
-    elif "Treemap - Hierarquia" in chart_type:
-        st.subheader("🗂️ Hierarquia de Gastos")
+            fig = go.Figure(go.Funnel(
+                y=chart_data['category'],
+                x=chart_data['amount'],
+                textinfo="value+percent initial",
+                marker={"color": px.colors.sequential.Turbo}
+            ))
 
-        chart_data = df_filtered.groupby(['category', 'subcategory'])['amount'].sum().reset_index()
+            fig.update_layout(
+                title='Top 10 Categorias - Funil',
+                height=600,
+                template='plotly_dark'
+            )
+            st.plotly_chart(fig, use_container_width=True)
 
-        fig = px.treemap(
-            chart_data,
-            path=['category', 'subcategory'],
-            values='amount',
-            title='Hierarquia: Categoria → Subcategoria',
-            color='amount',
-            color_continuous_scale='RdYlGn_r'
-        )
+        elif "Treemap - Hierarquia" in chart_type:
+            st.subheader("🗂️ Hierarquia de Gastos")
 
-        fig.update_layout(height=600, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
+            chart_data = rollup(cube, ['category', 'subcategory'])
 
-    elif "Heatmap" in chart_type:
-        st.subheader("🔥 Heatmap de Gastos")
+            fig = px.treemap(
+                chart_data,
+                path=['category', 'subcategory'],
+                values='amount',
+                title='Hierarquia: Categoria → Subcategoria',
+                color='amount',
+                color_continuous_scale='RdYlGn_r'
+            )
 
-        df_filtered['weekday_num'] = df_filtered['date'].dt.dayofweek
-        df_filtered['week'] = df_filtered['date'].dt.isocalendar().week
+            fig.update_layout(height=600, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
 
-        heatmap_data = df_filtered.groupby(['weekday', 'month_name'])['amount'].sum().reset_index()
-        heatmap_pivot = heatmap_data.pivot(index='weekday', columns='month_name', values='amount').fillna(0)
+        elif "Heatmap" in chart_type:
+            st.subheader("🔥 Heatmap de Gastos")
 
-        # Ordenar dias da semana
-        weekday_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        heatmap_pivot = heatmap_pivot.reindex(weekday_order)
+            heatmap_data = rollup(
+                cube.assign(weekday=cube['day'].dt.day_name(), month_name=cube['day'].dt.month_name()),
+                ['weekday', 'month_name']
+            )
+            heatmap_pivot = heatmap_data.pivot(index='weekday', columns='month_name', values='amount').fillna(0)
+
+            # Ordenar dias da semana
+            weekday_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+            heatmap_pivot = heatmap_pivot.reindex(weekday_order)
+
+            fig = px.imshow(
+                heatmap_pivot,
+                title='Gastos por Dia da Semana e Mês',
+                labels={'x': 'Mês', 'y': 'Dia da Semana', 'color': 'Valor (R$)'},
+                color_continuous_scale='YlOrRd',
+                aspect='auto'
+            )
 
-        fig = px.imshow(
-            heatmap_pivot,
-            title='Gastos por Dia da Semana e Mês',
-            labels={'x': 'Mês', 'y': 'Dia da Semana', 'color': 'Valor (R$)'},
-            color_continuous_scale='YlOrRd',
-            aspect='auto'
-        )
+            fig.update_layout(height=500, template='plotly_dark')
+            st.plotly_chart(fig, use_container_width=True)
 
-        fig.update_layout(height=500, template='plotly_dark')
-        st.plotly_chart(fig, use_container_width=True)
+    render_charts(df_filtered, cube, state_key, point_budget)
 
     # Tabela de dados filtrados
-    st.markdown("---")
-    st.subheader("📋 Dados Filtrados")
-
-    if st.checkbox("Mostrar tabela de transações"):
-        display_columns = ['date', 'description', 'type', 'category', 'subcategory', 'amount', 'paymentMethod']
-        display_df = df_filtered[display_columns].sort_values('date', ascending=False)
-
-        st.dataframe(
-            display_df.style.format({'amount': 'R$ {:.2f}'}),
-            use_container_width=True,
-            height=400
-        )
+    @st.fragment
+    def render_table(df_filtered, state_key):
+        st.markdown("---")
+        st.subheader("📋 Dados Filtrados")
+
+        if st.checkbox("Mostrar tabela de transações"):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                sort_label = st.selectbox("Ordenar por", options=list(SORTABLE_COLUMNS))
+            with col2:
+                direction = st.radio("Direção", ["Decrescente", "Crescente"], horizontal=True)
+            with col3:
+                page_size = st.selectbox("Linhas por página", options=[25, 50, 100, 250], index=1)
+
+            total_rows = len(df_filtered)
+            page_count = max(1, math.ceil(total_rows / page_size))
+            with col4:
+                page = st.number_input("Página", min_value=1, max_value=page_count, value=1, step=1)
+
+            # Ordem calculada uma vez por estado; cada rerun só fatia a página
+            order = sorted_positions(df_filtered, state_key, SORTABLE_COLUMNS[sort_label], direction == "Crescente")
+
+            start = (page - 1) * page_size
+            page_df = df_filtered.iloc[order[start:start + page_size]][TABLE_COLUMNS]
+
+            st.caption(
+                f"Mostrando {start + 1 if total_rows else 0}–{min(start + page_size, total_rows)} "
+                f"de {total_rows} {ROW_LABEL} · página {page} de {page_count}"
+            )
+            st.dataframe(
+                page_df,
+                column_config={
+                    'date': st.column_config.DatetimeColumn('Data', format='DD/MM/YYYY HH:mm'),
+                    'description': 'Descrição',
+                    'type': 'Tipo',
+                    'category': 'Categoria',
+                    'subcategory': 'Subcategoria',
+                    'amount': st.column_config.NumberColumn('Valor', format='R$ %.2f'),
+                    'paymentMethod': 'Método de Pagamento'
+                },
+                hide_index=True,
+                use_container_width=True,
+                height=400
+            )
 
-        # Botão de download
-        csv = display_df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 Download CSV",
-            data=csv,
-            file_name=f"transacoes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
+            # Exportação: o arquivo só é gerado quando pedido, e o botão de
+            # download (que lê o arquivo inteiro) só aparece na execução que o
+            # gerou; nas seguintes fica só o aviso de arquivo pronto
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                export_label = st.radio("Formato", list(EXPORT_FORMATS), horizontal=True)
+            extension, mime = EXPORT_FORMATS[export_label]
+            export_key = (state_key, sort_label, direction, extension)
+
+            export = st.session_state.get('export')
+            with col2:
+                if st.button(f"⚙️ Gerar {export_label}"):
+                    discard_export(export)
+                    export = {
+                        'key': export_key,
+                        'path': export_rows(df_filtered, order, extension),
+                        'file_name': f"transacoes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+                    }
+                    st.session_state['export'] = export
+
+                    with open(export['path'], 'rb') as f:
+                        st.download_button(
+                            label=f"📥 Download {export_label}",
+                            data=f,
+                            file_name=export['file_name'],
+                            mime=mime
+                        )
+                elif export and export['key'] == export_key:
+                    st.caption(
+                        f"✅ {export['file_name']} pronto. Para baixar de novo, "
+                        f"gere o arquivo outra vez."
+                    )
+
+    render_table(df_filtered, state_key)
 
 except Exception as e:
     st.error(f"❌ Erro ao carregar dados: {str(e)}")
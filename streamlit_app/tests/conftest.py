@@ -0,0 +1,54 @@
+import ast
+import os
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+
+def load_definitions():
+    """
+    Módulo com os imports, funções, classes e constantes de app.py, sem
+    executar a interface (o app é um script do Streamlit, não um pacote)
+    """
+    with open(APP_PATH, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), APP_PATH)
+
+    body = [
+        node for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef))
+        or (isinstance(node, ast.Assign)
+            and all(isinstance(target, ast.Name) and target.id.isupper() for target in node.targets))
+    ]
+    module = types.ModuleType('dashboard')
+    module.__file__ = APP_PATH
+    exec(compile(ast.Module(body=body, type_ignores=[]), APP_PATH, 'exec'), module.__dict__)
+    return module
+
+
+@pytest.fixture(scope='session')
+def dashboard():
+    return load_definitions()
+
+
+@pytest.fixture
+def frame(dashboard):
+    """Transações sintéticas de 90 dias, com as colunas categóricas de prepare_frame"""
+    rng = np.random.default_rng(3)
+    n = 500
+    types = rng.choice(['income', 'expense'], n, p=[0.2, 0.8])
+    frame = pd.DataFrame({
+        'date': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 90 * 24 * 60, n), unit='min'),
+        'type': types,
+        'category': rng.choice(['Alimentação', 'Transporte', 'Salário'], n),
+        'subcategory': rng.choice(['Mercado', 'Uber', None], n),
+        'paymentMethod': rng.choice(['pix', 'credit_card', 'cash'], n),
+        'amount': rng.gamma(2, 50, n).round(2),
+        'count': np.ones(n, dtype=np.int32)
+    })
+    for col in dashboard.CATEGORICAL_COLUMNS:
+        frame[col] = frame[col].astype('category')
+    return frame
@@ -0,0 +1,26 @@
+"""Série diária de saldos conferida contra o cumsum por transação que ela substituiu"""
+import numpy as np
+import pandas as pd
+
+
+def test_daily_balances_match_transaction_cumsum(dashboard, frame):
+    cube = dashboard.build_cube(frame, ('test', 'daily_balances'), 1)
+    daily = dashboard.daily_balances(cube, ('test', 'daily_balances'))
+
+    # Cálculo substituído: cumsum de receitas menos despesas por transação, em ordem de data
+    ordered = frame.sort_values('date', kind='stable')
+    signed = ordered['amount'].where(ordered['type'] == 'income', -ordered['amount'])
+    end_of_day = signed.cumsum().groupby(ordered['date'].dt.normalize().to_numpy()).last()
+
+    calendar = pd.date_range(end_of_day.index.min(), end_of_day.index.max(), freq='D')
+    assert daily['date'].tolist() == calendar.tolist()
+    np.testing.assert_allclose(
+        daily['cumulative_balance'].to_numpy(),
+        end_of_day.reindex(calendar).ffill().to_numpy()
+    )
+
+    by_day = frame.groupby([frame['date'].dt.normalize(), 'type'], observed=True)['amount'].sum().unstack(fill_value=0.0)
+    by_day = by_day.reindex(calendar, fill_value=0.0)
+    np.testing.assert_allclose(daily['income'].to_numpy(), by_day['income'].to_numpy())
+    np.testing.assert_allclose(daily['expense'].to_numpy(), by_day['expense'].to_numpy())
+    np.testing.assert_allclose(daily['balance'].to_numpy(), (by_day['income'] - by_day['expense']).to_numpy())
@@ -0,0 +1,30 @@
+"""Filtros por bitmaps conferidos contra isin e máscaras de data do pandas"""
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize('start_date, end_date, subcategories, payment_methods', [
+    (None, None, [], []),
+    ('2024-01-15', '2024-02-10', [], []),
+    ('2024-02-01', '2024-02-01', ['Mercado'], []),
+    (None, None, ['Uber', 'Inexistente'], ['pix', 'cash']),
+    ('2024-01-01', '2024-03-31', [], ['credit_card']),
+    ('2025-01-01', '2025-01-31', ['Mercado'], ['pix'])
+])
+def test_select_matches_isin_and_date_masks(dashboard, frame, start_date, end_date, subcategories, payment_methods):
+    index = dashboard.FrameIndex(frame, 'date')
+    positions = index.select(start_date, end_date, subcategories, payment_methods)
+
+    keep = pd.Series(True, index=frame.index)
+    if start_date is not None:
+        day = frame['date'].dt.normalize()
+        keep &= (day >= pd.Timestamp(start_date)) & (day <= pd.Timestamp(end_date))
+    income = frame['type'] == 'income'
+    if subcategories:
+        keep &= income | frame['subcategory'].isin(subcategories)
+    if payment_methods:
+        keep &= income | frame['paymentMethod'].isin(payment_methods)
+    expected = frame[keep].sort_values('date', kind='stable').index.to_numpy()
+
+    np.testing.assert_array_equal(positions, expected)